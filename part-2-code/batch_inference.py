@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Resumable streaming batch inference for arbitrary NL files.
+
+Questions are read line by line, generated in batches and written to the output
+.sql file as they are produced (one query per line, flushed every --flush_every
+batches). After each flush a small JSON checkpoint records how many input lines
+are done and the byte size of the outputs, so a killed job restarts with
+--resume, truncates any partially written tail and continues from the next line.
+The checkpoint also stores the input file's SHA-256 and the batch size; resuming
+with a different input or --batch_size is refused.
+Records are only executed with --records_path (streamed as JSON lines).
+
+Example:
+    python batch_inference.py --experiment_name my_exp --finetune \
+        --input questions.nl --output questions.sql --resume
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+from itertools import islice
+from types import SimpleNamespace
+
+import torch
+from transformers import StoppingCriteriaList
+
+from eval_utils import EndMarkerStoppingCriteria
+from schema_utils import format_enhanced_input, extract_sql_from_output
+from t5_utils import load_model_from_checkpoint, DEVICE
+from tokenizer_registry import get_tokenizer, get_eval_tokenizer
+from utils import compute_records
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Streaming batch text-to-SQL inference')
+    parser.add_argument('--experiment_name', type=str, required=True)
+    parser.add_argument('--finetune', action='store_true')
+    parser.add_argument('--checkpoint_dir', type=str, default=None)
+    parser.add_argument('--input', type=str, required=True, help='NL file, one question per line')
+    parser.add_argument('--output', type=str, required=True, help='SQL file, one query per line')
+    parser.add_argument('--records_path', type=str, default=None,
+                        help='If set, execute each query and stream its records here as JSON lines')
+    parser.add_argument('--checkpoint_path', type=str, default=None,
+                        help='Progress checkpoint (defaults to <output>.progress.json)')
+    parser.add_argument('--resume', action='store_true', help='Continue from the progress checkpoint')
+    parser.add_argument('--batch_size', type=int, default=32)
+    parser.add_argument('--flush_every', type=int, default=10, help='Flush outputs and checkpoint every N batches')
+    parser.add_argument('--num_beams', type=int, default=1)
+    parser.add_argument('--max_gen_length', type=int, default=256)
+    parser.add_argument('--stop_at_end_marker', action='store_true')
+    return parser.parse_args()
+
+
+def load_progress(checkpoint_path):
+    if not os.path.exists(checkpoint_path):
+        return {'lines_done': 0, 'output_bytes': 0, 'records_bytes': 0}
+    with open(checkpoint_path, 'r') as f:
+        return json.load(f)
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def check_resume(progress, input_sha256, batch_size):
+    """Refuse to continue a checkpoint written for another input file or batch size."""
+    if not progress['lines_done']:
+        return
+    if progress.get('input_sha256') != input_sha256:
+        raise SystemExit("Cannot resume: the input file differs from the one the checkpoint was written for "
+                         "(start over without --resume or use another --checkpoint_path)")
+    if progress.get('batch_size') != batch_size:
+        raise SystemExit(f"Cannot resume: the checkpoint was written with --batch_size {progress.get('batch_size')}, "
+                         f"not {batch_size}")
+
+
+def save_progress(checkpoint_path, progress):
+    # Write-then-rename so a kill mid-write never leaves a corrupt checkpoint
+    tmp_path = checkpoint_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(progress, f)
+    os.replace(tmp_path, checkpoint_path)
+
+
+def open_for_resume(path, size):
+    """Open `path` for appending after truncating anything written past the last checkpoint."""
+    f = open(path, 'ab')
+    f.truncate(size)
+    f.seek(size)
+    return f
+
+
+def iter_batches(input_path, batch_size, skip):
+    with open(input_path, 'r') as f:
+        lines = (line.strip() for line in islice(f, skip, None))
+        while True:
+            batch = list(islice(lines, batch_size))
+            if not batch:
+                return
+            yield batch
+
+
+@torch.no_grad()
+def generate_sql(model, tokenizer, questions, num_beams=1, max_gen_length=256, stopping_criteria=None,
+                 decode_tokenizer=None):
+    """Encode with `tokenizer` (the training tokenizer), decode with `decode_tokenizer` (default: `tokenizer`)."""
+    decode_tokenizer = decode_tokenizer or tokenizer
+    inputs = tokenizer(
+        [format_enhanced_input(q) for q in questions],
+        return_tensors="pt", padding=True, truncation=True, max_length=512,
+    ).to(DEVICE)
+    generated_ids = model.generate(
+        input_ids=inputs['input_ids'],
+        attention_mask=inputs['attention_mask'],
+        decoder_start_token_id=tokenizer.pad_token_id,
+        max_length=max_gen_length,
+        num_beams=num_beams,
+        early_stopping=True,
+        pad_token_id=tokenizer.pad_token_id,
+        eos_token_id=tokenizer.eos_token_id,
+        stopping_criteria=stopping_criteria,
+    )
+    return [extract_sql_from_output(decode_tokenizer.decode(ids, skip_special_tokens=True).strip())
+            for ids in generated_ids]
+
+
+def flush_and_checkpoint(sql_file, records_file, checkpoint_path, progress):
+    for f in (sql_file, records_file):
+        if f is not None:
+            f.flush()
+            os.fsync(f.fileno())
+    progress['output_bytes'] = sql_file.tell()
+    progress['records_bytes'] = records_file.tell() if records_file is not None else 0
+    save_progress(checkpoint_path, progress)
+
+
+def main():
+    args = get_args()
+    checkpoint_path = args.checkpoint_path or args.output + '.progress.json'
+    input_sha256 = file_sha256(args.input)
+    if args.resume:
+        progress = load_progress(checkpoint_path)
+        check_resume(progress, input_sha256, args.batch_size)
+    else:
+        progress = {'lines_done': 0, 'output_bytes': 0, 'records_bytes': 0}
+    progress.update(input_sha256=input_sha256, batch_size=args.batch_size)
+    if progress['lines_done']:
+        print(f"Resuming after {progress['lines_done']} lines")
+
+    model_type = 'ft' if args.finetune else 'scr'
+    checkpoint_dir = args.checkpoint_dir or os.path.join('runs', f'{model_type}_experiments',
+                                                         args.experiment_name, 'checkpoints')
+    model = load_model_from_checkpoint(
+        SimpleNamespace(finetune=args.finetune, experiment_name=args.experiment_name, checkpoint_dir=checkpoint_dir),
+        best=True,
+    )
+    model.eval()
+    # Same tokenizers as train_t5 test inference and serve_t5: encode with the training
+    # tokenizer, decode (and find the END marker) with the eval tokenizer
+    tokenizer = get_tokenizer()
+    decode_tokenizer = get_eval_tokenizer()
+    stopping_criteria = None
+    if args.stop_at_end_marker:
+        stopping_criteria = StoppingCriteriaList([EndMarkerStoppingCriteria(decode_tokenizer)])
+
+    sql_file = open_for_resume(args.output, progress['output_bytes'])
+    records_file = None
+    if args.records_path:
+        records_file = open_for_resume(args.records_path, progress['records_bytes'])
+
+    start = time.perf_counter()
+    processed = 0
+    try:
+        for batch_idx, questions in enumerate(iter_batches(args.input, args.batch_size, progress['lines_done'])):
+            sqls = generate_sql(model, tokenizer, questions, args.num_beams, args.max_gen_length, stopping_criteria,
+                                decode_tokenizer)
+            # Queries are single-line by construction; keep the output aligned with the input
+            sql_file.write(''.join(sql.replace('\n', ' ') + '\n' for sql in sqls).encode('utf-8'))
+            if records_file is not None:
+                recs, error_msgs = compute_records(sqls)
+                records_file.write(''.join(
+                    json.dumps({'records': [list(row) for row in rec], 'error': err}, default=str) + '\n'
+                    for rec, err in zip(recs, error_msgs)
+                ).encode('utf-8'))
+
+            progress['lines_done'] += len(questions)
+            processed += len(questions)
+            if (batch_idx + 1) % args.flush_every == 0:
+                flush_and_checkpoint(sql_file, records_file, checkpoint_path, progress)
+                elapsed = time.perf_counter() - start
+                print(f"{progress['lines_done']} lines done ({processed / elapsed:.1f} questions/s)")
+        flush_and_checkpoint(sql_file, records_file, checkpoint_path, progress)
+    finally:
+        sql_file.close()
+        if records_file is not None:
+            records_file.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"Finished: {progress['lines_done']} lines total, {processed} this run in {elapsed:.1f}s")
+    print(f"Saved SQL to {args.output}" + (f" and records to {args.records_path}" if args.records_path else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+fp32 vs bf16 autocast on the training device: train step time (forward, loss,
+backward, AdamW step) on train batches, greedy generation time and record F1 on
+dev, and optionally the final dev record F1 of two runs trained with and
+without train_t5 --bf16.
+"""
+
+import argparse
+import copy
+import time
+from itertools import islice
+from types import SimpleNamespace
+
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader, Subset
+
+from eval_utils import eval_epoch
+from load_data import get_dataloader, PAD_IDX
+from t5_utils import initialize_model, initialize_optimizer, load_model_from_checkpoint, autocast_context, DEVICE
+from tokenizer_registry import get_eval_tokenizer
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='bf16 autocast benchmark')
+    parser.add_argument('--batch_size', type=int, default=16)
+    parser.add_argument('--num_steps', type=int, default=30)
+    parser.add_argument('--warmup_steps', type=int, default=3)
+    parser.add_argument('--dev_batches', type=int, default=10, help='Dev batches for generation timing/F1 (0 = all)')
+    parser.add_argument('--fp32_experiment', type=str, default=None,
+                        help='Fine-tuned experiment trained in fp32 (for final dev record F1)')
+    parser.add_argument('--bf16_experiment', type=str, default=None,
+                        help='Fine-tuned experiment trained with --bf16 (for final dev record F1)')
+    return parser.parse_args()
+
+
+def time_train_steps(model, batches, bf16, warmup_steps):
+    """Mean seconds per optimizer step (after warmup) and the mean token CE loss."""
+    args = SimpleNamespace(weight_decay=0.0, learning_rate=1e-4, optimizer_type='AdamW', bf16=bf16)
+    optimizer = initialize_optimizer(args, model)
+    criterion = nn.CrossEntropyLoss()
+    model.train()
+    secs, losses = [], []
+    for i, (encoder_ids, encoder_mask, decoder_inputs, decoder_targets, _) in enumerate(batches):
+        encoder_ids, encoder_mask = encoder_ids.to(DEVICE), encoder_mask.to(DEVICE)
+        decoder_inputs, decoder_targets = decoder_inputs.to(DEVICE), decoder_targets.to(DEVICE)
+        start = time.perf_counter()
+        optimizer.zero_grad()
+        with autocast_context(bf16):
+            logits = model(input_ids=encoder_ids, attention_mask=encoder_mask,
+                           decoder_input_ids=decoder_inputs)['logits']
+            non_pad = decoder_targets != PAD_IDX
+            loss = criterion(logits[non_pad].float(), decoder_targets[non_pad])
+        loss.backward()
+        optimizer.step()
+        if DEVICE.type == 'cuda':
+            torch.cuda.synchronize()
+        if i >= warmup_steps:
+            secs.append(time.perf_counter() - start)
+            losses.append(loss.item())
+    return sum(secs) / len(secs), sum(losses) / len(losses)
+
+
+def time_generation(model, dev_loader, tokenizer, bf16):
+    model.eval()
+    start = time.perf_counter()
+    with autocast_context(bf16):
+        f1 = eval_epoch(model, dev_loader, tokenizer, DEVICE)
+    return time.perf_counter() - start, f1
+
+
+def main():
+    cli = get_args()
+    tokenizer = get_eval_tokenizer()
+    train_loader = get_dataloader(cli.batch_size, 'train')
+    batches = list(islice(train_loader, cli.warmup_steps + cli.num_steps))
+    dev_loader = get_dataloader(cli.batch_size, 'dev')
+    dev_batches = dev_loader
+    if cli.dev_batches:
+        subset = Subset(dev_loader.dataset, range(min(cli.dev_batches * cli.batch_size, len(dev_loader.dataset))))
+        dev_batches = DataLoader(subset, batch_size=cli.batch_size, collate_fn=dev_loader.collate_fn)
+
+    torch.manual_seed(0)
+    base = initialize_model(SimpleNamespace(finetune=True))
+    print(f"\n{'='*60}")
+    print(f"⚡ Train steps on {DEVICE} (batch {cli.batch_size}, {cli.num_steps} timed steps)")
+    print(f"{'='*60}")
+    results = {}
+    for label, bf16 in (('fp32', False), ('bf16', True)):
+        results[label] = time_train_steps(copy.deepcopy(base), batches, bf16, cli.warmup_steps)
+        print(f"{label}: {results[label][0] * 1000:8.1f} ms/step  mean loss {results[label][1]:.4f}")
+    print(f"Speedup: {results['fp32'][0] / results['bf16'][0]:.2f}x")
+
+    print(f"\n{'='*60}")
+    print(f"⚡ Greedy generation on {len(dev_batches)} dev batches (pretrained weights)")
+    print(f"{'='*60}")
+    for label, bf16 in (('fp32', False), ('bf16', True)):
+        secs, f1 = time_generation(base, dev_batches, tokenizer, bf16)
+        print(f"{label}: {secs:8.2f}s  record F1 {f1:.4f}")
+
+    for label, experiment, bf16 in (('fp32', cli.fp32_experiment, False), ('bf16', cli.bf16_experiment, True)):
+        if experiment:
+            model = load_model_from_checkpoint(SimpleNamespace(finetune=True, experiment_name=experiment), best=True)
+            secs, f1 = time_generation(model, dev_loader, tokenizer, bf16)
+            print(f"Final dev record F1, {label} run {experiment}: {f1:.4f} ({secs:.1f}s)")
+
+
+if __name__ == "__main__":
+    main()
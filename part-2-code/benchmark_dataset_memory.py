@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Compare T5Dataset storage: list of per-example dicts vs packed token buffers.
+
+Each variant runs in a fresh subprocess and reports resident memory of the built
+dataset, peak RSS, pickled size, and the time for DataLoader workers (spawned, so
+the dataset is pickled into each one) to deliver their first batch.
+"""
+
+import argparse
+import json
+import os
+import pickle
+import resource
+import subprocess
+import sys
+import time
+
+import torch
+from torch.utils.data import Dataset, DataLoader
+
+from load_data import load_lines, tokenize_split, normal_collate_fn, PackedSequences, PackedExamples
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Dataset memory and worker spawn benchmark')
+    parser.add_argument('--data_folder', type=str, default='data')
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 100])
+    parser.add_argument('--num_workers', type=int, default=4)
+    parser.add_argument('--batch_size', type=int, default=16)
+    parser.add_argument('--variant', type=str, default=None, choices=['dicts', 'packed'],
+                        help=argparse.SUPPRESS)  # set for the per-variant subprocesses
+    parser.add_argument('--scale', type=int, default=1, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+class ExamplesDataset(Dataset):
+    def __init__(self, data):
+        self.data = data
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, idx):
+        return self.data[idx]
+
+
+def current_rss_mb():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+
+
+def build_dicts(arrays, nl_queries):
+    """The previous representation: three int64 tensors and the NL string per example."""
+    data = []
+    for i, nl_query in enumerate(nl_queries):
+        example = {name: torch.tensor(tokens[offsets[i]:offsets[i + 1]], dtype=torch.long)
+                   for name, (tokens, offsets) in arrays.items()}
+        example['nl_query'] = nl_query
+        example['idx'] = i
+        data.append(example)
+    return data
+
+
+def build_packed(arrays, nl_queries):
+    return PackedExamples({name: PackedSequences(tokens, offsets) for name, (tokens, offsets) in arrays.items()},
+                          nl_queries)
+
+
+def run_variant(args):
+    from transformers import T5TokenizerFast
+    tokenizer = T5TokenizerFast.from_pretrained('google-t5/t5-small')
+    nl_queries = load_lines(os.path.join(args.data_folder, 'train.nl')) * args.scale
+    sql_queries = load_lines(os.path.join(args.data_folder, 'train.sql')) * args.scale
+    arrays = tokenize_split(tokenizer, nl_queries, sql_queries)
+
+    before = current_rss_mb()
+    start = time.perf_counter()
+    data = build_dicts(arrays, nl_queries) if args.variant == 'dicts' else build_packed(arrays, nl_queries)
+    build_secs = time.perf_counter() - start
+    dataset_mb = current_rss_mb() - before
+
+    start = time.perf_counter()
+    pickled = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+    pickle_secs = time.perf_counter() - start
+    pickled_mb = len(pickled) / (1024 * 1024)
+    del pickled
+
+    loader = DataLoader(ExamplesDataset(data), batch_size=args.batch_size, shuffle=True,
+                        collate_fn=normal_collate_fn, num_workers=args.num_workers,
+                        multiprocessing_context='spawn')
+    start = time.perf_counter()
+    next(iter(loader))
+    spawn_secs = time.perf_counter() - start
+
+    print(json.dumps({
+        'examples': len(nl_queries),
+        'dataset_mb': dataset_mb,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'build_secs': build_secs,
+        'pickle_secs': pickle_secs,
+        'pickled_mb': pickled_mb,
+        'spawn_secs': spawn_secs,
+    }))
+
+
+def main():
+    args = get_args()
+    if args.variant is not None:
+        run_variant(args)
+        return
+
+    for scale in args.scales:
+        results = {}
+        for variant in ('dicts', 'packed'):
+            output = subprocess.run(
+                [sys.executable, __file__, '--variant', variant, '--scale', str(scale),
+                 '--data_folder', args.data_folder, '--num_workers', str(args.num_workers),
+                 '--batch_size', str(args.batch_size)],
+                capture_output=True, text=True, check=True,
+            ).stdout
+            results[variant] = json.loads(output.strip().splitlines()[-1])
+
+        print(f"\n{'='*60}")
+        print(f"📊 train x{scale}: {results['packed']['examples']} examples")
+        print(f"{'='*60}")
+        print(f"{'':24}{'dicts':>12}{'packed':>12}")
+        for key, label in [('dataset_mb', 'Dataset RSS (MB)'), ('peak_rss_mb', 'Peak RSS (MB)'),
+                           ('build_secs', 'Build (s)'), ('pickled_mb', 'Pickled size (MB)'),
+                           ('pickle_secs', 'Pickle (s)'), ('spawn_secs', 'Worker spawn (s)')]:
+            print(f"{label:24}{results['dicts'][key]:>12.2f}{results['packed'][key]:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
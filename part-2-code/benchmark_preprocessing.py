@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Benchmark T5 preprocessing: per-example encoding vs batched (and multi-process) encoding
+on train.nl/train.sql and on a replicated corpus
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+import torch
+from transformers import T5TokenizerFast
+
+from load_data import load_lines, tokenize_split, MAX_LENGTH, PARALLEL_MIN_EXAMPLES
+from schema_utils import format_enhanced_input, format_enhanced_target
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Preprocessing wall-time benchmark')
+    parser.add_argument('--data_folder', type=str, default='data')
+    parser.add_argument('--replicate', type=int, default=100, help='Replication factor for the large corpus')
+    parser.add_argument('--num_workers', type=int, default=os.cpu_count())
+    parser.add_argument('--skip_legacy_large', action='store_true',
+                        help='Skip the per-example baseline on the replicated corpus (slow)')
+    return parser.parse_args()
+
+
+def legacy_tokenize(tokenizer, nl_queries, sql_queries):
+    """The previous process_data loop: one encode call and tensor per example."""
+    data = []
+    for nl_query, sql_query in zip(nl_queries, sql_queries):
+        encoder_input = tokenizer.encode(format_enhanced_input(nl_query), return_tensors="pt",
+                                         truncation=True, max_length=MAX_LENGTH).squeeze(0)
+        decoder_target = tokenizer.encode(format_enhanced_target(sql_query), return_tensors="pt",
+                                          truncation=True, max_length=MAX_LENGTH).squeeze(0)
+        decoder_input = torch.cat([torch.tensor([tokenizer.pad_token_id]), decoder_target[:-1]])
+        data.append((encoder_input, decoder_input, decoder_target))
+    return data
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def check_parity(legacy, arrays):
+    for i, example in enumerate(legacy):
+        for name, expected in zip(('encoder_input', 'decoder_input', 'decoder_target'), example):
+            tokens, offsets = arrays[name]
+            if not np.array_equal(tokens[offsets[i]:offsets[i + 1]], expected.numpy()):
+                return False
+    return True
+
+
+def main():
+    args = get_args()
+    tokenizer = T5TokenizerFast.from_pretrained('google-t5/t5-small')
+    nl_queries = load_lines(os.path.join(args.data_folder, 'train.nl'))
+    sql_queries = load_lines(os.path.join(args.data_folder, 'train.sql'))
+    format_enhanced_input("warm up")  # load the schema once outside the timings
+
+    corpora = [('train', nl_queries, sql_queries),
+               (f'train x{args.replicate}', nl_queries * args.replicate, sql_queries * args.replicate)]
+    for label, nl, sql in corpora:
+        print(f"\n{'='*60}")
+        print(f"⏱️  {label}: {len(nl)} examples")
+        print(f"{'='*60}")
+        legacy_secs = None
+        if label == 'train' or not args.skip_legacy_large:
+            legacy, legacy_secs = timed(lambda: legacy_tokenize(tokenizer, nl, sql))
+            print(f"Per-example encode:        {legacy_secs:.2f}s")
+        batched, batched_secs = timed(lambda: tokenize_split(tokenizer, nl, sql, num_workers=1))
+        print(f"Batched (1 process):       {batched_secs:.2f}s")
+        parallel, parallel_secs = timed(lambda: tokenize_split(tokenizer, nl, sql, num_workers=args.num_workers))
+        print(f"Batched ({args.num_workers} processes):      {parallel_secs:.2f}s"
+              + ("" if len(nl) >= PARALLEL_MIN_EXAMPLES else " (below the parallel threshold, runs in-process)"))
+        if legacy_secs is not None:
+            print(f"Speedup vs per-example:    {legacy_secs / batched_secs:.1f}x batched, "
+                  f"{legacy_secs / parallel_secs:.1f}x parallel")
+        if label == 'train':
+            print(f"Identical token ids:       {check_parity(legacy, batched) and check_parity(legacy, parallel)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Cold-start benchmark for the T5 training entry points.
+
+Each measurement runs in a fresh interpreter and reports the wall time from
+process start to: importing load_data, importing train_t5 (the full training
+import graph), building the train/dev/test loaders, and the first training batch.
+It also reports how many tokenizers were actually loaded from disk.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+PROBE = r'''
+import json, sys, time
+start = time.perf_counter()
+import load_data
+t_load_data = time.perf_counter() - start
+import train_t5
+t_train_t5 = time.perf_counter() - start
+import tokenizer_registry
+train_loader, dev_loader, test_loader = load_data.load_t5_data(16, 16)
+t_loaders = time.perf_counter() - start
+next(iter(train_loader))
+t_first_batch = time.perf_counter() - start
+print(json.dumps({"import load_data": t_load_data, "import train_t5": t_train_t5,
+                  "build loaders": t_loaders, "first batch": t_first_batch,
+                  "tokenizers loaded": len(tokenizer_registry._TOKENIZERS),
+                  "modules": len(sys.modules)}))
+'''
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Startup time benchmark')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--offline', action='store_true',
+                        help='Run the probes in strict offline mode (HF_HUB_OFFLINE / TRANSFORMERS_OFFLINE)')
+    return parser.parse_args()
+
+
+def run_probe(offline):
+    env = dict(os.environ)
+    if offline:
+        from tokenizer_registry import OFFLINE_ENV_VARS
+        env.update({var: '1' for var in OFFLINE_ENV_VARS})
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, '-c', PROBE], capture_output=True, text=True, check=True,
+                            env=env, cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    result['process total'] = time.perf_counter() - start
+    return result
+
+
+def main():
+    args = get_args()
+    runs = [run_probe(args.offline) for _ in range(args.repeats)]
+    print(f"\n{'='*60}")
+    print(f"🚀 Cold start, median of {args.repeats} fresh processes{' (offline)' if args.offline else ''}")
+    print(f"{'='*60}")
+    for key in ('import load_data', 'import train_t5', 'build loaders', 'first batch', 'process total'):
+        print(f"{key:24}{statistics.median(run[key] for run in runs):>8.2f}s")
+    print(f"{'tokenizers loaded':24}{runs[-1]['tokenizers loaded']:>8d}")
+    print(f"{'modules imported':24}{runs[-1]['modules']:>8d}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Compare eager PyTorch and onnxruntime (onnx_backend) greedy inference on CPU:
+startup time, per-query latency at batch size 1, and dev record F1 parity
+"""
+
+import argparse
+import os
+import time
+from types import SimpleNamespace
+
+import torch
+
+from load_data import get_dataloader
+from eval_utils import eval_epoch
+from t5_utils import load_model_from_checkpoint
+from tokenizer_registry import get_eval_tokenizer
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Eager PyTorch vs ONNX Runtime CPU inference comparison')
+    parser.add_argument('--experiment_name', type=str, required=True)
+    parser.add_argument('--finetune', action='store_true')
+    parser.add_argument('--onnx_dir', type=str, default=None,
+                        help='Exported graphs (default: <checkpoint_dir>/onnx, exported if missing or stale)')
+    parser.add_argument('--batch_size', type=int, default=16)
+    parser.add_argument('--max_gen_length', type=int, default=256)
+    parser.add_argument('--latency_queries', type=int, default=100,
+                        help='Dev questions timed one at a time (batch size 1)')
+    parser.add_argument('--num_threads', type=int, default=0,
+                        help='torch / onnxruntime CPU threads (0 = library default)')
+    return parser.parse_args()
+
+
+@torch.no_grad()
+def per_query_latency(model, dev_loader, tokenizer, max_gen_length, num_queries):
+    """Milliseconds per greedy `generate` call on single dev questions (p50, mean)"""
+    secs = []
+    for encoder_ids, encoder_mask, _, _, _ in dev_loader:
+        for ids, mask in zip(encoder_ids, encoder_mask):
+            if len(secs) >= num_queries:
+                break
+            length = int(mask.sum())
+            start = time.perf_counter()
+            model.generate(input_ids=ids[None, :length], attention_mask=mask[None, :length],
+                           decoder_start_token_id=tokenizer.pad_token_id, max_length=max_gen_length,
+                           num_beams=1, pad_token_id=tokenizer.pad_token_id, eos_token_id=tokenizer.eos_token_id)
+            secs.append(time.perf_counter() - start)
+    secs.sort()
+    return secs[len(secs) // 2] * 1000, sum(secs) / len(secs) * 1000
+
+
+def evaluate_on_cpu(model, dev_loader, tokenizer, max_gen_length, label):
+    """Run dev evaluation on CPU and return (record F1, seconds, predictions)"""
+    print(f"\n{'='*60}")
+    print(f"⏱️  EVALUATING: {label}")
+    print(f"{'='*60}")
+    start = time.perf_counter()
+    f1, predictions = eval_epoch(
+        model=model,
+        dataloader=dev_loader,
+        tokenizer=tokenizer,
+        device=torch.device('cpu'),
+        generation_max_length=max_gen_length,
+        num_beams=1,
+        return_predictions=True,
+    )
+    return f1, time.perf_counter() - start, predictions
+
+
+def main():
+    args = get_args()
+    if args.num_threads > 0:
+        torch.set_num_threads(args.num_threads)
+
+    tokenizer = get_eval_tokenizer()
+    dev_loader = get_dataloader(batch_size=args.batch_size, split="dev")
+
+    model_type = 'ft' if args.finetune else 'scr'
+    checkpoint_dir = os.path.join('runs', f'{model_type}_experiments', args.experiment_name, 'checkpoints')
+    ckpt_args = SimpleNamespace(finetune=args.finetune, experiment_name=args.experiment_name,
+                                checkpoint_dir=checkpoint_dir)
+
+    start = time.perf_counter()
+    eager_model = load_model_from_checkpoint(ckpt_args, best=True).to('cpu')
+    eager_model.eval()
+    eager_load_secs = time.perf_counter() - start
+
+    from onnx_backend import export_onnx_if_stale, OnnxT5Generator
+    onnx_dir = args.onnx_dir or os.path.join(checkpoint_dir, 'onnx')
+    export_onnx_if_stale(eager_model, onnx_dir)
+    start = time.perf_counter()
+    onnx_model = OnnxT5Generator(onnx_dir, num_threads=args.num_threads)
+    onnx_load_secs = time.perf_counter() - start
+
+    eager_p50, eager_mean = per_query_latency(eager_model, dev_loader, tokenizer, args.max_gen_length,
+                                              args.latency_queries)
+    onnx_p50, onnx_mean = per_query_latency(onnx_model, dev_loader, tokenizer, args.max_gen_length,
+                                            args.latency_queries)
+
+    eager_f1, eager_secs, eager_preds = evaluate_on_cpu(eager_model, dev_loader, tokenizer,
+                                                        args.max_gen_length, "eager PyTorch")
+    onnx_f1, onnx_secs, onnx_preds = evaluate_on_cpu(onnx_model, dev_loader, tokenizer,
+                                                     args.max_gen_length, "ONNX Runtime")
+    n = len(eager_preds)
+    same = sum(a == b for a, b in zip(eager_preds, onnx_preds))
+
+    print(f"\n{'='*60}")
+    print("📊 PARITY AND LATENCY REPORT")
+    print(f"{'='*60}")
+    print(f"Startup eager:       {eager_load_secs:.2f}s (checkpoint load)")
+    print(f"Startup onnx:        {onnx_load_secs:.2f}s (session creation)")
+    print(f"Per-query eager:     p50 {eager_p50:.1f} ms, mean {eager_mean:.1f} ms ({args.latency_queries} queries, batch 1)")
+    print(f"Per-query onnx:      p50 {onnx_p50:.1f} ms, mean {onnx_mean:.1f} ms  (speedup {eager_mean / onnx_mean:.2f}x)")
+    print(f"Dev eval eager:      {eager_secs / n * 1000:.1f} ms/example (batch {args.batch_size})")
+    print(f"Dev eval onnx:       {onnx_secs / n * 1000:.1f} ms/example (batch {args.batch_size})")
+    print(f"Record F1 eager:     {eager_f1:.4f}")
+    print(f"Record F1 onnx:      {onnx_f1:.4f}  (delta {onnx_f1 - eager_f1:+.4f})")
+    print(f"Identical SQL:       {same}/{n}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Compare fp32 and dynamic int8 T5 inference on CPU: record F1 on dev and latency/throughput
+"""
+
+import argparse
+import os
+import time
+from types import SimpleNamespace
+
+import torch
+from transformers import T5TokenizerFast
+
+from load_data import get_dataloader
+from eval_utils import eval_epoch
+from t5_utils import load_model_from_checkpoint, quantize_model_dynamic, save_quantized_model, load_quantized_model
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='fp32 vs int8 CPU inference comparison')
+    parser.add_argument('--experiment_name', type=str, required=True)
+    parser.add_argument('--finetune', action='store_true')
+    parser.add_argument('--batch_size', type=int, default=16)
+    parser.add_argument('--max_gen_length', type=int, default=256)
+    parser.add_argument('--num_threads', type=int, default=0,
+                        help='torch CPU threads (0 = torch default)')
+    return parser.parse_args()
+
+
+def evaluate_on_cpu(model, dev_loader, tokenizer, max_gen_length, label):
+    """Run dev evaluation on CPU and return (record F1, seconds, examples)"""
+    print(f"\n{'='*60}")
+    print(f"⏱️  EVALUATING: {label}")
+    print(f"{'='*60}")
+    start = time.perf_counter()
+    f1, predictions = eval_epoch(
+        model=model,
+        dataloader=dev_loader,
+        tokenizer=tokenizer,
+        device=torch.device('cpu'),
+        generation_max_length=max_gen_length,
+        num_beams=1,
+        return_predictions=True,
+    )
+    elapsed = time.perf_counter() - start
+    return f1, elapsed, len(predictions)
+
+
+def checkpoint_size_mb(path):
+    return os.path.getsize(path) / (1024 * 1024)
+
+
+def main():
+    args = get_args()
+    if args.num_threads > 0:
+        torch.set_num_threads(args.num_threads)
+
+    tokenizer = T5TokenizerFast.from_pretrained('google-t5/t5-small')
+    dev_loader = get_dataloader(batch_size=args.batch_size, split="dev")
+
+    model_type = 'ft' if args.finetune else 'scr'
+    checkpoint_dir = os.path.join('runs', f'{model_type}_experiments', args.experiment_name, 'checkpoints')
+    ckpt_args = SimpleNamespace(finetune=args.finetune, experiment_name=args.experiment_name,
+                                checkpoint_dir=checkpoint_dir)
+
+    fp32_model = load_model_from_checkpoint(ckpt_args, best=True).to('cpu')
+    fp32_f1, fp32_secs, n = evaluate_on_cpu(fp32_model, dev_loader, tokenizer, args.max_gen_length, "fp32")
+
+    # Quantize, save and reload to check the saved artifact round-trips
+    int8_path = save_quantized_model(checkpoint_dir, quantize_model_dynamic(fp32_model), best=True)
+    int8_model = load_quantized_model(int8_path)
+    int8_f1, int8_secs, _ = evaluate_on_cpu(int8_model, dev_loader, tokenizer, args.max_gen_length, "int8 (dynamic)")
+
+    print(f"\n{'='*60}")
+    print("📊 PARITY AND LATENCY REPORT")
+    print(f"{'='*60}")
+    print(f"Examples evaluated:  {n}")
+    print(f"Record F1 fp32:      {fp32_f1:.4f}")
+    print(f"Record F1 int8:      {int8_f1:.4f}  (delta {int8_f1 - fp32_f1:+.4f})")
+    print(f"Latency fp32:        {fp32_secs / n * 1000:.1f} ms/example ({n / fp32_secs:.2f} examples/s)")
+    print(f"Latency int8:        {int8_secs / n * 1000:.1f} ms/example ({n / int8_secs:.2f} examples/s)")
+    print(f"Speedup:             {fp32_secs / int8_secs:.2f}x")
+    print(f"Checkpoint size:     fp32 {checkpoint_size_mb(os.path.join(checkpoint_dir, 'best_model.pt')):.1f} MB, "
+          f"int8 {checkpoint_size_mb(int8_path):.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+"""
+Compiled T5 decoding with a static KV cache.
+
+`model.generate` re-dispatches every decoder op from Python at every step and
+grows the KV cache with torch.cat, so each step has a different shape. This
+module runs greedy decoding with a preallocated self-attention cache of fixed
+length and fixed (batch, encoder length) shape buckets, so one decoder step can
+be compiled with `torch.compile` (or traced with TorchScript as a fallback) and
+reused for every step and every call with the same bucket.
+"""
+
+import time
+from typing import List, Optional
+
+import torch
+import torch.nn as nn
+
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+ENCODER_LENGTH_BUCKET = 32
+
+
+def _bucket(value: int, buckets) -> int:
+    for b in buckets:
+        if value <= b:
+            return b
+    return value
+
+
+def _round_up(value: int, multiple: int) -> int:
+    return ((value + multiple - 1) // multiple) * multiple
+
+
+class StaticCacheT5DecoderStep(nn.Module):
+    """
+    One greedy decoder step of a T5ForConditionalGeneration over a static KV cache.
+
+    The self-attention cache has shape (layers, batch, heads, max_length, d_kv) and is
+    updated in place at `position`; positions after `position` are masked by
+    `self_bias`. Cross-attention keys/values are computed once per generate call.
+    """
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+        self.decoder = model.get_decoder()
+        self.n_heads = model.config.num_heads
+        self.d_kv = model.config.d_kv
+        self.scale_output = model.config.tie_word_embeddings
+        self.model_dim = model.config.d_model
+
+    def _heads(self, states):
+        return states.view(states.shape[0], -1, self.n_heads, self.d_kv).transpose(1, 2)
+
+    def _attend(self, attention, query, key, value, bias):
+        scores = torch.matmul(query, key.transpose(3, 2)) + bias  # T5 does not scale scores
+        weights = torch.softmax(scores.float(), dim=-1).type_as(scores)
+        output = torch.matmul(weights, value).transpose(1, 2).reshape(query.shape[0], -1, self.n_heads * self.d_kv)
+        return attention.o(output)
+
+    def forward(self, input_ids, position, self_k, self_v, cross_k, cross_v, self_bias, cross_bias):
+        hidden = self.decoder.embed_tokens(input_ids)
+        step_bias = self_bias.index_select(2, position)  # (1, heads, 1, max_length)
+
+        for i, block in enumerate(self.decoder.block):
+            layer = block.layer[0]
+            normed = layer.layer_norm(hidden)
+            attention = layer.SelfAttention
+            query = self._heads(attention.q(normed))
+            self_k[i].index_copy_(2, position, self._heads(attention.k(normed)))
+            self_v[i].index_copy_(2, position, self._heads(attention.v(normed)))
+            hidden = hidden + self._attend(attention, query, self_k[i], self_v[i], step_bias)
+
+            layer = block.layer[1]
+            normed = layer.layer_norm(hidden)
+            attention = layer.EncDecAttention
+            query = self._heads(attention.q(normed))
+            hidden = hidden + self._attend(attention, query, cross_k[i], cross_v[i], cross_bias)
+
+            hidden = block.layer[2](hidden)
+
+        hidden = self.decoder.final_layer_norm(hidden)
+        if self.scale_output:
+            hidden = hidden * (self.model_dim ** -0.5)
+        return self.model.lm_head(hidden)[:, -1, :]
+
+
+class CompiledT5Generator:
+    """
+    Drop-in wrapper around a T5 model whose `generate` runs compiled greedy decoding.
+
+    Any other attribute (forward, get_encoder, parameters, ...) is delegated to the
+    wrapped model, so it can be passed wherever eval_utils.eval_epoch expects a model.
+    Beam search falls back to the eager `model.generate`.
+
+    Args:
+        model: T5ForConditionalGeneration (weights may keep training; the step reads them live)
+        max_length: Static cache length (matches --max_gen_length)
+        backend: "compile" (torch.compile, falling back to TorchScript) or "script" (TorchScript only)
+    """
+
+    def __init__(self, model, max_length: int = 256, backend: str = "compile"):
+        self.model = model
+        self.max_length = max_length
+        self.step_module = StaticCacheT5DecoderStep(model)
+        self.backend = backend
+        self._compiled = None
+        self._traced = {}
+
+    def __getattr__(self, name):
+        if name == 'model':
+            raise AttributeError(name)
+        return getattr(self.model, name)
+
+    def __call__(self, *args, **kwargs):
+        return self.model(*args, **kwargs)
+
+    def _step_fn(self, example_inputs):
+        if self.backend == "compile" and self._compiled is None and hasattr(torch, "compile"):
+            try:
+                compiled = torch.compile(self.step_module, dynamic=False)
+                with torch.no_grad():
+                    compiled(*example_inputs)
+                self._compiled = compiled
+            except Exception as e:
+                print(f"torch.compile unavailable ({type(e).__name__}: {e}); falling back to TorchScript")
+                self.backend = "script"
+        if self.backend == "compile" and self._compiled is not None:
+            return self._compiled
+
+        # TorchScript traces are shape-specialized, so keep one per bucket
+        key = (example_inputs[0].shape[0], example_inputs[4].shape[3])
+        if key not in self._traced:
+            with torch.no_grad():
+                self._traced[key] = torch.jit.trace(self.step_module, example_inputs, check_trace=False)
+        return self._traced[key]
+
+    def _self_bias(self, device, dtype):
+        attention = self.model.get_decoder().block[0].layer[0].SelfAttention
+        bias = attention.compute_bias(self.max_length, self.max_length, device=device).to(dtype)
+        causal = torch.ones(self.max_length, self.max_length, dtype=torch.bool, device=device).triu(1)
+        return bias.masked_fill(causal, torch.finfo(dtype).min)
+
+    @torch.no_grad()
+    def generate(self, input_ids, attention_mask, decoder_start_token_id=0, max_length=None,
+                 num_beams=1, pad_token_id=0, eos_token_id=1, logits_processor=None,
+                 stopping_criteria=None, encoder_outputs=None, **kwargs):
+        max_length = min(max_length or self.max_length, self.max_length)
+        if num_beams > 1 or kwargs.get('num_return_sequences', 1) > 1:
+            if encoder_outputs is not None:
+                kwargs['encoder_outputs'] = encoder_outputs
+            return self.model.generate(input_ids=input_ids, attention_mask=attention_mask,
+                                       decoder_start_token_id=decoder_start_token_id, max_length=max_length,
+                                       num_beams=num_beams, pad_token_id=pad_token_id, eos_token_id=eos_token_id,
+                                       logits_processor=logits_processor, stopping_criteria=stopping_criteria,
+                                       **kwargs)
+
+        if torch.is_tensor(decoder_start_token_id):
+            decoder_start_token_id = int(decoder_start_token_id.reshape(-1)[0])
+        device = input_ids.device
+        batch_size, enc_len = input_ids.shape
+
+        # Pad batch and encoder length up to fixed buckets so the compiled step is reused
+        padded_batch = _bucket(batch_size, BATCH_BUCKETS)
+        padded_len = _round_up(enc_len, ENCODER_LENGTH_BUCKET)
+        mask = torch.zeros(padded_batch, padded_len, dtype=attention_mask.dtype, device=device)
+        mask[:batch_size, :enc_len] = attention_mask
+        mask[batch_size:, 0] = 1  # dummy rows attend to one position
+
+        if encoder_outputs is None:
+            ids = torch.full((padded_batch, padded_len), pad_token_id, dtype=input_ids.dtype, device=device)
+            ids[:batch_size, :enc_len] = input_ids
+            hidden = self.model.get_encoder()(input_ids=ids, attention_mask=mask)[0]
+        else:
+            hidden = torch.zeros(padded_batch, padded_len, encoder_outputs[0].shape[-1],
+                                 dtype=encoder_outputs[0].dtype, device=device)
+            hidden[:batch_size, :enc_len] = encoder_outputs[0]
+
+        step = self.step_module
+        dtype = hidden.dtype
+        cross_k = torch.stack([step._heads(block.layer[1].EncDecAttention.k(hidden)) for block in step.decoder.block])
+        cross_v = torch.stack([step._heads(block.layer[1].EncDecAttention.v(hidden)) for block in step.decoder.block])
+        cross_bias = (1.0 - mask[:, None, None, :].to(dtype)) * torch.finfo(dtype).min
+        num_layers = len(step.decoder.block)
+        cache_shape = (num_layers, padded_batch, step.n_heads, self.max_length, step.d_kv)
+        self_k = torch.zeros(cache_shape, dtype=dtype, device=device)
+        self_v = torch.zeros(cache_shape, dtype=dtype, device=device)
+        self_bias = self._self_bias(device, dtype)
+
+        tokens = torch.full((padded_batch, 1), decoder_start_token_id, dtype=torch.long, device=device)
+        sequences = tokens[:batch_size]
+        finished = torch.zeros(batch_size, dtype=torch.bool, device=device)
+        position = torch.zeros(1, dtype=torch.long, device=device)
+
+        step_fn = None
+        for t in range(max_length - 1):
+            position.fill_(t)
+            inputs = (tokens, position, self_k, self_v, cross_k, cross_v, self_bias, cross_bias)
+            if step_fn is None:
+                step_fn = self._step_fn(inputs)
+            logits = step_fn(*inputs)[:batch_size]
+            if logits_processor:
+                logits = logits_processor(sequences, logits)
+            next_tokens = logits.argmax(dim=-1)
+            next_tokens = torch.where(finished, torch.full_like(next_tokens, pad_token_id), next_tokens)
+            sequences = torch.cat([sequences, next_tokens[:, None]], dim=1)
+            finished |= next_tokens == eos_token_id
+            if stopping_criteria:
+                finished |= stopping_criteria(sequences, logits).to(device)
+            if bool(finished.all()):
+                break
+            tokens = torch.full((padded_batch, 1), pad_token_id, dtype=torch.long, device=device)
+            tokens[:batch_size, 0] = next_tokens
+        return sequences
+
+    def warmup(self, batch_sizes: List[int] = (1,), encoder_lengths: List[int] = (ENCODER_LENGTH_BUCKET,),
+               steps: int = 2, device=None):
+        """Compile/trace the decoder step for the given buckets before timing-sensitive work."""
+        device = device or next(self.model.parameters()).device
+        start = time.perf_counter()
+        for batch_size in batch_sizes:
+            for length in encoder_lengths:
+                ids = torch.ones(batch_size, length, dtype=torch.long, device=device)
+                self.generate(ids, torch.ones_like(ids), max_length=steps + 1, eos_token_id=-1)
+        print(f"Compiled decoder warmup ({self.backend}) took {time.perf_counter() - start:.2f}s")
+
+
+_GENERATOR_CACHE = {}
+
+def get_compiled_generator(model, max_length: int = 256, backend: str = "compile",
+                           warmup_batch_sizes: Optional[List[int]] = None) -> CompiledT5Generator:
+    """Reuse one compiled generator per model so repeated evaluations do not recompile."""
+    key = (id(model), max_length, backend)
+    if key not in _GENERATOR_CACHE:
+        generator = CompiledT5Generator(model, max_length=max_length, backend=backend)
+        if warmup_batch_sizes:
+            generator.warmup(batch_sizes=warmup_batch_sizes)
+        _GENERATOR_CACHE[key] = generator
+    return _GENERATOR_CACHE[key]
+
+
+if __name__ == "__main__":
+    # Benchmark compiled static-cache decoding against eager model.generate on CPU
+    import argparse
+    from types import SimpleNamespace
+    from transformers import T5TokenizerFast
+    from load_data import get_dataloader
+    from t5_utils import load_model_from_checkpoint
+
+    parser = argparse.ArgumentParser(description='Benchmark compiled T5 decoding')
+    parser.add_argument('--experiment_name', type=str, required=True)
+    parser.add_argument('--finetune', action='store_true')
+    parser.add_argument('--batch_size', type=int, default=16)
+    parser.add_argument('--max_gen_length', type=int, default=256)
+    parser.add_argument('--num_batches', type=int, default=5)
+    parser.add_argument('--backend', type=str, default='compile', choices=['compile', 'script'])
+    cli = parser.parse_args()
+
+    tokenizer = T5TokenizerFast.from_pretrained('google-t5/t5-small')
+    model = load_model_from_checkpoint(SimpleNamespace(finetune=cli.finetune, experiment_name=cli.experiment_name), best=True)
+    model = model.to('cpu').eval()
+    generator = CompiledT5Generator(model, max_length=cli.max_gen_length, backend=cli.backend)
+    dev_loader = get_dataloader(batch_size=cli.batch_size, split="dev")
+
+    batches = [batch for _, batch in zip(range(cli.num_batches), dev_loader)]
+    generator.warmup(batch_sizes=sorted({b[0].shape[0] for b in batches}),
+                     encoder_lengths=sorted({_round_up(b[0].shape[1], ENCODER_LENGTH_BUCKET) for b in batches}))
+
+    eager_secs, compiled_secs, identical, total = 0.0, 0.0, 0, 0
+    for encoder_ids, encoder_mask, *_ in batches:
+        kwargs = dict(decoder_start_token_id=tokenizer.pad_token_id, max_length=cli.max_gen_length,
+                      pad_token_id=tokenizer.pad_token_id, eos_token_id=tokenizer.eos_token_id)
+        start = time.perf_counter()
+        with torch.no_grad():
+            eager = model.generate(input_ids=encoder_ids, attention_mask=encoder_mask, num_beams=1, **kwargs)
+        eager_secs += time.perf_counter() - start
+        start = time.perf_counter()
+        compiled = generator.generate(encoder_ids, encoder_mask, **kwargs)
+        compiled_secs += time.perf_counter() - start
+
+        for a, b in zip(eager.tolist(), compiled.tolist()):
+            strip = lambda seq: [t for t in seq if t != tokenizer.pad_token_id]
+            identical += int(strip(a) == strip(b))
+            total += 1
+
+    print(f"Identical outputs: {identical}/{total}")
+    print(f"Eager generate:    {eager_secs:.2f}s ({total / eager_secs:.2f} examples/s)")
+    print(f"Compiled ({generator.backend}): {compiled_secs:.2f}s ({total / compiled_secs:.2f} examples/s)")
+    print(f"Speedup: {eager_secs / compiled_secs:.2f}x")
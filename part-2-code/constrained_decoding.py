@@ -0,0 +1,516 @@
+"""
+Schema-constrained decoding for T5 text-to-SQL model.
+
+This module contains a LogitsProcessor that, whenever the decoder is emitting
+an identifier, masks tokens that cannot extend a valid table name, table alias
+or `table_alias.column` reference from the flight database schema.
+"""
+
+import os
+import re
+from typing import Dict, Iterator, List, Optional
+
+import torch
+from transformers import LogitsProcessor
+
+from schema_registry import get_schema_registry
+
+# ATIS queries alias tables as <table>_<n>; the training data uses n <= 6
+MAX_ALIAS_INDEX = 9
+
+# Lowercase words that appear in SQL targets but are not schema identifiers
+LOWERCASE_SQL_WORDS = ('not', 'count', 'min', 'max', 'avg', 'sum')
+
+IDENTIFIER_PREFIX = re.compile(r'[A-Za-z0-9_.]*')
+IDENTIFIER_SUFFIX = re.compile(r'[A-Za-z0-9_.]*$')
+
+
+class IdentifierTrie:
+    """Character trie over valid SQL identifiers."""
+
+    def __init__(self, words=()):
+        self.root = {}
+        self.size = 0
+        for word in words:
+            self.insert(word)
+
+    def insert(self, word: str):
+        node = self.root
+        for ch in word:
+            node = node.setdefault(ch, {})
+        if None not in node:
+            node[None] = True
+            self.size += 1
+
+    def _find(self, prefix: str) -> Optional[dict]:
+        node = self.root
+        for ch in prefix:
+            node = node.get(ch)
+            if node is None:
+                return None
+        return node
+
+    def has_prefix(self, prefix: str) -> bool:
+        return self._find(prefix) is not None
+
+    def contains(self, word: str) -> bool:
+        node = self._find(word)
+        return node is not None and None in node
+
+    def extensions(self, prefix: str, max_len: int) -> Iterator[str]:
+        """Yield every non-empty string s (len <= max_len) such that prefix + s is a trie prefix."""
+        start = self._find(prefix)
+        if start is None:
+            return
+        stack = [(start, '')]
+        while stack:
+            node, suffix = stack.pop()
+            if len(suffix) >= max_len:
+                continue
+            for ch, child in node.items():
+                if ch is None:
+                    continue
+                stack.append((child, suffix + ch))
+                yield suffix + ch
+
+
+def load_schema_for_decoding() -> Dict[str, List[str]]:
+    """
+    Load table -> column names, from the SQLite database if present, otherwise
+    from data/flight_database.schema (shared with input formatting via schema_registry).
+    """
+    return get_schema_registry().column_names()
+
+
+def build_identifier_trie(schema: Dict[str, List[str]], max_alias_index: int = MAX_ALIAS_INDEX) -> IdentifierTrie:
+    """
+    Build a trie of every identifier the decoder may emit: table names,
+    aliases (`city_1`), qualified columns (`city_1.city_code`) and bare columns.
+    """
+    trie = IdentifierTrie(LOWERCASE_SQL_WORDS)
+    for table, columns in schema.items():
+        trie.insert(table)
+        for col in columns:
+            trie.insert(col)
+        for n in range(1, max_alias_index + 1):
+            alias = f"{table}_{n}"
+            trie.insert(alias)
+            for col in columns:
+                trie.insert(f"{alias}.{col}")
+    return trie
+
+
+def token_pieces(tokenizer) -> List[str]:
+    """Surface text of every token id (SentencePiece '▁' as a space, special tokens as '')."""
+    special_ids = set(tokenizer.all_special_ids)
+    pieces = tokenizer.convert_ids_to_tokens(list(range(len(tokenizer))))
+    return ['' if i in special_ids else piece.replace('▁', ' ') for i, piece in enumerate(pieces)]
+
+
+class SchemaConstrainedLogitsProcessor(LogitsProcessor):
+    """
+    Mask tokens that cannot continue a valid schema identifier.
+
+    The decoded prefix of each hypothesis is inspected at every step. Outside
+    string literals, a word that starts with a lowercase letter is treated as an
+    identifier and may only be extended along the identifier trie; it may only be
+    terminated (by whitespace or punctuation) once it is a complete identifier.
+    Uppercase words (SQL keywords), numbers and quoted literals are unconstrained.
+    Masks depend only on the current partial identifier, so they are cached.
+    """
+
+    def __init__(self, tokenizer, schema: Optional[Dict[str, List[str]]] = None,
+                 max_alias_index: int = MAX_ALIAS_INDEX):
+        self.trie = build_identifier_trie(schema or load_schema_for_decoding(), max_alias_index)
+
+        vocab_size = len(tokenizer)
+        special_ids = set(tokenizer.all_special_ids)
+        self.pieces = token_pieces(tokenizer)
+        self.vocab_size = vocab_size
+
+        # Per-token split: leading space, identifier characters, remaining characters
+        self.special = torch.zeros(vocab_size, dtype=torch.bool)
+        self.lead_space = torch.zeros(vocab_size, dtype=torch.bool)
+        self.start_ok = torch.ones(vocab_size, dtype=torch.bool)
+        self.open_by_ident = {}    # token is all identifier chars: may keep extending
+        self.closed_by_ident = {}  # token ends the identifier with punctuation
+        self.max_piece_len = 1
+
+        for i, piece in enumerate(self.pieces):
+            if i in special_ids:
+                self.special[i] = True
+                continue
+            lead = piece.startswith(' ')
+            body = piece.lstrip(' ') if lead else piece
+            ident = IDENTIFIER_PREFIX.match(body).group(0)
+            rest = body[len(ident):]
+            self.max_piece_len = max(self.max_piece_len, len(ident))
+            self.lead_space[i] = lead
+
+            if ident and ident[0].islower():
+                self.start_ok[i] = self.trie.contains(ident) if rest else self.trie.has_prefix(ident)
+
+            if not lead:
+                table = self.closed_by_ident if rest else self.open_by_ident
+                table.setdefault(ident, []).append(i)
+
+        self.start_ok |= self.special
+        self._unconstrained_keyword = (~self.lead_space) | self.start_ok
+        self._mask_cache = {}
+        self._scores_mask_cache = {}
+
+    def _identifier_mask(self, word: str) -> torch.Tensor:
+        allowed = self.special.clone()
+        complete = self.trie.contains(word)
+        ids = []
+        for suffix in self.trie.extensions(word, self.max_piece_len):
+            ids.extend(self.open_by_ident.get(suffix, ()))
+            if self.trie.contains(word + suffix):
+                ids.extend(self.closed_by_ident.get(suffix, ()))
+        if complete:
+            ids.extend(self.closed_by_ident.get('', ()))
+            allowed |= self.lead_space & self.start_ok
+        if ids:
+            allowed[torch.tensor(ids, dtype=torch.long)] = True
+        return allowed
+
+    def _state_key(self, token_ids: List[int]) -> Optional[str]:
+        """Return the current partial identifier ('' at a word boundary), '<keyword>', or None if unconstrained."""
+        text = ''.join(self.pieces[t] for t in token_ids if t < self.vocab_size)
+        if text.count("'") % 2 == 1:
+            return None  # inside a string literal
+
+        word = IDENTIFIER_SUFFIX.search(text).group(0)
+        if word and not word[0].islower():
+            return '<keyword>'
+        return word
+
+    def allowed_tokens(self, token_ids: List[int]) -> Optional[torch.Tensor]:
+        """Return a bool mask over the tokenizer vocabulary, or None if unconstrained."""
+        key = self._state_key(token_ids)
+        if key is None:
+            return None
+        mask = self._mask_cache.get(key)
+        if mask is None:
+            if key == '<keyword>':
+                mask = self._unconstrained_keyword
+            elif key == '':
+                mask = self.start_ok
+            else:
+                mask = self._identifier_mask(key)
+            self._mask_cache[key] = mask
+        return mask
+
+    def _scores_mask(self, key: str, token_ids: List[int], size: int, device) -> Optional[torch.Tensor]:
+        # Masks padded to the model vocab (which may exceed the tokenizer) and moved to device, cached per key
+        cache_key = (key, size, str(device))
+        if cache_key not in self._scores_mask_cache:
+            mask = torch.ones(size, dtype=torch.bool)
+            n = min(self.vocab_size, size)
+            mask[:n] = self.allowed_tokens(token_ids)[:n]
+            # Never leave a hypothesis without any allowed token
+            self._scores_mask_cache[cache_key] = mask.to(device) if mask.any() else None
+        return self._scores_mask_cache[cache_key]
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        for row, token_ids in enumerate(input_ids.tolist()):
+            key = self._state_key(token_ids)
+            if key is None:
+                continue
+            mask = self._scores_mask(key, token_ids, scores.shape[-1], scores.device)
+            if mask is None:
+                continue
+            scores[row] = scores[row].masked_fill(~mask, float('-inf'))
+        return scores
+
+
+# Clause keywords in the order they may appear within one query level
+CLAUSE_RANK = {'SELECT': 1, 'FROM': 2, 'WHERE': 3, 'GROUP': 4, 'HAVING': 5, 'ORDER': 6}
+SET_OPERATORS = ('UNION', 'INTERSECT', 'EXCEPT')
+END_MARKER = 'END'
+
+SQL_TOKEN = re.compile(r"'[^']*'?|[A-Za-z0-9_]+(?:\.[A-Za-z0-9_]*)?|\S")
+
+
+class SQLPrefixState:
+    """
+    Incremental validator state for a partial SQL query.
+
+    Text is fed in arbitrary chunks (e.g. one decoder token at a time); only
+    complete SQL tokens are consumed, the trailing partial token is buffered.
+    Tracks parentheses balance, clause order per query level, aliases declared
+    in FROM and the aliases referenced elsewhere. Once `dead` is set the prefix
+    can no longer become a valid query.
+    """
+
+    def __init__(self):
+        self.pending = ''
+        self.levels = [self._new_level(is_query=True)]
+        self.dead = False
+        self.reason = ''
+        self.finished = False
+
+    @staticmethod
+    def _new_level(is_query=False):
+        return {'is_query': is_query, 'clause': None, 'aliases': set(),
+                'select_refs': [], 'prev_ident': False}
+
+    def copy(self) -> 'SQLPrefixState':
+        other = SQLPrefixState.__new__(SQLPrefixState)
+        other.pending = self.pending
+        other.levels = [dict(level, aliases=set(level['aliases']), select_refs=list(level['select_refs']))
+                        for level in self.levels]
+        other.dead = self.dead
+        other.reason = self.reason
+        other.finished = self.finished
+        return other
+
+    def _kill(self, reason):
+        self.dead = True
+        self.reason = reason
+
+    def _query_level(self):
+        for level in reversed(self.levels):
+            if level['is_query']:
+                return level
+        return self.levels[0]
+
+    def _in_scope(self, alias):
+        return any(alias in level['aliases'] for level in self.levels)
+
+    def _check_select_refs(self, level):
+        for alias in level['select_refs']:
+            if not self._in_scope(alias):
+                self._kill(f"alias '{alias}' used in SELECT but not declared in FROM")
+                return
+        level['select_refs'] = []
+
+    def feed(self, text: str) -> 'SQLPrefixState':
+        if self.dead or self.finished:
+            return self
+        self.pending += text
+        matches = list(SQL_TOKEN.finditer(self.pending))
+        consumed = 0
+        for match in matches:
+            token = match.group(0)
+            # The last token may still grow (or a literal may still be open)
+            at_end = match.end() == len(self.pending)
+            if at_end and (not token.startswith("'") or len(token) == 1 or not token.endswith("'")):
+                break
+            self._consume(token)
+            consumed = match.end()
+            if self.dead or self.finished:
+                break
+        self.pending = self.pending[consumed:]
+        return self
+
+    def close(self) -> 'SQLPrefixState':
+        """Consume any buffered token and apply end-of-query checks."""
+        if self.pending and not self.dead and not self.finished:
+            for match in SQL_TOKEN.finditer(self.pending):
+                self._consume(match.group(0))
+                if self.dead or self.finished:
+                    break
+            self.pending = ''
+        if self.dead:
+            return self
+        if len(self.levels) > 1:
+            self._kill("unbalanced parentheses")
+        elif (self.levels[0]['clause'] or 'SELECT') == 'SELECT':
+            self._kill("query has no FROM clause")
+        else:
+            self._check_select_refs(self.levels[0])
+        return self
+
+    def _consume(self, token: str):
+        upper = token.upper()
+        level = self.levels[-1]
+
+        if token == END_MARKER:
+            self.finished = True
+            return
+        if token.startswith("'"):
+            level['prev_ident'] = False
+            return
+        if token == '(':
+            self.levels.append(self._new_level())
+            return
+        if token == ')':
+            if len(self.levels) == 1:
+                self._kill("unbalanced parentheses")
+                return
+            closed = self.levels.pop()
+            if closed['is_query']:
+                if (closed['clause'] or 'SELECT') == 'SELECT':
+                    self._kill("subquery has no FROM clause")
+                    return
+                self._check_select_refs(closed)
+            self.levels[-1]['prev_ident'] = False
+            return
+
+        if upper in SET_OPERATORS:
+            query = self._query_level()
+            query['clause'] = None
+            query['aliases'] = set()
+            return
+
+        if upper in CLAUSE_RANK:
+            level['prev_ident'] = False
+            if upper == 'SELECT' and not level['is_query'] and level['clause'] is None:
+                level['is_query'] = True
+            query = self._query_level()
+            current = query['clause']
+            current_rank = CLAUSE_RANK[current] if current else 0
+            rank = CLAUSE_RANK[upper]
+            if rank <= current_rank:
+                self._kill(f"{upper} after {current}")
+            elif upper == 'FROM' and current != 'SELECT':
+                self._kill("FROM without SELECT")
+            elif upper != 'SELECT' and upper != 'FROM' and current_rank < CLAUSE_RANK['FROM']:
+                self._kill(f"{upper} before FROM")
+            elif upper == 'HAVING' and current != 'GROUP':
+                self._kill("HAVING without GROUP BY")
+            else:
+                query['clause'] = upper
+                if rank > CLAUSE_RANK['FROM']:
+                    self._check_select_refs(query)
+            return
+
+        if not (token[0].isalpha() or token[0] == '_') or token[0].isupper():
+            # Keywords, numbers, operators and punctuation
+            level['prev_ident'] = False
+            return
+
+        query = self._query_level()
+        clause = query['clause']
+        if clause == 'FROM' and '.' not in token:
+            # "table alias" pairs: both the table name and the alias may qualify columns
+            query['aliases'].add(token)
+            level['prev_ident'] = True
+            return
+        level['prev_ident'] = False
+
+        if '.' in token:
+            alias = token.split('.', 1)[0]
+            if clause == 'SELECT':
+                query['select_refs'].append(alias)
+            elif not self._in_scope(alias):
+                self._kill(f"alias '{alias}' used in {clause} but not declared in FROM")
+
+
+def validate_sql_prefix(sql: str, complete: bool = False) -> SQLPrefixState:
+    """
+    Validate a (partial) SQL string.
+    
+    Args:
+        sql: SQL prefix or full query
+        complete: If True, also apply end-of-query checks (balanced parentheses, FROM present)
+    
+    Returns:
+        SQLPrefixState; `dead` is True if the query can no longer become valid
+    """
+    state = SQLPrefixState().feed(sql)
+    if complete:
+        state.close()
+    return state
+
+
+class SQLPrefixValidatorLogitsProcessor(LogitsProcessor):
+    """
+    Prune hypotheses whose SQL prefix can no longer become a valid query.
+
+    Each hypothesis keeps an incremental SQLPrefixState, looked up from its parent
+    prefix and advanced by the newest token only. Dead hypotheses either get all
+    scores set to -inf (beam search: the beam slot goes to a live hypothesis) or,
+    with `stop_dead`, are forced to emit EOS (greedy: stop decoding a doomed row).
+    """
+
+    def __init__(self, tokenizer, stop_dead: bool = False):
+        self.pieces = token_pieces(tokenizer)
+        self.vocab_size = len(self.pieces)
+        self.eos_token_id = tokenizer.eos_token_id
+        self.stop_dead = stop_dead
+        self.stats = {'hypotheses': 0, 'pruned': 0}
+        self._states = {}
+        self._last_len = 0
+
+    def _piece(self, token_id):
+        return self.pieces[token_id] if token_id < self.vocab_size else ''
+
+    def _state_for(self, token_ids: tuple) -> SQLPrefixState:
+        parent = self._states.get(token_ids[:-1])
+        if parent is None:
+            state = SQLPrefixState().feed(''.join(self._piece(t) for t in token_ids))
+        else:
+            state = parent.copy().feed(self._piece(token_ids[-1])) if not parent.dead else parent
+        return state
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        cur_len = input_ids.shape[-1]
+        if cur_len <= self._last_len:
+            self._states = {}  # new generate() call
+        self._last_len = cur_len
+
+        states = {}
+        for row, token_ids in enumerate(map(tuple, input_ids.tolist())):
+            state = states.get(token_ids) or self._state_for(token_ids)
+            states[token_ids] = state
+            self.stats['hypotheses'] += 1
+            if not state.dead:
+                continue
+            parent = self._states.get(token_ids[:-1])
+            if parent is None or not parent.dead:
+                self.stats['pruned'] += 1
+            if self.stop_dead and self.eos_token_id is not None:
+                eos_score = scores[row, self.eos_token_id].clone()
+                scores[row] = float('-inf')
+                scores[row, self.eos_token_id] = eos_score
+            else:
+                scores[row] = float('-inf')
+        self._states = states
+        return scores
+
+
+if __name__ == "__main__":
+    # Benchmark per-step overhead by replaying dev targets through the processor
+    import time
+    from transformers import T5TokenizerFast
+    from schema_utils import format_enhanced_target
+
+    tokenizer = T5TokenizerFast.from_pretrained('google-t5/t5-small')
+
+    start = time.perf_counter()
+    processor = SchemaConstrainedLogitsProcessor(tokenizer)
+    build_secs = time.perf_counter() - start
+    print(f"Built processor in {build_secs:.3f}s ({processor.trie.size} identifiers)")
+
+    with open(os.path.join('data', 'dev.sql'), 'r') as f:
+        dev_sql = [line.strip() for line in f.readlines()]
+
+    vocab = 32128
+    steps = 0
+    masked_gold = 0
+    elapsed = 0.0
+    for sql in dev_sql:
+        target = tokenizer.encode(format_enhanced_target(sql))
+        prefix = [tokenizer.pad_token_id]
+        for gold in target:
+            scores = torch.zeros(1, vocab)
+            t0 = time.perf_counter()
+            scores = processor(torch.tensor([prefix]), scores)
+            elapsed += time.perf_counter() - t0
+            steps += 1
+            if scores[0, gold] == float('-inf'):
+                masked_gold += 1
+            prefix.append(gold)
+
+    print(f"Decode steps replayed: {steps}")
+    print(f"Per-step overhead: {elapsed / steps * 1e6:.1f} us (batch row of 1, {len(processor._mask_cache)} cached masks)")
+    print(f"Gold tokens masked: {masked_gold}/{steps}")
+
+    # Sanity check for the prefix validator: no gold query should be pruned
+    rejected = [(sql, state.reason) for sql in dev_sql
+                for state in [validate_sql_prefix(sql, complete=True)] if state.dead]
+    print(f"Gold dev queries rejected by prefix validator: {len(rejected)}/{len(dev_sql)}")
+    for sql, reason in rejected[:3]:
+        print(f"  {reason}: {sql[:100]}")
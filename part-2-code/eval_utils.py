@@ -5,10 +5,19 @@ This module contains functions for evaluating T5 model performance,
 including SQL generation and F1 score computation.
 """
 
+import time
 import torch
-from utils import compute_record_F1, compute_records, read_queries
-from schema_utils import extract_sql_from_output
+from torch.utils.data import DataLoader
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from utils import compute_record_F1, compute_records, compute_record, read_queries
+from schema_utils import extract_sql_from_output, format_enhanced_target, SQL_POSTPROCESS_VERSION
+from t5_utils import autocast_context
+from transformers import StoppingCriteria, StoppingCriteriaList
 
+# Per-query execution limit, the same as utils.compute_records
+EXECUTION_TIMEOUT_SECS = 120
+# Bump when candidate reranking changes which SQL is picked, so cached predictions are regenerated
+RERANK_VERSION = 1
 
 def rerank_candidates_by_execution(candidates, target_sql=None, tokenizer=None):
     """
@@ -51,8 +60,138 @@ def rerank_candidates_by_execution(candidates, target_sql=None, tokenizer=None):
     # If all candidates failed, return the first one
     return candidates[0]
 
+def rerank_candidates_lazily(candidates, window=1, stats=None):
+    """
+    Return the first SQL candidate that executes successfully, executing lazily.
+    
+    Candidates are expected in beam-score order (as returned by `model.generate`),
+    so the first successful one is the same answer `rerank_candidates_by_execution`
+    would pick. Instead of executing every candidate up front, candidates are run
+    in order and execution stops at the first success. With `window > 1`, the next
+    `window` candidates are executed speculatively in parallel. Each window gets
+    EXECUTION_TIMEOUT_SECS, the limit `utils.compute_records` applies; a candidate
+    still running then counts as failed and the search moves to the next beam.
+    
+    Args:
+        candidates: List of SQL candidate strings in beam-score order
+        window: Number of candidates to execute in parallel per step (1 = strictly sequential)
+        stats: Optional dict; 'executions' is incremented by the number of queries run
+               and 'timeouts' by the number that hit EXECUTION_TIMEOUT_SECS
+    
+    Returns:
+        Best SQL candidate string (first one that executes successfully)
+    """
+    if not candidates:
+        return ""
+    
+    if len(candidates) == 1:
+        return candidates[0]
+    
+    window = max(1, window)
+    executed = 0
+    timeouts = 0
+    best = None
+    
+    # Not a `with` block: shutting down would wait for a runaway query. A pool whose
+    # worker is stuck on a timed-out query is dropped and the next window gets a new one.
+    pool = None
+    try:
+        for start in range(0, len(candidates), window):
+            chunk = candidates[start:start + window]
+            if pool is None:
+                pool = ThreadPoolExecutor(window)
+            futures = [pool.submit(compute_record, start + j, candidate) for j, candidate in enumerate(chunk)]
+            executed += len(chunk)
+            deadline = time.perf_counter() + EXECUTION_TIMEOUT_SECS
+            timed_out = False
+            # Keep beam order within the window; a timed-out candidate counts as failed
+            for candidate, future in zip(chunk, futures):
+                try:
+                    _, _, error = future.result(timeout=max(0.0, deadline - time.perf_counter()))
+                except FuturesTimeoutError:
+                    error, timed_out = "Query timed out", True
+                    timeouts += 1
+                if not error:
+                    best = candidate
+                    break
+            if best is not None:
+                break
+            if timed_out:
+                pool.shutdown(wait=False, cancel_futures=True)
+                pool = None
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+    
+    if stats is not None:
+        stats['executions'] = stats.get('executions', 0) + executed
+        stats['timeouts'] = stats.get('timeouts', 0) + timeouts
+    
+    # If all candidates failed, return the first one
+    return best if best is not None else candidates[0]
+
+class EndMarkerStoppingCriteria(StoppingCriteria):
+    """
+    Stop each sequence as soon as it has produced the END marker appended by
+    `format_enhanced_target`; `generate` stops the batch once every row has.
+    
+    Args:
+        tokenizer: T5 tokenizer used to find the token ids of the END marker
+        stats: Optional dict; 'stopped' counts rows stopped by the marker
+    """
+    
+    def __init__(self, tokenizer, stats=None):
+        marker = format_enhanced_target("")  # " END" with the leading space used in targets
+        self.end_ids = tokenizer.encode(marker, add_special_tokens=False)
+        self.stats = stats
+        self._done = None
+        self._last_len = 0
+    
+    def __call__(self, input_ids, scores, **kwargs):
+        n = len(self.end_ids)
+        if input_ids.shape[1] < n:
+            return torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+        end_ids = torch.tensor(self.end_ids, device=input_ids.device)
+        is_done = (input_ids[:, -n:] == end_ids).all(dim=-1)
+        if self.stats is not None:
+            # A shorter input means a new generate() call
+            if self._done is None or input_ids.shape[1] <= self._last_len:
+                self._done = torch.zeros_like(is_done)
+            self._last_len = input_ids.shape[1]
+            self.stats['stopped'] = self.stats.get('stopped', 0) + int((is_done & ~self._done).sum().item())
+            self._done = self._done | is_done
+        return is_done
+
+def teacher_forced_loss(model, encoder_outputs, encoder_mask, decoder_inputs, decoder_targets, pad_idx=0):
+    """
+    Token-level cross-entropy of the targets given precomputed encoder outputs.
+    
+    Returns:
+        tuple (summed loss over non-pad target tokens, number of non-pad target tokens)
+    """
+    logits = model(
+        encoder_outputs=encoder_outputs,
+        attention_mask=encoder_mask,
+        decoder_input_ids=decoder_inputs,
+    )["logits"]
+    non_pad = decoder_targets != pad_idx
+    loss = torch.nn.functional.cross_entropy(logits[non_pad].float(), decoder_targets[non_pad])
+    num_tokens = int(non_pad.sum().item())
+    return loss.item() * num_tokens, num_tokens
+
+def decode_targets(tokenizer, decoder_targets):
+    """Decode a batch of target ids to SQL strings, stripping the END marker."""
+    targets = []
+    for target_ids in decoder_targets:
+        target_raw = tokenizer.decode(target_ids, skip_special_tokens=True).strip()
+        targets.append(target_raw.replace(' END', '').strip())
+    return targets
+
 def eval_epoch(model, dataloader, tokenizer, device, generation_max_length=256, 
-               num_beams=1, num_candidates=1, rerank_by_execution=False, return_predictions=False):
+               num_beams=1, num_candidates=1, rerank_by_execution=False, return_predictions=False,
+               rerank_strategy="all", rerank_window=1, schema_constrained=False,
+               prune_invalid_beams=False, speculative_decoding=False, stop_at_end_marker=False,
+               compute_loss=False, prediction_cache_dir=None, loss_bf16=None):
     """
     Evaluate the model on the given dataloader.
     
@@ -66,24 +205,129 @@ def eval_epoch(model, dataloader, tokenizer, device, generation_max_length=256,
         num_candidates: Number of candidates to generate per input (for reranking)
         rerank_by_execution: If True, generate multiple candidates and rerank by execution success
         return_predictions: If True, return generated predictions alongside F1 score
+        rerank_strategy: "all" executes every candidate; "lazy" executes in beam order
+                         and stops at the first success
+        rerank_window: Number of candidates executed speculatively in parallel (lazy only)
+        schema_constrained: If True, mask tokens that cannot extend a valid schema identifier
+        prune_invalid_beams: If True, drop hypotheses whose SQL prefix can no longer become valid
+        speculative_decoding: If True (greedy decoding only), draft tokens from train.sql n-grams
+                              and verify every row's draft in one batched decoder pass per step
+                              (reusing the shared encoder outputs and honoring stop_at_end_marker);
+                              output equals greedy decoding
+        stop_at_end_marker: If True, stop each sequence as soon as it emits the END marker
+        compute_loss: If True, also compute the teacher-forced CE loss over every batch with
+                      targets, encoding each batch once and reusing the encoder outputs for
+                      generation through `encoder_outputs`
+        loss_bf16: Autocast setting for the shared encoder pass and loss (None = the caller's
+                   context). When it differs from the generation context, the encoder
+                   outputs are not reused and generate() re-encodes the batch, so
+                   predictions match those of an unshared run
+        prediction_cache_dir: If set, look up each batch in a prediction cache keyed by the
+                              model weights, inputs and generation config before calling
+                              generate, and store newly generated predictions there
     
     Returns:
         If return_predictions is False: float (F1 score)
         If return_predictions is True: tuple (F1 score, list of predictions)
+        If compute_loss is True, the average token CE loss is appended to the returned tuple
     """
     model.eval()
     
     all_predictions = []
     all_targets = []
+    rerank_stats = {'executions': 0, 'examples': 0}
+    
+    # Beam waste: returned hypotheses that fail the SQL prefix validator
+    waste_stats = {'hypotheses': 0, 'invalid': 0}
+    
+    from constrained_decoding import validate_sql_prefix
+    logits_processor = None
+    prefix_validator = None
+    if schema_constrained or prune_invalid_beams:
+        from transformers import LogitsProcessorList
+        from constrained_decoding import SchemaConstrainedLogitsProcessor, SQLPrefixValidatorLogitsProcessor
+        logits_processor = LogitsProcessorList()
+        if schema_constrained:
+            logits_processor.append(SchemaConstrainedLogitsProcessor(tokenizer))
+        if prune_invalid_beams:
+            # Greedy decoding has no other beams to fall back to, so dead rows just stop
+            effective_beams = max(num_beams, num_candidates) if rerank_by_execution else num_beams
+            prefix_validator = SQLPrefixValidatorLogitsProcessor(tokenizer, stop_dead=effective_beams == 1)
+            logits_processor.append(prefix_validator)
+    
+    stopping_stats = {}
+    stopping_criteria = None
+    if stop_at_end_marker:
+        stopping_criteria = StoppingCriteriaList([EndMarkerStoppingCriteria(tokenizer, stats=stopping_stats)])
+    
+    draft_index = None
+    speculative_stats = {}
+    if speculative_decoding:
+        if not isinstance(model, torch.nn.Module):
+            print("Speculative decoding needs the eager PyTorch model; using the backend's generate")
+        elif num_beams == 1 and not rerank_by_execution and logits_processor is None:
+            from speculative_decoding import get_train_draft_index
+            from tokenizer_registry import get_tokenizer
+            # Drafts are fed to the decoder, so they must use the training tokenizer's ids
+            # (the SQL-optimized eval tokenizer adds tokens beyond the model vocabulary)
+            draft_index = get_train_draft_index(get_tokenizer(), vocab_size=model.config.vocab_size)
+        else:
+            print("Speculative decoding only applies to plain greedy decoding; using model.generate")
+    
+    prediction_cache = None
+    if prediction_cache_dir is not None:
+        from prediction_cache import get_prediction_cache
+        rerank = rerank_by_execution and num_candidates > 1
+        prediction_cache = get_prediction_cache(model, {
+            'num_beams': num_beams,
+            'max_length': generation_max_length,
+            'num_candidates': num_candidates if rerank else 1,
+            'rerank_by_execution': rerank,
+            'schema_constrained': schema_constrained,
+            'prune_invalid_beams': prune_invalid_beams,
+            'stop_at_end_marker': stop_at_end_marker,
+            'tokenizer': (tokenizer.name_or_path, len(tokenizer)),
+            # Cached entries are final SQL strings, so post-processing is part of the key
+            'postprocess': SQL_POSTPROCESS_VERSION,
+            'rerank_version': RERANK_VERSION if rerank else None,
+            # bf16 generation (train_t5 --bf16_generation) can change predictions
+            'autocast': str(torch.get_autocast_cpu_dtype()) if torch.is_autocast_cpu_enabled()
+                        else str(torch.get_autocast_gpu_dtype()) if torch.is_autocast_enabled() else None,
+        }, cache_dir=prediction_cache_dir)
     
-    # Use only half the batches for faster evaluation
-    max_batches = len(dataloader) // 2
-    print(f"Evaluating on {max_batches}/{len(dataloader)} batches (half for speed)...")
+    # Length-sorted loaders (load_data.LengthSortedSampler) visit examples out of file order
+    sampler_order = getattr(dataloader.sampler, 'order', None)
+    
+    if sampler_order is None:
+        # Use only half the batches for faster evaluation
+        max_batches = len(dataloader) // 2
+        print(f"Evaluating on {max_batches}/{len(dataloader)} batches (half for speed)...")
+    else:
+        # Generate for the same examples as the unsorted path (the first half of the
+        # batches in file order), longest first; the rest follow only for the loss
+        max_batches = len(dataloader) // 2
+        num_examples = max_batches * dataloader.batch_size
+        sampler_order = ([i for i in sampler_order if i < num_examples] +
+                         [i for i in sampler_order if i >= num_examples])
+        dataloader = DataLoader(dataloader.dataset, batch_size=dataloader.batch_size, sampler=sampler_order,
+                                collate_fn=dataloader.collate_fn)
+        print(f"Evaluating on {max_batches}/{len(dataloader)} length-sorted batches (half for speed)...")
+    
+    # Padding and throughput statistics
+    encoder_tokens = 0
+    encoder_slots = 0
+    generated_tokens = 0
+    decode_steps = 0
+    generation_secs = 0.0
+    loss_total = 0.0
+    loss_tokens = 0
+    generation_bf16 = torch.is_autocast_cpu_enabled() if device.type == 'cpu' else torch.is_autocast_enabled()
+    share_encoder_outputs = loss_bf16 is None or loss_bf16 == generation_bf16
 
     with torch.no_grad():
         for batch_idx, batch in enumerate(dataloader):
-            # Stop after processing half the batches
-            if batch_idx >= max_batches:
+            # Stop after processing half the batches (the loss still covers every batch)
+            if batch_idx >= max_batches and not (compute_loss and len(batch) == 5):
                 break
             # Handle different batch formats (train vs test)
             if len(batch) == 5:  # Train/dev format
@@ -97,6 +341,38 @@ def eval_epoch(model, dataloader, tokenizer, device, generation_max_length=256,
             encoder_mask = encoder_mask.to(device)
             initial_decoder_inputs = initial_decoder_inputs.to(device)
             
+            # Shared encoder pass: the same encoder outputs serve the loss and generate()
+            encoder_kwargs = {}
+            if compute_loss and decoder_targets is not None:
+                with autocast_context(generation_bf16 if loss_bf16 is None else loss_bf16, device):
+                    encoder_outputs = model.get_encoder()(input_ids=encoder_ids, attention_mask=encoder_mask)
+                    batch_loss, batch_tokens = teacher_forced_loss(
+                        model, encoder_outputs, encoder_mask,
+                        decoder_inputs.to(device), decoder_targets.to(device), pad_idx=tokenizer.pad_token_id,
+                    )
+                loss_total += batch_loss
+                loss_tokens += batch_tokens
+                if batch_idx >= max_batches:
+                    continue
+                # generate() expands encoder outputs for beams in place, so it runs after the loss
+                if share_encoder_outputs:
+                    encoder_kwargs = {'encoder_outputs': encoder_outputs}
+            
+            # Serve the batch from the prediction cache when every example is a hit
+            cache_keys = None
+            if prediction_cache is not None:
+                cache_keys = prediction_cache.batch_keys(encoder_ids, encoder_mask)
+                cached = prediction_cache.get_many(cache_keys)
+                if all(sql is not None for sql in cached):
+                    all_predictions.extend(cached)
+                    if decoder_targets is not None:
+                        all_targets.extend(decode_targets(tokenizer, decoder_targets))
+                    continue
+            
+            encoder_tokens += int(encoder_mask.sum().item())
+            encoder_slots += encoder_mask.numel()
+            generation_start = time.perf_counter()
+            
             # Generate SQL queries
             if rerank_by_execution and num_candidates > 1:
                 # Generate multiple candidates for reranking
@@ -111,6 +387,24 @@ def eval_epoch(model, dataloader, tokenizer, device, generation_max_length=256,
                     pad_token_id=tokenizer.pad_token_id,
                     eos_token_id=tokenizer.eos_token_id,
                     do_sample=False,  # Use deterministic beam search
+                    logits_processor=logits_processor,
+                    stopping_criteria=stopping_criteria,
+                    **encoder_kwargs,
+                )
+            elif draft_index is not None:
+                from speculative_decoding import speculative_generate
+                generated_ids = speculative_generate(
+                    model,
+                    encoder_ids,
+                    encoder_mask,
+                    draft_index,
+                    decoder_start_token_id=int(initial_decoder_inputs[0, 0]),
+                    eos_token_id=tokenizer.eos_token_id,
+                    pad_token_id=tokenizer.pad_token_id,
+                    max_length=generation_max_length,
+                    encoder_outputs=encoder_kwargs.get('encoder_outputs'),
+                    end_ids=stopping_criteria[0].end_ids if stopping_criteria is not None else None,
+                    stats=speculative_stats,
                 )
             else:
                 # Standard generation
@@ -122,9 +416,16 @@ def eval_epoch(model, dataloader, tokenizer, device, generation_max_length=256,
                     num_beams=num_beams,
                     early_stopping=True,
                     pad_token_id=tokenizer.pad_token_id,
-                    eos_token_id=tokenizer.eos_token_id
+                    eos_token_id=tokenizer.eos_token_id,
+                    logits_processor=logits_processor,
+                    stopping_criteria=stopping_criteria,
+                    **encoder_kwargs,
                 )
             
+            generation_secs += time.perf_counter() - generation_start
+            generated_tokens += int((generated_ids != tokenizer.pad_token_id).sum().item())
+            decode_steps += generated_ids.shape[1] - 1
+            
             # Process generated sequences
             batch_size = encoder_ids.shape[0]
             sequences_per_input = num_candidates if (rerank_by_execution and num_candidates > 1) else 1
@@ -142,9 +443,16 @@ def eval_epoch(model, dataloader, tokenizer, device, generation_max_length=256,
                         candidate_raw = tokenizer.decode(cand_id, skip_special_tokens=True).strip()
                         candidate_sql = extract_sql_from_output(candidate_raw)
                         candidates.append(candidate_sql)
+                        waste_stats['hypotheses'] += 1
+                        waste_stats['invalid'] += int(validate_sql_prefix(candidate_sql, complete=True).dead)
                     
                     # Rerank candidates by execution success
-                    best_sql = rerank_candidates_by_execution(candidates, decoder_targets[i] if decoder_targets is not None else None, tokenizer)
+                    if rerank_strategy == "lazy":
+                        best_sql = rerank_candidates_lazily(candidates, window=rerank_window, stats=rerank_stats)
+                    else:
+                        best_sql = rerank_candidates_by_execution(candidates, decoder_targets[i] if decoder_targets is not None else None, tokenizer)
+                        rerank_stats['executions'] += len(candidates)
+                    rerank_stats['examples'] += 1
                     all_predictions.append(best_sql)
                 else:
                     # Standard single prediction
@@ -154,21 +462,62 @@ def eval_epoch(model, dataloader, tokenizer, device, generation_max_length=256,
                     ).strip()
                     generated_sql = extract_sql_from_output(generated_raw)
                     all_predictions.append(generated_sql)
-                
-                # Get target SQL if available (for train/dev)
-                if decoder_targets is not None:
-                    # Decode target ids and strip END
-                    target_raw = tokenizer.decode(
-                        decoder_targets[i], 
-                        skip_special_tokens=True
-                    ).strip()
-                    target_sql = target_raw.replace(' END', '').strip()
-                    all_targets.append(target_sql)
+                    waste_stats['hypotheses'] += 1
+                    waste_stats['invalid'] += int(validate_sql_prefix(generated_sql, complete=True).dead)
+            
+            # Get target SQL if available (for train/dev)
+            if decoder_targets is not None:
+                all_targets.extend(decode_targets(tokenizer, decoder_targets))
+            
+            if cache_keys is not None:
+                prediction_cache.put_many(cache_keys, all_predictions[-batch_size:])
 
             # Print progress every 10 batches
-            if (batch_idx + 1) % 10 == 0:
+            if (batch_idx + 1) % 10 == 0 and batch_idx < max_batches:
                 print(f"  Processed {batch_idx + 1}/{max_batches} batches")
     
+    if sampler_order is not None:
+        # Restore file order for the predictions (and targets) written downstream
+        visited = sampler_order[:len(all_predictions)]
+        all_predictions = [pred for _, pred in sorted(zip(visited, all_predictions))]
+        if all_targets:
+            all_targets = [tgt for _, tgt in sorted(zip(visited, all_targets))]
+    
+    if encoder_slots > 0:
+        padding_ratio = 1.0 - encoder_tokens / encoder_slots
+        num_examples = len(all_predictions)
+        print(f"Encoder padding ratio: {padding_ratio*100:.2f}%")
+        print(f"Generation throughput: {num_examples / max(generation_secs, 1e-9):.2f} examples/s, "
+              f"{generated_tokens / max(generation_secs, 1e-9):.1f} tokens/s ({generation_secs:.2f}s in generate)")
+        print(f"Decode steps: {decode_steps} batched steps over {max_batches} batches")
+    if prediction_cache is not None:
+        print(f"Prediction cache: {prediction_cache.hits} hits, {prediction_cache.misses} misses "
+              f"({prediction_cache.path})")
+        prediction_cache.close()
+    if stop_at_end_marker:
+        stopped = stopping_stats.get('stopped', 0) + speculative_stats.get('stopped', 0)
+        print(f"END-marker stopping: {stopped} sequences stopped at END")
+    
+    if speculative_stats.get('forward_passes'):
+        print(f"Speculative decoding: {speculative_stats['tokens'] / speculative_stats['forward_passes']:.2f} "
+              f"tokens per decoder pass ({speculative_stats['accepted']} draft tokens accepted)")
+    
+    if waste_stats['hypotheses'] > 0:
+        waste = waste_stats['invalid'] / waste_stats['hypotheses']
+        print(f"Beam waste: {waste_stats['invalid']}/{waste_stats['hypotheses']} returned hypotheses "
+              f"are invalid SQL ({waste*100:.2f}%)")
+    if prefix_validator is not None:
+        print(f"Prefix validator pruned {prefix_validator.stats['pruned']} hypotheses "
+              f"over {prefix_validator.stats['hypotheses']} decode-step rows")
+    
+    if rerank_stats['examples'] > 0:
+        avg_executions = rerank_stats['executions'] / rerank_stats['examples']
+        print(f"Reranking ({rerank_strategy}): {avg_executions:.2f} query executions per example "
+              f"(num_candidates={num_candidates})")
+        if rerank_stats.get('timeouts'):
+            print(f"Reranking: {rerank_stats['timeouts']} candidate executions timed out "
+                  f"after {EXECUTION_TIMEOUT_SECS}s")
+    
     # Compute F1 score if we have targets (requires executing SQL queries on database)
     if all_targets:
         print("Executing SQL queries on database to compute F1 score...")
@@ -212,6 +561,13 @@ def eval_epoch(model, dataloader, tokenizer, device, generation_max_length=256,
     
     model.train()  # Reset to training mode
     
+    if compute_loss:
+        avg_loss = loss_total / loss_tokens if loss_tokens > 0 else 0.0
+        print(f"Dev loss (shared encoder pass): {avg_loss:.4f}")
+        if return_predictions:
+            return f1_score, all_predictions, avg_loss
+        return f1_score, avg_loss
+    
     if return_predictions:
         return f1_score, all_predictions
     else:
@@ -234,7 +590,10 @@ def save_predictions_to_file(predictions, filename):
 
 
 def evaluate_and_save(model, dataloader, tokenizer, device, output_file, 
-                     generation_max_length=256, num_beams=1, num_candidates=1, rerank_by_execution=False):
+                     generation_max_length=256, num_beams=1, num_candidates=1, rerank_by_execution=False,
+                     rerank_strategy="all", rerank_window=1, schema_constrained=False,
+                     prune_invalid_beams=False, speculative_decoding=False, stop_at_end_marker=False,
+                     compute_loss=False, prediction_cache_dir=None, loss_bf16=None):
     """
     Evaluate model and save predictions to file.
     
@@ -248,11 +607,20 @@ def evaluate_and_save(model, dataloader, tokenizer, device, output_file,
         num_beams: Number of beams for beam search
         num_candidates: Number of candidates to generate per input (for reranking)
         rerank_by_execution: If True, generate multiple candidates and rerank by execution success
+        rerank_strategy: "all" or "lazy" (see eval_epoch)
+        rerank_window: Speculative parallel window for lazy reranking
+        schema_constrained: If True, use schema-constrained decoding
+        prune_invalid_beams: If True, prune hypotheses that can no longer become valid SQL
+        speculative_decoding: If True, use retrieval-based speculative greedy decoding
+        stop_at_end_marker: If True, stop each sequence once it emits the END marker
+        compute_loss: If True, also compute the dev loss in the shared encoder pass (see eval_epoch)
+        prediction_cache_dir: Prediction cache directory (see eval_epoch)
+        loss_bf16: Autocast setting for the shared-encoder loss (see eval_epoch)
     
     Returns:
-        F1 score (None if no targets available)
+        F1 score (None if no targets available), or (F1 score, loss) when compute_loss is True
     """
-    f1_score, predictions = eval_epoch(
+    outputs = eval_epoch(
         model=model,
         dataloader=dataloader, 
         tokenizer=tokenizer,
@@ -261,9 +629,21 @@ def evaluate_and_save(model, dataloader, tokenizer, device, output_file,
         num_beams=num_beams,
         num_candidates=num_candidates,
         rerank_by_execution=rerank_by_execution,
-        return_predictions=True
+        return_predictions=True,
+        rerank_strategy=rerank_strategy,
+        rerank_window=rerank_window,
+        schema_constrained=schema_constrained,
+        prune_invalid_beams=prune_invalid_beams,
+        speculative_decoding=speculative_decoding,
+        stop_at_end_marker=stop_at_end_marker,
+        compute_loss=compute_loss,
+        prediction_cache_dir=prediction_cache_dir,
+        loss_bf16=loss_bf16,
     )
+    f1_score, predictions = outputs[:2]
     
     save_predictions_to_file(predictions, output_file)
     
+    if compute_loss:
+        return f1_score, outputs[2]
     return f1_score
\ No newline at end of file
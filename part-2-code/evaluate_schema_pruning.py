@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Report the effect of question-aware schema pruning (schema_linking) on T5 inputs:
+encoder tokens per example with the compact vs pruned schema, how long pruned
+schemas get and how often the compact fallback is taken, recall of the tables
+gold SQL uses (with misses per table), and optionally dev record F1 of two
+checkpoints trained without and with --prune_schema.
+"""
+
+import argparse
+import os
+import re
+from collections import Counter
+from types import SimpleNamespace
+
+from load_data import load_lines, MAX_LENGTH
+from schema_utils import format_enhanced_input
+from tokenizer_registry import get_tokenizer
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Schema pruning report')
+    parser.add_argument('--data_folder', type=str, default='data')
+    parser.add_argument('--splits', type=str, nargs='+', default=['train', 'dev'])
+    parser.add_argument('--full_experiment', type=str, default=None,
+                        help='Fine-tuned experiment trained with the compact schema (for record F1)')
+    parser.add_argument('--pruned_experiment', type=str, default=None,
+                        help='Fine-tuned experiment trained with --prune_schema (for record F1)')
+    parser.add_argument('--test_batch_size', type=int, default=16)
+    return parser.parse_args()
+
+
+def gold_tables(sql: str):
+    """Tables referenced by an ATIS query (they always appear aliased as `table table_N`)."""
+    return set(re.findall(r"\b([a-z_]+) \1_\d+\b", sql))
+
+
+def token_report(tokenizer, nl_queries):
+    """Mean and max encoder tokens per example for the compact and pruned inputs."""
+    report = {}
+    for label, prune in (('compact', False), ('pruned', True)):
+        texts = [format_enhanced_input(nl, prune_schema=prune) for nl in nl_queries]
+        lengths = [len(ids) for ids in tokenizer(texts, truncation=True, max_length=MAX_LENGTH)['input_ids']]
+        report[label] = (sum(lengths) / len(lengths), max(lengths), sum(lengths))
+    return report
+
+
+def table_recall(linker, nl_queries, sql_queries):
+    """
+    Share of gold tables kept, share of questions with every gold table kept, mean
+    tables shown, and a Counter of missed gold tables.
+    """
+    kept, total, complete, shown = 0, 0, 0, 0
+    misses = Counter()
+    for nl, sql in zip(nl_queries, sql_queries):
+        selected = set(linker.link(nl))
+        gold = gold_tables(sql)
+        kept += len(gold & selected)
+        total += len(gold)
+        complete += gold <= selected
+        shown += len(selected)
+        misses.update(gold - selected)
+    return kept / max(total, 1), complete / max(len(nl_queries), 1), shown / max(len(nl_queries), 1), misses
+
+
+def schema_lengths(linker, nl_queries):
+    """Longest pruned schema (characters, before the fallback), compact length, fallback count."""
+    compact = len(linker.registry.compact())
+    pruned = [len(linker.render_pruned(nl)) for nl in nl_queries]
+    return max(pruned, default=0), compact, sum(length > compact for length in pruned)
+
+
+def dev_record_f1(experiment_name, prune_schema, batch_size):
+    from eval_utils import eval_epoch
+    from load_data import get_dataloader
+    from t5_utils import load_model_from_checkpoint, DEVICE
+
+    args = SimpleNamespace(finetune=True, experiment_name=experiment_name)
+    model = load_model_from_checkpoint(args, best=True)
+    model.eval()
+    tokenizer = get_tokenizer()
+    dev_loader = get_dataloader(batch_size, 'dev', prune_schema=prune_schema)
+    return eval_epoch(model, dev_loader, tokenizer, DEVICE)
+
+
+def main():
+    args = get_args()
+    from schema_linking import get_schema_linker
+
+    tokenizer = get_tokenizer()
+    linker = get_schema_linker()
+
+    for split in args.splits:
+        nl_queries = load_lines(os.path.join(args.data_folder, f'{split}.nl'))
+        sql_path = os.path.join(args.data_folder, f'{split}.sql')
+        print(f"\n{'='*60}")
+        print(f"✂️  {split}: {len(nl_queries)} examples")
+        print(f"{'='*60}")
+        report = token_report(tokenizer, nl_queries)
+        for label, (mean, longest, total) in report.items():
+            print(f"{label.capitalize():10} encoder tokens: mean {mean:7.1f}  max {longest:4d}  total {total}")
+        print(f"Reduction:                {1 - report['pruned'][2] / report['compact'][2]:.1%}")
+        longest, compact, fallbacks = schema_lengths(linker, nl_queries)
+        print(f"Schema characters:        pruned max {longest}, compact {compact}; "
+              f"{fallbacks}/{len(nl_queries)} questions fall back to compact")
+        if os.path.exists(sql_path):
+            recall, complete, shown, misses = table_recall(linker, nl_queries, load_lines(sql_path))
+            print(f"Gold table recall:        {recall:.1%} ({complete:.1%} of questions keep every gold table)")
+            print(f"Tables shown per example: {shown:.1f}")
+            if misses:
+                print("Missed gold tables:       " + ", ".join(f"{t} {n}" for t, n in misses.most_common(8)))
+
+    if args.full_experiment or args.pruned_experiment:
+        print(f"\n{'='*60}")
+        print("📈 Dev record F1")
+        print(f"{'='*60}")
+        if args.full_experiment:
+            print(f"Compact schema ({args.full_experiment}): "
+                  f"{dev_record_f1(args.full_experiment, False, args.test_batch_size):.4f}")
+        if args.pruned_experiment:
+            print(f"Pruned schema ({args.pruned_experiment}):  "
+                  f"{dev_record_f1(args.pruned_experiment, True, args.test_batch_size):.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,196 @@
-import os, random, re, string
+import os, random, re, string, hashlib, shutil, glob
 from collections import Counter
-from tqdm import tqdm
-import pickle
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import chain, zip_longest
+import numpy as np
 
-from torch.utils.data import Dataset, DataLoader
+from torch.utils.data import Dataset, IterableDataset, DataLoader, Sampler, get_worker_info
 from torch.nn.utils.rnn import pad_sequence
 
-import nltk
-nltk.download('punkt')
-from transformers import T5TokenizerFast
 import torch
 
-from schema_utils import format_enhanced_input, format_enhanced_target
+from schema_utils import format_enhanced_input, format_enhanced_target, ENHANCED_FORMAT_VERSION
+from tokenizer_registry import get_tokenizer
 
 PAD_IDX = 0
+MAX_LENGTH = 512
+TOKEN_FIELDS = ('encoder_input', 'decoder_input', 'decoder_target')
+# Corpora at least this large are tokenized in worker processes
+PARALLEL_MIN_EXAMPLES = 50000
+STREAM_SHUFFLE_BUFFER = 10000
+STREAM_ENCODE_BATCH = 1024
+
+def _encode_chunk(tokenizer, texts, formatter):
+    '''Format and batch-encode a chunk of texts; returns flat int32 tokens and int64 lengths.'''
+    ids = tokenizer([formatter(text) for text in texts], truncation=True, max_length=MAX_LENGTH)['input_ids']
+    lengths = np.fromiter((len(seq) for seq in ids), dtype=np.int64, count=len(ids))
+    tokens = np.fromiter(chain.from_iterable(ids), dtype=np.int32, count=int(lengths.sum()))
+    return tokens, lengths
+
+def encode_texts(tokenizer, texts, formatter, num_workers=None, chunk_size=10000):
+    '''
+    Batch-encode `formatter(text)` for every text with the fast tokenizer.
+
+    Large corpora (PARALLEL_MIN_EXAMPLES or more) are split into chunks encoded in
+    `num_workers` processes (default: all CPUs).
+
+    Returns:
+        (tokens, offsets): flat int32 token ids and int64 offsets of length len(texts) + 1
+    '''
+    num_workers = os.cpu_count() if num_workers is None else num_workers
+    if num_workers > 1 and len(texts) >= PARALLEL_MIN_EXAMPLES:
+        chunks = [texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)]
+        with ProcessPoolExecutor(num_workers) as pool:
+            results = list(pool.map(_encode_chunk, [tokenizer] * len(chunks), chunks, [formatter] * len(chunks)))
+    else:
+        results = [_encode_chunk(tokenizer, texts, formatter)]
+    tokens = np.concatenate([r[0] for r in results]) if results else np.zeros(0, dtype=np.int32)
+    lengths = np.concatenate([r[1] for r in results]) if results else np.zeros(0, dtype=np.int64)
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return tokens, offsets
+
+def shift_right(tokens, offsets, start_token_id=PAD_IDX):
+    '''
+    Decoder inputs for flat target arrays: every sequence shifted right by one with
+    `start_token_id` in front (the last target token is dropped), without a per-example loop.
+    '''
+    shifted = np.empty_like(tokens)
+    shifted[1:] = tokens[:-1]
+    starts = offsets[:-1][offsets[:-1] < offsets[1:]]  # skip empty sequences
+    shifted[starts] = start_token_id
+    return shifted
+
+def tokenize_split(tokenizer, nl_queries, sql_queries=None, num_workers=None, prune_schema=False):
+    '''
+    Tokenize a split into flat arrays: {field: (int32 tokens, int64 offsets)} for
+    encoder_input and, when SQL targets are given, decoder_input and decoder_target.
+    With prune_schema, inputs carry the question-specific schema (schema_linking).
+    '''
+    input_formatter = partial(format_enhanced_input, prune_schema=True) if prune_schema else format_enhanced_input
+    arrays = {'encoder_input': encode_texts(tokenizer, nl_queries, input_formatter, num_workers)}
+    if sql_queries is not None:
+        target_tokens, target_offsets = encode_texts(tokenizer, sql_queries, format_enhanced_target, num_workers)
+        arrays['decoder_input'] = (shift_right(target_tokens, target_offsets, tokenizer.pad_token_id), target_offsets)
+        arrays['decoder_target'] = (target_tokens, target_offsets)
+    return arrays
+
+def dataset_cache_key(data_folder, split, tokenizer, max_length=MAX_LENGTH, prune_schema=False):
+    '''
+    Hash of everything that determines the tokenized split: the source files, the
+    tokenizer, the input/target format (version, schema and pruning, including the
+    linker's alignment and value sources) and max_length.
+    '''
+    from schema_registry import get_schema_registry
+    digest = hashlib.sha256()
+    for name in (f"{split}.nl", f"{split}.sql"):
+        path = os.path.join(data_folder, name)
+        if os.path.exists(path):
+            digest.update(name.encode())
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+    backend = getattr(tokenizer, 'backend_tokenizer', None)
+    digest.update(backend.to_str().encode() if backend is not None else tokenizer.name_or_path.encode())
+    digest.update(f"format={ENHANCED_FORMAT_VERSION};schema={get_schema_registry().fingerprint};"
+                  f"max_length={max_length}".encode())
+    if prune_schema:
+        from schema_linking import schema_linking_fingerprint
+        digest.update(f";pruned={schema_linking_fingerprint()}".encode())
+    return digest.hexdigest()[:24]
+
+def save_token_arrays(cache_dir, arrays):
+    '''
+    Save each field's flat int32 tokens and int64 offsets (as built by tokenize_split)
+    so they can be memory-mapped back. Written to a temporary directory and renamed,
+    so concurrent workers never see a partial cache.
+    '''
+    tmp_dir = f"{cache_dir}.tmp{os.getpid()}"
+    os.makedirs(tmp_dir, exist_ok=True)
+    for name, (tokens, offsets) in arrays.items():
+        np.save(os.path.join(tmp_dir, f"{name}.tokens.npy"), tokens)
+        np.save(os.path.join(tmp_dir, f"{name}.offsets.npy"), offsets)
+    try:
+        os.replace(tmp_dir, cache_dir)
+    except OSError:
+        # Another worker finished first
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def load_token_arrays(cache_dir, names):
+    '''Memory-map the (tokens, offsets) arrays saved by save_token_arrays, or None if missing.'''
+    if not os.path.isdir(cache_dir):
+        return None
+    arrays = {}
+    for name in names:
+        tokens_path = os.path.join(cache_dir, f"{name}.tokens.npy")
+        offsets_path = os.path.join(cache_dir, f"{name}.offsets.npy")
+        if not (os.path.exists(tokens_path) and os.path.exists(offsets_path)):
+            return None
+        arrays[name] = (np.load(tokens_path, mmap_mode='r'), np.load(offsets_path, mmap_mode='r'))
+    return arrays
+
+class PackedSequences:
+    '''
+    Ragged token sequences stored as one contiguous int32 tensor plus int64 offsets.
+    Indexing returns a view into the buffer, so no per-example tensors are kept.
+    '''
+
+    def __init__(self, tokens, offsets):
+        self.tokens = torch.from_numpy(np.ascontiguousarray(tokens, dtype=np.int32))
+        self.offsets = np.ascontiguousarray(offsets, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        return self.tokens[self.offsets[idx]:self.offsets[idx + 1]]
+
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    @property
+    def nbytes(self):
+        return self.tokens.numel() * self.tokens.element_size() + self.offsets.nbytes
+
+class PackedExamples:
+    '''
+    Compact storage for T5Dataset: one PackedSequences per token field plus the NL
+    strings. Examples are materialized as dicts of views on access.
+    '''
+
+    def __init__(self, fields, nl_queries):
+        self.fields = fields
+        self.nl_queries = nl_queries
+
+    def __len__(self):
+        return len(self.nl_queries)
+
+    def __getitem__(self, idx):
+        example = {name: field[idx] for name, field in self.fields.items()}
+        example['nl_query'] = self.nl_queries[idx]
+        example['idx'] = idx
+        return example
 
 class T5Dataset(Dataset):
 
-    def __init__(self, data_folder, split):
+    def __init__(self, data_folder, split, use_cache=True, cache_dir=None, num_workers=None, prune_schema=False):
         '''
         Dataset class for performing data processing for the T5 model.
+
+        Tokenized splits are cached under `cache_dir` (default <data_folder>/.t5_cache)
+        and reused while the source files, tokenizer and input format are unchanged.
+        `num_workers` tokenization processes are used for large corpora (default: all CPUs).
+        `prune_schema` puts only the question-relevant schema into each input.
         '''
         self.split = split
+        self.num_workers = num_workers
+        self.prune_schema = prune_schema
         self.data_folder = data_folder
+        self.use_cache = use_cache
+        self.cache_dir = cache_dir or os.path.join(data_folder, '.t5_cache')
         
-        # Initialize default T5 tokenizer
-        self.tokenizer = T5TokenizerFast.from_pretrained('google-t5/t5-small')
+        # Shared default T5 tokenizer (loaded once per process for all splits)
+        self.tokenizer = get_tokenizer()
         
         # Process and load data
         self.data = self.process_data(data_folder, split, self.tokenizer)
@@ -34,7 +199,7 @@ class T5Dataset(Dataset):
     
     def _create_sql_tokenizer(self, save_path):
         # Deprecated: custom tokenizer creation removed
-        return T5TokenizerFast.from_pretrained('google-t5/t5-small')
+        return get_tokenizer()
 
     def process_data(self, data_folder, split, tokenizer):
         '''
@@ -45,71 +210,31 @@ class T5Dataset(Dataset):
         with open(nl_file, 'r') as f:
             nl_queries = [line.strip() for line in f.readlines()]
 
-        data = []
-
-        if split == "test":
-            # Test set: only has natural language queries
-            for i, nl_query in enumerate(nl_queries):
-                # Create enhanced input with schema information and Answer: pattern
-                enhanced_input = format_enhanced_input(nl_query)
-
-                # Tokenize enhanced input
-                encoder_input = tokenizer.encode(
-                    enhanced_input,
-                    return_tensors="pt",
-                    truncation=True,
-                    max_length=512
-                ).squeeze(0)
-
-                data.append({
-                    'encoder_input': encoder_input,
-                    'nl_query': nl_query,
-                    'idx': i
-                })
-        else:
+        sql_queries = None
+        if split != "test":
             # Train/dev sets: have both NL queries and SQL targets
             sql_file = os.path.join(data_folder, f"{split}.sql")
             with open(sql_file, 'r') as f:
                 sql_queries = [line.strip() for line in f.readlines()]
-
             assert len(nl_queries) == len(sql_queries), f"Mismatch in {split}: {len(nl_queries)} vs {len(sql_queries)}"
 
-            for i, (nl_query, sql_query) in enumerate(zip(nl_queries, sql_queries)):
-                # Create enhanced input with schema information and Answer: pattern
-                enhanced_input = format_enhanced_input(nl_query)
-
-                # Tokenize enhanced input
-                encoder_input = tokenizer.encode(
-                    enhanced_input,
-                    return_tensors="pt",
-                    truncation=True,
-                    max_length=512
-                ).squeeze(0)
-
-                # Format and tokenize SQL target
-                formatted_target = format_enhanced_target(sql_query)
-                decoder_target = tokenizer.encode(
-                    formatted_target,
-                    return_tensors="pt",
-                    truncation=True,
-                    max_length=512
-                ).squeeze(0)
-
-                # Create decoder input (shift right with BOS token)
-                decoder_input = torch.cat([
-                    torch.tensor([tokenizer.pad_token_id]),  # BOS token
-                    decoder_target[:-1]  # All but last token
-                ])
-
-                data.append({
-                    'encoder_input': encoder_input,
-                    'decoder_input': decoder_input,
-                    'decoder_target': decoder_target,
-                    'nl_query': nl_query,
-                    'idx': i
-                })
-
-        return data
+        names = TOKEN_FIELDS if sql_queries is not None else TOKEN_FIELDS[:1]
+        arrays = None
+        split_cache_dir = None
+        if self.use_cache:
+            split_cache_dir = os.path.join(self.cache_dir, f"{split}-{dataset_cache_key(data_folder, split, tokenizer, prune_schema=self.prune_schema)}")
+            arrays = load_token_arrays(split_cache_dir, names)
+            if arrays is not None:
+                print(f"Loaded tokenized {split} split from {split_cache_dir}")
+        if arrays is None:
+            # Enhanced inputs (schema + Answer: pattern) and END-terminated targets, batch-encoded
+            arrays = tokenize_split(tokenizer, nl_queries, sql_queries, self.num_workers, self.prune_schema)
+            if split_cache_dir is not None:
+                save_token_arrays(split_cache_dir, arrays)
+
+        # Token buffers stay int32 (collate functions widen the padded batch to int64)
+        fields = {name: PackedSequences(tokens, offsets) for name, (tokens, offsets) in arrays.items()}
+        return PackedExamples(fields, nl_queries)
     
     def __len__(self):
         return len(self.data)
@@ -128,9 +253,9 @@ def normal_collate_fn(batch):
     decoder_targets = [item['decoder_target'] for item in batch]
     
     # Pad sequences to the same length in the batch
-    encoder_ids = pad_sequence(encoder_inputs, batch_first=True, padding_value=PAD_IDX)
-    decoder_input_ids = pad_sequence(decoder_inputs, batch_first=True, padding_value=PAD_IDX)
-    decoder_target_ids = pad_sequence(decoder_targets, batch_first=True, padding_value=PAD_IDX)
+    encoder_ids = pad_sequence(encoder_inputs, batch_first=True, padding_value=PAD_IDX).long()
+    decoder_input_ids = pad_sequence(decoder_inputs, batch_first=True, padding_value=PAD_IDX).long()
+    decoder_target_ids = pad_sequence(decoder_targets, batch_first=True, padding_value=PAD_IDX).long()
     
     # Create attention masks (1 for real tokens, 0 for padding)
     encoder_mask = (encoder_ids != PAD_IDX).long()
@@ -148,7 +273,7 @@ def test_collate_fn(batch):
     encoder_inputs = [item['encoder_input'] for item in batch]
     
     # Pad sequences to the same length in the batch
-    encoder_ids = pad_sequence(encoder_inputs, batch_first=True, padding_value=PAD_IDX)
+    encoder_ids = pad_sequence(encoder_inputs, batch_first=True, padding_value=PAD_IDX).long()
     
     # Create attention masks (1 for real tokens, 0 for padding)
     encoder_mask = (encoder_ids != PAD_IDX).long()
@@ -158,19 +283,372 @@ def test_collate_fn(batch):
     
     return encoder_ids, encoder_mask, initial_decoder_inputs
 
-def get_dataloader(batch_size, split):
+class LengthSortedSampler(Sampler):
+    '''
+    Sampler for dev/test generation that visits examples from longest to shortest
+    encoder input, so each batch pads (and decodes) to a similar length. Optionally
+    breaks ties by a predicted output length (question word count as a proxy).
+
+    `order` holds the visiting order; eval_utils.eval_epoch uses it to put
+    predictions back into file order.
+    '''
+
+    def __init__(self, dataset, by_output_length=False):
+        enc_lengths = [len(dataset[i]['encoder_input']) for i in range(len(dataset))]
+        if by_output_length:
+            out_lengths = [len(dataset[i]['nl_query'].split()) for i in range(len(dataset))]
+        else:
+            out_lengths = [0] * len(dataset)
+        self.order = sorted(range(len(dataset)), key=lambda i: (-enc_lengths[i], -out_lengths[i], i))
+
+    def __iter__(self):
+        return iter(self.order)
+
+    def __len__(self):
+        return len(self.order)
+
+def example_lengths(dataset, field):
+    '''Token length of `field` for every example (read from the packed offsets when available).'''
+    data = getattr(dataset, 'data', None)
+    if isinstance(data, PackedExamples) and field in data.fields:
+        return data.fields[field].lengths().tolist()
+    return [len(dataset[i][field]) for i in range(len(dataset))]
+
+class ResumableBatchSampler(Sampler):
+    '''
+    Base for training batch samplers whose batch order is a pure function of
+    (seed, epoch), so the iteration state is just {'seed', 'epoch', 'position'} and
+    a restarted job can continue from the exact batch it stopped at.
+
+    Subclasses implement `_plan(epoch)` returning the epoch's list of index batches.
+    The training loop calls `set_epoch` before each epoch (otherwise consecutive
+    iterations play consecutive epochs) and, after restoring a checkpoint,
+    `load_state_dict`, which makes the next iteration skip the first `position`
+    batches of that epoch.
+    '''
+
+    def __init__(self, seed=0):
+        self.seed = seed
+        self.epoch = 0
+        self.position = 0
+        self.batches = self._plan(self.epoch)
+
+    def _plan(self, epoch):
+        raise NotImplementedError
+
+    def set_epoch(self, epoch):
+        if epoch != self.epoch:
+            self.epoch = epoch
+            self.position = 0
+            self.batches = self._plan(epoch)
+
+    def state_dict(self, epoch, batches_done):
+        '''State that resumes after `batches_done` batches of `epoch`.'''
+        return {'seed': self.seed, 'epoch': epoch, 'position': batches_done}
+
+    def load_state_dict(self, state):
+        self.seed = state['seed']
+        self.epoch = state['epoch']
+        self.position = state['position']
+        self.batches = self._plan(self.epoch)
+
+    def __iter__(self):
+        if self.position == 0:
+            # Re-plan: the batch sizes/order of the previous iteration may be stale
+            self.batches = self._plan(self.epoch)
+        batches = self.batches[self.position:]
+        self.epoch += 1
+        self.position = 0
+        return iter(batches)
+
+    def __len__(self):
+        # Batch counts may vary between epochs; this is the current epoch's remaining plan
+        return len(self.batches) - self.position
+
+    def epoch_lengths(self, num_epochs):
+        '''Batches in each of the first `num_epochs` epochs (the LR schedule's step counts).'''
+        return [len(self._plan(epoch)) for epoch in range(num_epochs)]
+
+class ShuffledBatchSampler(ResumableBatchSampler):
+    '''Fixed-size batches of a seeded per-epoch shuffle (DataLoader(shuffle=True), but resumable).'''
+
+    def __init__(self, dataset, batch_size, seed=0):
+        self.num_examples = len(dataset)
+        self.batch_size = batch_size
+        super().__init__(seed)
+
+    def _plan(self, epoch):
+        indices = list(range(self.num_examples))
+        random.Random(self.seed + epoch).shuffle(indices)
+        return [indices[i:i + self.batch_size] for i in range(0, len(indices), self.batch_size)]
+
+class TokenBudgetBatchSampler(ResumableBatchSampler):
+    '''
+    Training batch sampler that fills each batch up to `max_tokens` padded tokens,
+    counting encoder + decoder: a batch of n examples costs n * (max encoder length
+    + max decoder length). Short SQL targets therefore get large batches and long
+    joins small ones, keeping memory use per step roughly constant.
+
+    Each epoch, examples are shuffled, split into pools of `pool_size`, sorted by
+    length within a pool and cut into batches; the batch order is then shuffled,
+    so randomness comes from bucket-level shuffling.
+    '''
+
+    def __init__(self, dataset, max_tokens, pool_size=1024, seed=0):
+        self.enc_lengths = example_lengths(dataset, 'encoder_input')
+        self.dec_lengths = example_lengths(dataset, 'decoder_target')
+        self.max_tokens = max_tokens
+        self.pool_size = pool_size
+        super().__init__(seed)
+
+    def _plan(self, epoch):
+        rng = random.Random(self.seed + epoch)
+        indices = list(range(len(self.enc_lengths)))
+        rng.shuffle(indices)
+
+        batches = []
+        for start in range(0, len(indices), self.pool_size):
+            pool = sorted(indices[start:start + self.pool_size],
+                          key=lambda i: (self.dec_lengths[i], self.enc_lengths[i]))
+            batch, max_enc, max_dec = [], 0, 0
+            for i in pool:
+                new_enc = max(max_enc, self.enc_lengths[i])
+                new_dec = max(max_dec, self.dec_lengths[i])
+                if batch and (len(batch) + 1) * (new_enc + new_dec) > self.max_tokens:
+                    batches.append(batch)
+                    batch, new_enc, new_dec = [], self.enc_lengths[i], self.dec_lengths[i]
+                batch.append(i)
+                max_enc, max_dec = new_enc, new_dec
+            if batch:
+                batches.append(batch)
+        rng.shuffle(batches)
+        return batches
+
+def find_shards(data_folder, split):
+    '''
+    Aligned (nl_path, sql_path) pairs for a split: <split>.nl itself and/or shards named
+    <split>-*.nl (e.g. train-00000.nl), sorted. sql_path is None when the .sql file is missing.
+    '''
+    nl_paths = sorted(glob.glob(os.path.join(data_folder, f"{split}.nl")) +
+                      glob.glob(os.path.join(data_folder, f"{split}-*.nl")))
+    if not nl_paths:
+        raise FileNotFoundError(f"No {split}.nl or {split}-*.nl files in {data_folder}")
+    shards = []
+    for nl_path in nl_paths:
+        sql_path = nl_path[:-len('.nl')] + '.sql'
+        shards.append((nl_path, sql_path if os.path.exists(sql_path) else None))
+    return shards
+
+def shuffle_buffer(examples, buffer_size, rng):
+    '''
+    Approximate shuffle of a stream: keep `buffer_size` examples and emit a random
+    one each time a new example arrives. Memory is bounded by the buffer size.
+    '''
+    buffer = []
+    for example in examples:
+        if len(buffer) < buffer_size:
+            buffer.append(example)
+            continue
+        i = rng.randrange(buffer_size)
+        yield buffer[i]
+        buffer[i] = example
+    rng.shuffle(buffer)
+    yield from buffer
+
+class StreamingT5Dataset(IterableDataset):
+    '''
+    Streams aligned .nl/.sql files (or shards, see find_shards) and tokenizes them on
+    the fly, so corpora far larger than memory can be trained on. Yields the same
+    example dicts as T5Dataset, so normal_collate_fn / packed_collate_fn apply.
+
+    Each DataLoader worker (and distributed rank) reads a disjoint part of the
+    stream: whole shards when there are at least as many shards as readers,
+    otherwise every reader-th line. Lines are encoded in batches of `encode_batch_size`
+    with the fast tokenizer, and `shuffle_buffer_size` > 0 shuffles approximately
+    with a bounded buffer seeded by (seed, epoch, reader). Call set_epoch before
+    each epoch for a different order.
+    '''
+
+    def __init__(self, data_folder, split, shuffle_buffer_size=STREAM_SHUFFLE_BUFFER, seed=0,
+                 encode_batch_size=STREAM_ENCODE_BATCH, prune_schema=False, shards=None):
+        self.shards = shards or find_shards(data_folder, split)
+        self.has_targets = all(sql_path is not None for _, sql_path in self.shards)
+        if not self.has_targets and any(sql_path is not None for _, sql_path in self.shards):
+            raise ValueError(f"Some {split} shards are missing their .sql file")
+        self.shuffle_buffer_size = shuffle_buffer_size
+        self.seed = seed
+        self.epoch = 0
+        self.encode_batch_size = encode_batch_size
+        self.prune_schema = prune_schema
+        self._tokenizer = None
+        self._shard_lengths = None
+
+    @property
+    def tokenizer(self):
+        # Loaded on first use, i.e. inside each DataLoader worker
+        if self._tokenizer is None:
+            self._tokenizer = get_tokenizer()
+        return self._tokenizer
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def shard_lengths(self):
+        '''Lines per .nl shard, counting a last line without a newline (read once, not kept in memory).'''
+        if self._shard_lengths is None:
+            self._shard_lengths = []
+            for nl_path, _ in self.shards:
+                count, last = 0, b'\n'
+                with open(nl_path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(1 << 20), b''):
+                        count += chunk.count(b'\n')
+                        last = chunk[-1:]
+                self._shard_lengths.append(count + (last != b'\n'))
+        return self._shard_lengths
+
+    def __len__(self):
+        return sum(self.shard_lengths())
+
+    def _reader_lengths(self, num_readers):
+        '''Examples each of `num_readers` readers yields (see _lines for the split).'''
+        lengths = self.shard_lengths()
+        if len(self.shards) >= num_readers:
+            return [sum(lengths[reader::num_readers]) for reader in range(num_readers)]
+        total = sum(lengths)
+        return [(total - reader + num_readers - 1) // num_readers for reader in range(num_readers)]
+
+    def num_batches(self, batch_size, num_workers=0):
+        '''
+        Batches a DataLoader over this dataset yields on this rank per epoch. Every
+        worker ends with its own partial batch, so this can exceed
+        ceil(len(self) / batch_size), which is what len(DataLoader) reports.
+        '''
+        num_workers = max(num_workers, 1)
+        rank, world_size = 0, 1
+        if torch.distributed.is_available() and torch.distributed.is_initialized():
+            rank, world_size = torch.distributed.get_rank(), torch.distributed.get_world_size()
+        lengths = self._reader_lengths(world_size * num_workers)[rank * num_workers:(rank + 1) * num_workers]
+        return sum((length + batch_size - 1) // batch_size for length in lengths)
+
+    def _reader(self):
+        '''(reader index, number of readers) over DataLoader workers and distributed ranks.'''
+        worker = get_worker_info()
+        worker_id, num_workers = (worker.id, worker.num_workers) if worker is not None else (0, 1)
+        rank, world_size = 0, 1
+        if torch.distributed.is_available() and torch.distributed.is_initialized():
+            rank, world_size = torch.distributed.get_rank(), torch.distributed.get_world_size()
+        return rank * num_workers + worker_id, world_size * num_workers
+
+    def _lines(self, reader, num_readers):
+        '''(global line index, nl, sql) for this reader's part of the stream.'''
+        by_shard = len(self.shards) >= num_readers
+        # Index of each shard's first line, so idx is unique across readers
+        starts = np.concatenate([[0], np.cumsum(self.shard_lengths())]) if by_shard else None
+        position = 0
+        for shard, (nl_path, sql_path) in enumerate(self.shards):
+            if by_shard:
+                if shard % num_readers != reader:
+                    continue
+                position = int(starts[shard])
+            with open(nl_path, 'r') as nl_file, open(sql_path or os.devnull, 'r') as sql_file:
+                sql_lines = sql_file if sql_path is not None else []
+                for nl, sql in zip_longest(nl_file, sql_lines):
+                    if nl is None or (sql is None and sql_path is not None):
+                        raise ValueError(f"{nl_path} and {sql_path} have different line counts")
+                    if by_shard or position % num_readers == reader:
+                        yield position, nl.strip(), sql.strip() if sql is not None else None
+                    position += 1
+
+    def _encode(self, batch):
+        '''Tokenize a batch of (idx, nl, sql) lines into T5Dataset-style example dicts.'''
+        fields = {}
+        input_formatter = partial(format_enhanced_input, prune_schema=True) if self.prune_schema else format_enhanced_input
+        tokens, lengths = _encode_chunk(self.tokenizer, [nl for _, nl, _ in batch], input_formatter)
+        fields['encoder_input'] = (tokens, np.concatenate([[0], np.cumsum(lengths)]))
+        if self.has_targets:
+            tokens, lengths = _encode_chunk(self.tokenizer, [sql for _, _, sql in batch], format_enhanced_target)
+            offsets = np.concatenate([[0], np.cumsum(lengths)])
+            fields['decoder_input'] = (shift_right(tokens, offsets, self.tokenizer.pad_token_id), offsets)
+            fields['decoder_target'] = (tokens, offsets)
+        for i, (idx, nl, _) in enumerate(batch):
+            example = {name: torch.from_numpy(tokens[offsets[i]:offsets[i + 1]])
+                       for name, (tokens, offsets) in fields.items()}
+            example['nl_query'] = nl
+            example['idx'] = idx
+            yield example
+
+    def _examples(self, reader, num_readers):
+        batch = []
+        for line in self._lines(reader, num_readers):
+            batch.append(line)
+            if len(batch) == self.encode_batch_size:
+                yield from self._encode(batch)
+                batch = []
+        if batch:
+            yield from self._encode(batch)
+
+    def __iter__(self):
+        reader, num_readers = self._reader()
+        examples = self._examples(reader, num_readers)
+        if self.shuffle_buffer_size > 0:
+            rng = random.Random(f"{self.seed}-{self.epoch}-{reader}")
+            examples = shuffle_buffer(examples, self.shuffle_buffer_size, rng)
+        return examples
+
+def get_dataloader(batch_size, split, sort_by_length=False, sort_by_output_length=False, max_tokens=None,
+                   pack_sequences=False, prune_schema=False, streaming=False,
+                   shuffle_buffer_size=STREAM_SHUFFLE_BUFFER, num_workers=0, seed=0):
+    '''
+    max_tokens: For the train split, batch by a padded encoder+decoder token budget
+                (TokenBudgetBatchSampler) instead of a fixed batch_size.
+    pack_sequences: For the train split, concatenate each batch's examples into packed
+                    rows with segment ids (sequence_packing.packed_collate_fn).
+    prune_schema: Include only the question-relevant schema in each input (schema_linking).
+    streaming: For the train split, stream and tokenize train.nl/train.sql (or train-*.nl/.sql
+               shards) on the fly with StreamingT5Dataset, shuffling through a buffer of
+               `shuffle_buffer_size` examples in each of `num_workers` DataLoader workers.
+    seed: Seed of the train split's per-epoch batch order (or streaming shuffle).
+    '''
     data_folder = 'data'
-    dset = T5Dataset(data_folder, split)
     shuffle = split == "train"
+    if shuffle and pack_sequences and max_tokens:
+        # Packing regroups each token-budget batch into fewer rows, while the LR schedule
+        # and resume position count the sampler's unpacked batches
+        raise ValueError("pack_sequences and max_tokens cannot be combined; choose one batching scheme")
     collate_fn = normal_collate_fn if split != "test" else test_collate_fn
+    if shuffle and pack_sequences:
+        from sequence_packing import packed_collate_fn
+        collate_fn = packed_collate_fn
+
+    if shuffle and streaming:
+        if max_tokens:
+            raise ValueError("Token-budget batching needs example lengths up front and cannot stream")
+        dset = StreamingT5Dataset(data_folder, split, shuffle_buffer_size=shuffle_buffer_size, seed=seed,
+                                  prune_schema=prune_schema)
+        return DataLoader(dset, batch_size=batch_size, collate_fn=collate_fn, num_workers=num_workers)
 
-    dataloader = DataLoader(dset, batch_size=batch_size, shuffle=shuffle, collate_fn=collate_fn)
+    dset = T5Dataset(data_folder, split, prune_schema=prune_schema)
+    if shuffle and max_tokens:
+        batch_sampler = TokenBudgetBatchSampler(dset, max_tokens, seed=seed)
+        dataloader = DataLoader(dset, batch_sampler=batch_sampler, collate_fn=collate_fn)
+    elif not shuffle and (sort_by_length or sort_by_output_length):
+        sampler = LengthSortedSampler(dset, by_output_length=sort_by_output_length)
+        dataloader = DataLoader(dset, batch_size=batch_size, sampler=sampler, collate_fn=collate_fn)
+    elif shuffle:
+        # Seeded and checkpointable, so a preempted run resumes mid-epoch
+        dataloader = DataLoader(dset, batch_sampler=ShuffledBatchSampler(dset, batch_size, seed=seed), collate_fn=collate_fn)
+    else:
+        dataloader = DataLoader(dset, batch_size=batch_size, shuffle=False, collate_fn=collate_fn)
     return dataloader
 
-def load_t5_data(batch_size, test_batch_size):
-    train_loader = get_dataloader(batch_size, "train")
-    dev_loader = get_dataloader(test_batch_size, "dev")
-    test_loader = get_dataloader(test_batch_size, "test")
+def load_t5_data(batch_size, test_batch_size, sort_by_length=False, sort_by_output_length=False, max_tokens=None,
+                 pack_sequences=False, prune_schema=False, streaming=False,
+                 shuffle_buffer_size=STREAM_SHUFFLE_BUFFER, num_workers=0, seed=0):
+    train_loader = get_dataloader(batch_size, "train", max_tokens=max_tokens, pack_sequences=pack_sequences,
+                                  prune_schema=prune_schema, streaming=streaming,
+                                  shuffle_buffer_size=shuffle_buffer_size, num_workers=num_workers, seed=seed)
+    dev_loader = get_dataloader(test_batch_size, "dev", sort_by_length, sort_by_output_length, prune_schema=prune_schema)
+    test_loader = get_dataloader(test_batch_size, "test", sort_by_length, sort_by_output_length, prune_schema=prune_schema)
     
     return train_loader, dev_loader, test_loader
 
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Load test for serve_t5.py: fire concurrent /predict requests and report throughput and latency
+"""
+
+import argparse
+import json
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from load_data import load_lines
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Load test the text-to-SQL server')
+    parser.add_argument('--url', type=str, default='http://127.0.0.1:8000')
+    parser.add_argument('--questions', type=str, default='data/dev.nl')
+    parser.add_argument('--num_requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--execute', action='store_true', help='Ask the server to execute the SQL too')
+    return parser.parse_args()
+
+
+def post_question(url, question, execute):
+    payload = json.dumps({'question': question, 'execute': execute}).encode('utf-8')
+    request = urllib.request.Request(f"{url}/predict", data=payload, headers={'Content-Type': 'application/json'})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request) as response:
+            json.loads(response.read())
+        ok = True
+    except Exception:
+        ok = False
+    return (time.perf_counter() - start) * 1000, ok
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))] if values else 0.0
+
+
+def main():
+    args = get_args()
+    questions = load_lines(args.questions)
+    workload = [questions[i % len(questions)] for i in range(args.num_requests)]
+
+    print(f"Sending {len(workload)} requests with concurrency {args.concurrency} to {args.url}")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        results = list(pool.map(lambda q: post_question(args.url, q, args.execute), workload))
+    elapsed = time.perf_counter() - start
+
+    latencies = [latency for latency, ok in results if ok]
+    failures = sum(1 for _, ok in results if not ok)
+    print(f"Completed in {elapsed:.2f}s: {len(latencies) / elapsed:.2f} requests/s, {failures} failures")
+    print(f"Client latency ms: p50={percentile(latencies, 50):.1f} p95={percentile(latencies, 95):.1f} "
+          f"p99={percentile(latencies, 99):.1f}")
+
+    with urllib.request.urlopen(f"{args.url}/metrics") as response:
+        metrics = json.loads(response.read())
+    print(f"Server: {metrics['batches']} batches, avg batch size {metrics['avg_batch_size']:.2f}, "
+          f"latency ms p50={metrics['latency_ms']['p50']:.1f} p95={metrics['latency_ms']['p95']:.1f}")
+
+
+if __name__ == "__main__":
+    main()
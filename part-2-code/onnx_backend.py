@@ -0,0 +1,255 @@
+"""
+ONNX export and onnxruntime generation backend for T5 text-to-SQL model.
+
+`export_onnx` turns a T5 checkpoint into three graphs: the encoder, the first
+decoder step (which also produces the cross-attention cache) and the decoder
+with past key/values. `OnnxT5Generator` drives them with onnxruntime on CPU and
+exposes a `generate`-like interface, so it can be passed to
+eval_utils.eval_epoch in place of the PyTorch model.
+
+onnxruntime is only imported when the generator is created.
+"""
+
+import os
+import time
+from typing import List
+
+import numpy as np
+import torch
+
+from prediction_cache import model_fingerprint
+
+ENCODER_FILE = 'encoder.onnx'
+DECODER_INIT_FILE = 'decoder_init.onnx'
+DECODER_WITH_PAST_FILE = 'decoder_with_past.onnx'
+# prediction_cache.model_fingerprint of the PyTorch model the graphs were exported from
+SOURCE_FINGERPRINT_FILE = 'source_fingerprint.txt'
+ONNX_OPSET = 14
+
+
+def _past_names(num_layers: int, prefix: str) -> List[str]:
+    names = []
+    for i in range(num_layers):
+        names += [f"{prefix}.{i}.decoder.key", f"{prefix}.{i}.decoder.value",
+                  f"{prefix}.{i}.encoder.key", f"{prefix}.{i}.encoder.value"]
+    return names
+
+
+class _EncoderWrapper(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.encoder = model.get_encoder()
+
+    def forward(self, input_ids, attention_mask):
+        return self.encoder(input_ids=input_ids, attention_mask=attention_mask, return_dict=False)[0]
+
+
+class _DecoderWrapper(torch.nn.Module):
+    """Decoder step returning logits and the flattened KV cache (with or without past inputs)."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, decoder_input_ids, encoder_hidden_states, encoder_attention_mask, *past_flat):
+        past = None
+        if past_flat:
+            past = tuple(tuple(past_flat[i:i + 4]) for i in range(0, len(past_flat), 4))
+        outputs = self.model(
+            encoder_outputs=(encoder_hidden_states,),
+            attention_mask=encoder_attention_mask,
+            decoder_input_ids=decoder_input_ids,
+            past_key_values=past,
+            use_cache=True,
+            return_dict=True,
+        )
+        present = [t for layer in outputs.past_key_values for t in layer]
+        return (outputs.logits, *present)
+
+
+@torch.no_grad()
+def export_onnx(model, output_dir: str, opset: int = ONNX_OPSET) -> str:
+    """
+    Export a T5ForConditionalGeneration model to ONNX encoder/decoder graphs.
+
+    Args:
+        model: Trained T5 model (exported on CPU in fp32)
+        output_dir: Directory for encoder.onnx, decoder_init.onnx and decoder_with_past.onnx
+        opset: ONNX opset version
+
+    Returns:
+        output_dir
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    model = model.to('cpu').eval()
+    model.config.save_pretrained(output_dir)
+    num_layers = model.config.num_decoder_layers
+
+    input_ids = torch.ones(2, 8, dtype=torch.long)
+    attention_mask = torch.ones(2, 8, dtype=torch.long)
+    decoder_input_ids = torch.zeros(2, 1, dtype=torch.long)
+
+    encoder = _EncoderWrapper(model)
+    torch.onnx.export(
+        encoder, (input_ids, attention_mask), os.path.join(output_dir, ENCODER_FILE),
+        input_names=['input_ids', 'attention_mask'],
+        output_names=['encoder_hidden_states'],
+        dynamic_axes={'input_ids': {0: 'batch', 1: 'encoder_length'},
+                      'attention_mask': {0: 'batch', 1: 'encoder_length'},
+                      'encoder_hidden_states': {0: 'batch', 1: 'encoder_length'}},
+        opset_version=opset, do_constant_folding=True,
+    )
+    encoder_hidden_states = encoder(input_ids, attention_mask)
+
+    decoder = _DecoderWrapper(model)
+    present_names = _past_names(num_layers, 'present')
+    past_names = _past_names(num_layers, 'past_key_values')
+    common_axes = {'decoder_input_ids': {0: 'batch', 1: 'decoder_length'},
+                   'encoder_hidden_states': {0: 'batch', 1: 'encoder_length'},
+                   'encoder_attention_mask': {0: 'batch', 1: 'encoder_length'},
+                   'logits': {0: 'batch', 1: 'decoder_length'}}
+    present_axes = {name: {0: 'batch', 2: 'past_length' if '.decoder.' in name else 'encoder_length'}
+                    for name in present_names}
+
+    torch.onnx.export(
+        decoder, (decoder_input_ids, encoder_hidden_states, attention_mask),
+        os.path.join(output_dir, DECODER_INIT_FILE),
+        input_names=['decoder_input_ids', 'encoder_hidden_states', 'encoder_attention_mask'],
+        output_names=['logits'] + present_names,
+        dynamic_axes={**common_axes, **present_axes},
+        opset_version=opset, do_constant_folding=True,
+    )
+
+    init_outputs = decoder(decoder_input_ids, encoder_hidden_states, attention_mask)
+    past_axes = {name: {0: 'batch', 2: 'past_length' if '.decoder.' in name else 'encoder_length'}
+                 for name in past_names}
+    torch.onnx.export(
+        decoder, (decoder_input_ids, encoder_hidden_states, attention_mask, *init_outputs[1:]),
+        os.path.join(output_dir, DECODER_WITH_PAST_FILE),
+        input_names=['decoder_input_ids', 'encoder_hidden_states', 'encoder_attention_mask'] + past_names,
+        output_names=['logits'] + present_names,
+        dynamic_axes={**common_axes, **past_axes, **present_axes},
+        opset_version=opset, do_constant_folding=True,
+    )
+    with open(os.path.join(output_dir, SOURCE_FINGERPRINT_FILE), 'w') as f:
+        f.write(model_fingerprint(model))
+    print(f"Exported ONNX graphs to {output_dir}")
+    return output_dir
+
+
+def export_onnx_if_stale(model, output_dir: str) -> str:
+    """Export unless `output_dir` already holds graphs exported from these exact weights."""
+    fingerprint_path = os.path.join(output_dir, SOURCE_FINGERPRINT_FILE)
+    if os.path.exists(fingerprint_path) and os.path.exists(os.path.join(output_dir, DECODER_WITH_PAST_FILE)):
+        with open(fingerprint_path, 'r') as f:
+            if f.read().strip() == model_fingerprint(model):
+                return output_dir
+    return export_onnx(model, output_dir)
+
+
+class OnnxT5Generator:
+    """
+    Greedy T5 generation with onnxruntime on CPU.
+
+    Mirrors the parts of the `model.generate` interface used by eval_utils.eval_epoch
+    (including `stopping_criteria`); beam search and logits processors are not supported.
+    """
+
+    def __init__(self, onnx_dir: str, num_threads: int = 0):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise ImportError("The onnx backend requires onnxruntime (pip install onnxruntime)") from e
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads > 0:
+            options.intra_op_num_threads = num_threads
+        providers = ['CPUExecutionProvider']
+
+        self.onnx_dir = onnx_dir
+        start = time.perf_counter()
+        self.encoder = ort.InferenceSession(os.path.join(onnx_dir, ENCODER_FILE), options, providers=providers)
+        self.decoder_init = ort.InferenceSession(os.path.join(onnx_dir, DECODER_INIT_FILE), options, providers=providers)
+        self.decoder_with_past = ort.InferenceSession(os.path.join(onnx_dir, DECODER_WITH_PAST_FILE), options, providers=providers)
+        # The exporter may drop inputs a graph does not use (e.g. hidden states once cross-attention is cached)
+        self.with_past_inputs = {i.name for i in self.decoder_with_past.get_inputs()}
+        self.past_names = _past_names(self._num_layers(), 'past_key_values')
+        print(f"Loaded ONNX sessions from {onnx_dir} in {time.perf_counter() - start:.2f}s")
+
+    def _num_layers(self):
+        present = [o.name for o in self.decoder_init.get_outputs() if o.name.startswith('present')]
+        return len(present) // 4
+
+    # eval_epoch toggles train/eval mode on the model it is given
+    def eval(self):
+        return self
+
+    def train(self, mode=True):
+        return self
+
+    def generate(self, input_ids, attention_mask, decoder_start_token_id=0, max_length=256,
+                 num_beams=1, pad_token_id=0, eos_token_id=1, logits_processor=None,
+                 stopping_criteria=None, **kwargs):
+        if num_beams > 1 or kwargs.get('num_return_sequences', 1) > 1:
+            raise ValueError("The onnx backend only supports greedy decoding (num_beams=1)")
+        if logits_processor:
+            raise ValueError("The onnx backend does not support logits processors")
+
+        if torch.is_tensor(decoder_start_token_id):
+            decoder_start_token_id = int(decoder_start_token_id.reshape(-1)[0])
+        ids = input_ids.cpu().numpy().astype(np.int64)
+        mask = attention_mask.cpu().numpy().astype(np.int64)
+        batch_size = ids.shape[0]
+
+        hidden = self.encoder.run(None, {'input_ids': ids, 'attention_mask': mask})[0]
+        sequences = np.full((batch_size, 1), decoder_start_token_id, dtype=np.int64)
+        finished = np.zeros(batch_size, dtype=bool)
+
+        outputs = self.decoder_init.run(None, {
+            'decoder_input_ids': sequences,
+            'encoder_hidden_states': hidden,
+            'encoder_attention_mask': mask,
+        })
+        while True:
+            logits, past = outputs[0], outputs[1:]
+            next_tokens = logits[:, -1].argmax(axis=-1)
+            next_tokens = np.where(finished, pad_token_id, next_tokens).astype(np.int64)
+            sequences = np.concatenate([sequences, next_tokens[:, None]], axis=1)
+            finished |= next_tokens == eos_token_id
+            if stopping_criteria:
+                finished |= stopping_criteria(torch.from_numpy(sequences), None).cpu().numpy().astype(bool)
+            if finished.all() or sequences.shape[1] >= max_length:
+                break
+            feed = {
+                'decoder_input_ids': next_tokens[:, None],
+                'encoder_hidden_states': hidden,
+                'encoder_attention_mask': mask,
+            }
+            feed.update(zip(self.past_names, past))
+            feed = {name: value for name, value in feed.items() if name in self.with_past_inputs}
+            outputs = self.decoder_with_past.run(None, feed)
+
+        return torch.from_numpy(sequences).to(input_ids.device)
+
+
+if __name__ == "__main__":
+    # Export a checkpoint: python onnx_backend.py --experiment_name NAME [--finetune] [--output_dir DIR]
+    import argparse
+    from types import SimpleNamespace
+    from t5_utils import load_model_from_checkpoint
+
+    parser = argparse.ArgumentParser(description='Export a best_model.pt checkpoint to ONNX')
+    parser.add_argument('--experiment_name', type=str, required=True)
+    parser.add_argument('--finetune', action='store_true')
+    parser.add_argument('--output_dir', type=str, default=None,
+                        help='Defaults to <checkpoint_dir>/onnx')
+    cli = parser.parse_args()
+
+    model_type = 'ft' if cli.finetune else 'scr'
+    checkpoint_dir = os.path.join('runs', f'{model_type}_experiments', cli.experiment_name, 'checkpoints')
+    model = load_model_from_checkpoint(
+        SimpleNamespace(finetune=cli.finetune, experiment_name=cli.experiment_name, checkpoint_dir=checkpoint_dir),
+        best=True,
+    )
+    export_onnx(model, cli.output_dir or os.path.join(checkpoint_dir, 'onnx'))
@@ -0,0 +1,118 @@
+"""
+On-disk prediction cache for T5 text-to-SQL generation.
+
+Predictions are keyed by (model content hash, encoder input ids, generation
+config including the SQL post-processing version), so re-running evaluation or
+test inference with an unchanged checkpoint and unchanged inputs reads SQL back
+instead of calling `generate`.
+Entries live in a small SQLite table under the cache directory.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+from typing import Dict, List, Optional
+
+import torch
+
+DEFAULT_CACHE_DIR = os.path.join('runs', 'prediction_cache')
+
+
+def _update_hash(digest, value):
+    if torch.is_tensor(value):
+        tensor = value.detach().cpu()
+        if tensor.is_quantized:
+            tensor = tensor.dequantize()  # folds in the scales and zero points
+        digest.update(str(tensor.dtype).encode())
+        digest.update(tensor.contiguous().reshape(-1).view(torch.uint8).numpy().tobytes())
+    elif isinstance(value, (tuple, list)):
+        for item in value:
+            _update_hash(digest, item)
+    else:
+        # Non-tensor state (e.g. the dtype entry of quantized packed params)
+        digest.update(repr(value).encode())
+
+
+def model_fingerprint(model) -> str:
+    """
+    Content hash of a model's weights.
+
+    Works for fp32 and dynamically quantized models (hashes the state dict) and for
+    onnx_backend.OnnxT5Generator (hashes the exported graph files).
+    """
+    digest = hashlib.sha256()
+    onnx_dir = getattr(model, 'onnx_dir', None)
+    if onnx_dir is not None:
+        for name in sorted(os.listdir(onnx_dir)):
+            path = os.path.join(onnx_dir, name)
+            if os.path.isfile(path):
+                digest.update(name.encode())
+                with open(path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(1 << 20), b''):
+                        digest.update(chunk)
+        return digest.hexdigest()
+
+    for name, value in model.state_dict().items():
+        digest.update(name.encode())
+        _update_hash(digest, value)
+    return digest.hexdigest()
+
+
+class PredictionCache:
+    """
+    Maps (model fingerprint, generation config, encoder input ids) to the final SQL string.
+
+    Args:
+        cache_dir: Directory holding predictions.db
+        fingerprint: model_fingerprint(model) of the model that produces the predictions
+        generation_config: Every setting that changes the output (beams, max length,
+                           candidates, rerank flag, post-processing and reranking
+                           versions, ...); serialized into the key
+    """
+
+    def __init__(self, cache_dir: str, fingerprint: str, generation_config: Dict):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, 'predictions.db')
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS predictions (key TEXT PRIMARY KEY, sql TEXT)")
+        self.prefix = hashlib.sha256(
+            (fingerprint + json.dumps(generation_config, sort_keys=True)).encode()
+        ).hexdigest()
+        self.hits = 0
+        self.misses = 0
+
+    def batch_keys(self, encoder_ids, encoder_mask) -> List[str]:
+        """One key per example from its unpadded encoder input ids."""
+        keys = []
+        for ids, mask in zip(encoder_ids.cpu(), encoder_mask.cpu()):
+            tokens = ids[mask.bool()].to(torch.int64).numpy().tobytes()
+            keys.append(hashlib.sha256(self.prefix.encode() + tokens).hexdigest())
+        return keys
+
+    def get_many(self, keys: List[str]) -> List[Optional[str]]:
+        found = {}
+        for start in range(0, len(keys), 500):  # stay under SQLite's bound-parameter limit
+            chunk = keys[start:start + 500]
+            rows = self.conn.execute(
+                f"SELECT key, sql FROM predictions WHERE key IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchall()
+            found.update(rows)
+        results = [found.get(key) for key in keys]
+        hits = sum(result is not None for result in results)
+        self.hits += hits
+        self.misses += len(keys) - hits
+        return results
+
+    def put_many(self, keys: List[str], predictions: List[str]):
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO predictions (key, sql) VALUES (?, ?)",
+                                  list(zip(keys, predictions)))
+
+    def close(self):
+        self.conn.close()
+
+
+def get_prediction_cache(model, generation_config: Dict, cache_dir: str = DEFAULT_CACHE_DIR) -> PredictionCache:
+    """Open the cache for the current weights of `model` (hashed on every call, since weights may keep training)."""
+    return PredictionCache(cache_dir, model_fingerprint(model), generation_config)
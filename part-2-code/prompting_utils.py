@@ -3,9 +3,10 @@ import os
 
 def read_schema(schema_path):
     '''
-    Read the .schema file
+    Read the .schema file (the database is used instead when present), one table per line
     '''
-    # TODO
+    from schema_registry import get_schema_registry
+    return get_schema_registry(schema_path=schema_path).full()
 
 def extract_sql_query(response):
     '''
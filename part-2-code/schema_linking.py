@@ -0,0 +1,290 @@
+"""
+Question-aware schema pruning for T5 inputs.
+
+Instead of the fixed six tables of `format_schema_compact`, each question gets
+only the tables and columns it refers to:
+  - phrases are normalized with data/alignment.txt (e.g. "la guardia" -> "lga"),
+  - table and column `utt` phrases from flight_database.schema are matched
+    against the question,
+  - question n-grams are matched against values of the indexed text columns of
+    the database (city names, airport and airline codes, ...), or against the
+    string literals of train.sql when the database is absent,
+and the selected tables are connected to `flight` along the schema's join links
+so the rendering always contains a joinable subset. When that rendering is
+longer than the compact schema, the compact schema is used instead.
+
+Tables a question only implies (e.g. fare_basis behind "first class") can still
+be missed; evaluate_schema_pruning.py reports gold-table recall, misses per
+table and how often the compact fallback is taken.
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+from collections import deque
+from typing import Dict, List, Set, Tuple
+
+from schema_registry import get_schema_registry, COMPACT_TABLES
+
+ALIGNMENT_PATH = os.path.join('data', 'alignment.txt')
+TRAIN_SQL_PATH = os.path.join('data', 'train.sql')
+ROOT_TABLE = 'flight'
+# Always shown for flight: the columns almost every ATIS query joins or filters on
+ROOT_COLUMNS = ['flight_id', 'from_airport', 'to_airport', 'airline_code']
+MAX_COLUMNS = 8
+MAX_VALUE_NGRAM = 4
+# Values too common as English words to count as a database match
+VALUE_STOPWORDS = {'the', 'and', 'for', 'from', 'all', 'are', 'any', 'has', 'one', 'two', 'day', 'way', 'can',
+                   'yes', 'now', 'new', 'how', 'may', 'let', 'see', 'get', 'use', 'out', 'our', 'not'}
+
+# Joins used throughout ATIS gold SQL that flight_database.schema does not list as links
+EXTRA_LINKS = {
+    'flight': {'equipment_sequence': 'aircraft_code_sequence', 'days': 'flight_days'},
+    'equipment_sequence': {'flight': 'aircraft_code_sequence'},
+    'days': {'flight': 'days_code', 'date_day': 'day_name'},
+    'date_day': {'days': 'day_name'},
+}
+MONTHS = ['january', 'february', 'march', 'april', 'may', 'june', 'july', 'august',
+          'september', 'october', 'november', 'december']
+WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+# Question words that imply a table without naming it or one of its values
+TABLE_KEYWORDS = {
+    'fare': ['fare', 'cost', 'price', 'cheap', 'cheapest', 'expensive', 'round trip', 'one way', 'dollar'],
+    'date_day': MONTHS + WEEKDAYS + ['tomorrow', 'today', 'yesterday'],
+    'flight_stop': ['stop', 'stopover', 'layover'],
+    'aircraft': ['plane', 'aircraft', 'jet', 'seat'],
+    'ground_service': ['ground', 'limousine', 'taxi', 'car'],
+    'fare_basis': ['class', 'coach', 'economy', 'business', 'thrift'],
+}
+# Tables gold SQL joins through whenever the key table is used
+IMPLIED_TABLES = {'fare': ['flight_fare'], 'date_day': ['days']}
+
+# Bump when the linking rules change (part of the tokenized dataset cache key)
+SCHEMA_LINKING_VERSION = 2
+
+
+def _words(text: str) -> List[str]:
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+
+def _stem(word: str) -> str:
+    # Crude plural strip + prefix stem so fares/fare, departure/departing and arrival/arriving match
+    if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+        word = word[:-1]
+    return word[:5]
+
+
+def load_alignment(path: str = ALIGNMENT_PATH) -> List[Tuple[List[str], List[str]]]:
+    """(phrase words, replacement words) pairs, longest phrase first."""
+    pairs = []
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            for line in f:
+                parts = line.rstrip('\n').split('\t')
+                if len(parts) == 2:
+                    pairs.append((_words(parts[0]), _words(parts[1])))
+    return sorted(pairs, key=lambda pair: -len(pair[0]))
+
+
+class SchemaLinker:
+    """
+    Selects the tables and columns relevant to a question and renders them like
+    `format_schema_compact` ("Schema: table(col, ...) | ...").
+    """
+
+    def __init__(self, registry=None, alignment_path: str = ALIGNMENT_PATH, max_columns: int = MAX_COLUMNS,
+                 value_sql_path: str = TRAIN_SQL_PATH):
+        self.registry = registry or get_schema_registry()
+        self.columns = self.registry.column_names()
+        annotations = self.registry.annotations()
+        self.alignment = load_alignment(alignment_path)
+        self.max_columns = max_columns
+
+        self.table_phrases: Dict[str, List[List[str]]] = {}
+        self.column_phrases: Dict[Tuple[str, str], List[str]] = {}
+        for table, cols in annotations['ents'].items():
+            phrases = [[_stem(w) for w in _words(table.replace('_', ' '))]]
+            default = annotations['defaults'].get(table)
+            if default:
+                phrases.append([_stem(w) for w in _words(default['utt'])])
+            phrases.extend([_stem(w) for w in _words(keyword)] for keyword in TABLE_KEYWORDS.get(table, []))
+            self.table_phrases[table] = phrases
+            for col, info in cols.items():
+                self.column_phrases[(table, col)] = [_stem(w) for w in _words(info.get('utt', col))]
+        self.default_columns = {table: d['col'] for table, d in annotations['defaults'].items()}
+
+        # Undirected join graph: table -> {neighbor: join column on this table}
+        self.links: Dict[str, Dict[str, str]] = {table: {} for table in self.columns}
+        for table, neighbors in annotations['links'].items():
+            for neighbor, column in neighbors.items():
+                self.links.setdefault(table, {})[neighbor] = column
+                self.links.setdefault(neighbor, {}).setdefault(table, None)
+        for table, neighbors in EXTRA_LINKS.items():
+            self.links.setdefault(table, {}).update(neighbors)
+
+        indexed = [(table, col) for table, cols in annotations['ents'].items()
+                   for col, info in cols.items() if info.get('index')]
+        self.value_index: Dict[Tuple[str, ...], Set[Tuple[str, str]]] = {}
+        if not self._index_db_values(indexed):
+            self._index_sql_literals(value_sql_path)
+
+    def _add_value(self, value: str, table: str, col: str):
+        words = tuple(_words(value))
+        if (not words or len(words) > MAX_VALUE_NGRAM or words[0].isdigit()
+                or (len(words) == 1 and (len(words[0]) < 3 or words[0] in VALUE_STOPWORDS))):
+            return
+        self.value_index.setdefault(words, set()).add((table, col))
+
+    def _index_db_values(self, indexed) -> bool:
+        """Distinct text values of the indexed columns; False when the database is absent."""
+        db_path = self.registry.db_path
+        if not os.path.exists(db_path):
+            return False
+        conn = sqlite3.connect(db_path)
+        try:
+            for table, col in indexed:
+                if col not in self.columns.get(table, []):
+                    continue
+                for (value,) in conn.execute(f"SELECT DISTINCT {col} FROM {table}"):
+                    if isinstance(value, str):
+                        self._add_value(value, table, col)
+        finally:
+            conn.close()
+        return True
+
+    def _index_sql_literals(self, sql_path: str):
+        """String literals compared against `table_N.column` in the training SQL (e.g. city_name 'DENVER')."""
+        if not sql_path or not os.path.exists(sql_path):
+            return
+        with open(sql_path, 'r') as f:
+            for alias_table, col, value in re.findall(r"\b([a-z_]+)_\d+\.([a-z_]+)\s*=\s*'([^']*)'", f.read()):
+                if col in self.columns.get(alias_table, []):
+                    self._add_value(value, alias_table, col)
+
+    def normalize(self, question: str) -> List[str]:
+        """Question words with alignment.txt phrases replaced by their canonical form."""
+        words = _words(question)
+        out, i = [], 0
+        while i < len(words):
+            for phrase, replacement in self.alignment:
+                if phrase and words[i:i + len(phrase)] == phrase:
+                    out.extend(replacement)
+                    i += len(phrase)
+                    break
+            else:
+                out.append(words[i])
+                i += 1
+        return out
+
+    @staticmethod
+    def _contains(stems: List[str], phrase: List[str]) -> bool:
+        n = len(phrase)
+        return n > 0 and any(stems[i:i + n] == phrase for i in range(len(stems) - n + 1))
+
+    def link(self, question: str) -> Dict[str, List[str]]:
+        """Ordered table -> columns selection for `question`."""
+        words = self.normalize(question)
+        stems = [_stem(w) for w in words]
+
+        tables = {ROOT_TABLE}
+        matched_columns: Dict[str, Set[str]] = {}
+        for table, phrases in self.table_phrases.items():
+            if any(self._contains(stems, phrase) for phrase in phrases):
+                tables.add(table)
+        for (table, col), phrase in self.column_phrases.items():
+            if len(phrase) > 1 and self._contains(stems, phrase):
+                tables.add(table)
+                matched_columns.setdefault(table, set()).add(col)
+        for n in range(1, MAX_VALUE_NGRAM + 1):
+            for i in range(len(words) - n + 1):
+                for table, col in self.value_index.get(tuple(words[i:i + n]), ()):
+                    tables.add(table)
+                    matched_columns.setdefault(table, set()).add(col)
+
+        for table in list(tables):
+            tables.update(IMPLIED_TABLES.get(table, []))
+        tables = self._connect(tables)
+        return self._select_columns(tables, matched_columns)
+
+    def _connect(self, tables: Set[str]) -> Set[str]:
+        """Add the tables on the shortest join path from each selected table to ROOT_TABLE."""
+        connected = set(tables)
+        for table in tables:
+            parents = {table: None}
+            queue = deque([table])
+            while queue:
+                current = queue.popleft()
+                if current == ROOT_TABLE:
+                    while current is not None:
+                        connected.add(current)
+                        current = parents[current]
+                    break
+                for neighbor in sorted(self.links.get(current, {})):
+                    if neighbor not in parents:
+                        parents[neighbor] = current
+                        queue.append(neighbor)
+        return connected
+
+    def _select_columns(self, tables: Set[str], matched_columns: Dict[str, Set[str]]) -> Dict[str, List[str]]:
+        order = [t for t in COMPACT_TABLES if t in tables] + sorted(tables - set(COMPACT_TABLES))
+        selection = {}
+        for table in order:
+            if table not in self.columns:
+                continue
+            wanted = set(matched_columns.get(table, ()))
+            wanted.update(col for neighbor, col in self.links.get(table, {}).items() if col and neighbor in tables)
+            if table == ROOT_TABLE:
+                wanted.update(ROOT_COLUMNS)
+            if table in self.default_columns:
+                wanted.add(self.default_columns[table])
+            selection[table] = [col for col in self.columns[table] if col in wanted][:self.max_columns]
+        return selection
+
+    def render_pruned(self, question: str) -> str:
+        """The linked tables and columns, without the compact-schema fallback."""
+        parts = [f"{table}({', '.join(cols)})" for table, cols in self.link(question).items()]
+        return "Schema: " + " | ".join(parts)
+
+    def render(self, question: str) -> str:
+        pruned = self.render_pruned(question)
+        compact = self.registry.compact()
+        return pruned if len(pruned) <= len(compact) else compact
+
+
+_LINKERS: Dict[str, SchemaLinker] = {}
+
+def get_schema_linker() -> SchemaLinker:
+    """Shared linker for the current schema (the value index is built once per process)."""
+    registry = get_schema_registry()
+    if registry.fingerprint not in _LINKERS:
+        _LINKERS[registry.fingerprint] = SchemaLinker(registry)
+    return _LINKERS[registry.fingerprint]
+
+
+_FINGERPRINTS: Dict[Tuple[str, str], str] = {}
+
+def schema_linking_fingerprint(alignment_path: str = ALIGNMENT_PATH, value_sql_path: str = TRAIN_SQL_PATH) -> str:
+    """
+    Hash of what pruned inputs depend on besides the schema: the linking rules
+    version, alignment.txt and the value source (the database, or train.sql when
+    the database is absent). Computed without building the linker.
+    """
+    db_path = get_schema_registry().db_path
+    value_path = db_path if os.path.exists(db_path) else value_sql_path
+    key = (alignment_path, value_path or '')
+    if key not in _FINGERPRINTS:
+        digest = hashlib.sha256(f"version={SCHEMA_LINKING_VERSION}".encode())
+        for label, path in (('alignment', alignment_path), ('values', value_path)):
+            digest.update(f";{label}={os.path.basename(path or '')}:".encode())
+            if path and os.path.exists(path):
+                with open(path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(1 << 20), b''):
+                        digest.update(chunk)
+        _FINGERPRINTS[key] = digest.hexdigest()
+    return _FINGERPRINTS[key]
+
+
+def format_schema_pruned(question: str) -> str:
+    """Question-specific replacement for schema_utils.format_schema_compact."""
+    return get_schema_linker().render(question)
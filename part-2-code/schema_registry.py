@@ -0,0 +1,114 @@
+"""
+Process-wide registry for the flight database schema.
+
+The schema is read once, from the SQLite database when it exists and otherwise
+from data/flight_database.schema, and every rendering of it (the compact string
+put into each T5 input, the column lists used by constrained decoding, the
+full listing used for prompting) is memoized. `fingerprint` is a content hash
+of the loaded schema, so caches built from a rendering can be invalidated when
+the schema changes.
+"""
+
+import hashlib
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+
+from schema_utils import DB_PATH, SCHEMA_PATH, get_database_schema, get_schema_from_file
+
+# Key tables for flight queries, in the order they appear in the compact rendering
+COMPACT_TABLES = ['flight', 'city', 'airport', 'airport_service', 'airline', 'aircraft']
+COMPACT_MAX_COLUMNS = 6
+
+
+class SchemaRegistry:
+    """
+    Loads the schema lazily on first use and memoizes its renderings.
+
+    Args:
+        db_path: SQLite database to read the schema from (preferred)
+        schema_path: JSON .schema file used when the database is absent
+    """
+
+    def __init__(self, db_path: str = DB_PATH, schema_path: str = SCHEMA_PATH):
+        self.db_path = db_path
+        self.schema_path = schema_path
+        self.source: Optional[str] = None
+        self._schema: Optional[Dict[str, List[Tuple[str, str]]]] = None
+        self._fingerprint: Optional[str] = None
+        self._renderings: Dict[str, object] = {}
+
+    @property
+    def schema(self) -> Dict[str, List[Tuple[str, str]]]:
+        """Table name -> list of (column_name, column_type)."""
+        if self._schema is None:
+            if os.path.exists(self.db_path):
+                self._schema = get_database_schema(self.db_path)
+                self.source = self.db_path
+            else:
+                self._schema = get_schema_from_file(self.schema_path)
+                self.source = self.schema_path
+        return self._schema
+
+    @property
+    def fingerprint(self) -> str:
+        """Short content hash of the loaded schema (tables, columns and types)."""
+        if self._fingerprint is None:
+            payload = json.dumps(self.schema, sort_keys=True)
+            self._fingerprint = hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+        return self._fingerprint
+
+    def _memoize(self, name, build):
+        if name not in self._renderings:
+            self._renderings[name] = build()
+        return self._renderings[name]
+
+    def column_names(self) -> Dict[str, List[str]]:
+        """Table name -> column names (used by constrained decoding)."""
+        return self._memoize('column_names', lambda: {
+            table: [col[0] for col in cols] for table, cols in self.schema.items()
+        })
+
+    def compact(self) -> str:
+        """Compact schema string put into every enhanced T5 input."""
+        def build():
+            schema_parts = []
+            for table in COMPACT_TABLES:
+                if table in self.schema:
+                    col_names = [col[0] for col in self.schema[table][:COMPACT_MAX_COLUMNS]]
+                    schema_parts.append(f"{table}({', '.join(col_names)})")
+            return "Schema: " + " | ".join(schema_parts)
+        return self._memoize('compact', build)
+
+    def full(self) -> str:
+        """Every table with all of its columns, one table per line (used for prompting)."""
+        return self._memoize('full', lambda: "\n".join(
+            f"{table}({', '.join(col[0] for col in cols)})" for table, cols in sorted(self.schema.items())
+        ))
+
+    def annotations(self) -> Dict:
+        """
+        Raw JSON of the .schema file: per-column `utt` phrases and `index` flags, table
+        defaults and join links. Always read from the file, which the database lacks.
+        """
+        def build():
+            with open(self.schema_path, 'r') as f:
+                return json.load(f)
+        return self._memoize('annotations', build)
+
+    def reload(self):
+        """Drop the loaded schema and every memoized rendering."""
+        self.source = None
+        self._schema = None
+        self._fingerprint = None
+        self._renderings = {}
+
+
+_REGISTRIES: Dict[Tuple[str, str], SchemaRegistry] = {}
+
+def get_schema_registry(db_path: str = DB_PATH, schema_path: str = SCHEMA_PATH) -> SchemaRegistry:
+    """Return the shared registry for these paths, creating it on first use."""
+    key = (db_path, schema_path)
+    if key not in _REGISTRIES:
+        _REGISTRIES[key] = SchemaRegistry(db_path, schema_path)
+    return _REGISTRIES[key]
@@ -5,19 +5,32 @@ This module contains functions for extracting and formatting database schema
 information to enhance the model input.
 """
 
+import json
 import sqlite3
 from typing import Dict, List, Tuple
 
 DB_PATH = 'data/flight_database.db'
+SCHEMA_PATH = 'data/flight_database.schema'
 
-def get_database_schema() -> Dict[str, List[Tuple[str, str]]]:
+# Bump when format_enhanced_input / format_enhanced_target change, so cached
+# tokenized datasets (load_data) are rebuilt
+ENHANCED_FORMAT_VERSION = 1
+
+# Bump when extract_sql_from_output (or the fixes it applies) changes, so cached
+# predictions (prediction_cache) are regenerated
+SQL_POSTPROCESS_VERSION = 1
+
+def get_database_schema(db_path: str = DB_PATH) -> Dict[str, List[Tuple[str, str]]]:
     """
     Extract database schema information.
     
+    Args:
+        db_path: Path to the SQLite database
+    
     Returns:
         Dict mapping table names to list of (column_name, column_type) tuples
     """
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
     
     # Get all table names
@@ -34,41 +47,57 @@ def get_database_schema() -> Dict[str, List[Tuple[str, str]]]:
     conn.close()
     return schema
 
-def format_schema_compact() -> str:
+def get_schema_from_file(schema_path: str = SCHEMA_PATH) -> Dict[str, List[Tuple[str, str]]]:
     """
-    Format schema in a compact way suitable for T5 input.
+    Read schema information from the JSON .schema file shipped with the data.
+    
+    Useful when the SQLite database is not available. Column types are the
+    entity types recorded in the file rather than SQLite types.
+    
+    Args:
+        schema_path: Path to the flight_database.schema file
     
     Returns:
-        Compact schema string
+        Dict mapping table names to list of (column_name, column_type) tuples
     """
-    schema = get_database_schema()
-    
-    # Create a concise schema representation
-    schema_parts = []
+    with open(schema_path, 'r') as f:
+        ents = json.load(f)['ents']
     
-    # Key tables for flight queries
-    key_tables = ['flight', 'city', 'airport', 'airport_service', 'airline', 'aircraft']
+    return {
+        table: [(col_name, col_info.get('type', '')) for col_name, col_info in columns.items()]
+        for table, columns in ents.items()
+    }
+
+def format_schema_compact() -> str:
+    """
+    Format schema in a compact way suitable for T5 input.
     
-    for table in key_tables:
-        if table in schema:
-            # Get most important columns (first 6 to keep it manageable)
-            cols = schema[table][:6]
-            col_names = [col[0] for col in cols]
-            schema_parts.append(f"{table}({', '.join(col_names)})")
+    The schema is loaded once per process and the rendering is memoized by
+    schema_registry, so this is cheap to call for every example.
     
-    return "Schema: " + " | ".join(schema_parts)
+    Returns:
+        Compact schema string
+    """
+    from schema_registry import get_schema_registry
+    return get_schema_registry().compact()
 
-def format_enhanced_input(natural_language: str) -> str:
+def format_enhanced_input(natural_language: str, prune_schema: bool = False) -> str:
     """
     Create enhanced input with schema information and proper formatting.
     
     Args:
         natural_language: The original natural language query
+        prune_schema: If True, include only the tables and columns linked to this
+                      question (schema_linking) instead of the fixed compact schema
     
     Returns:
         Enhanced input string with schema and formatting
     """
-    schema_info = format_schema_compact()
+    if prune_schema:
+        from schema_linking import format_schema_pruned
+        schema_info = format_schema_pruned(natural_language)
+    else:
+        schema_info = format_schema_compact()
     
     enhanced_input = f"""translate English to SQL:
 {schema_info}
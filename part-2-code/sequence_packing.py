@@ -0,0 +1,166 @@
+"""
+Sequence packing for T5 training.
+
+Several (encoder input, SQL target) examples are concatenated into one training
+row. Every token carries a segment id (1, 2, ... per example, 0 for padding) and
+attention is restricted with block-diagonal masks built from them: encoder
+self-attention and cross-attention stay within a segment, and decoder
+self-attention is also causal. T5 has no absolute position embeddings, and its
+relative position bias only depends on the distance between two tokens of the
+same segment, which packing does not change, so no position ids need resetting.
+"""
+
+import time
+from typing import Dict, List
+
+import torch
+from torch.nn.utils.rnn import pad_sequence
+
+PAD_IDX = 0
+MAX_PACKED_ENCODER_LENGTH = 1024
+MAX_PACKED_DECODER_LENGTH = 256
+
+
+def pack_examples(batch: List[Dict], max_encoder_length: int = MAX_PACKED_ENCODER_LENGTH,
+                  max_decoder_length: int = MAX_PACKED_DECODER_LENGTH) -> List[List[Dict]]:
+    """First-fit decreasing (by target length) assignment of examples to rows under both length caps."""
+    rows, row_lengths = [], []
+    for example in sorted(batch, key=lambda ex: -len(ex['decoder_target'])):
+        enc_len, dec_len = len(example['encoder_input']), len(example['decoder_target'])
+        for r, (row_enc, row_dec) in enumerate(row_lengths):
+            if row_enc + enc_len <= max_encoder_length and row_dec + dec_len <= max_decoder_length:
+                rows[r].append(example)
+                row_lengths[r] = (row_enc + enc_len, row_dec + dec_len)
+                break
+        else:
+            rows.append([example])
+            row_lengths.append((enc_len, dec_len))
+    return rows
+
+
+def _concat_row(row, field):
+    tokens = torch.cat([example[field] for example in row]).long()
+    segments = torch.cat([torch.full((len(example[field]),), s + 1, dtype=torch.long) for s, example in enumerate(row)])
+    return tokens, segments
+
+
+def packed_collate_fn(batch, max_encoder_length=MAX_PACKED_ENCODER_LENGTH,
+                      max_decoder_length=MAX_PACKED_DECODER_LENGTH):
+    """
+    Collate train/dev examples into packed rows.
+
+    Returns:
+        encoder_ids, encoder_segments, decoder_input_ids, decoder_target_ids, decoder_segments
+        (segment ids are 0 on padding), in the positions normal_collate_fn uses for
+        ids, mask, decoder inputs, targets and initial decoder inputs.
+    """
+    rows = pack_examples(batch, max_encoder_length, max_decoder_length)
+    encoder_ids, encoder_segments, decoder_inputs, decoder_targets, decoder_segments = [], [], [], [], []
+    for row in rows:
+        ids, segments = _concat_row(row, 'encoder_input')
+        encoder_ids.append(ids)
+        encoder_segments.append(segments)
+        inputs, segments = _concat_row(row, 'decoder_input')
+        decoder_inputs.append(inputs)
+        decoder_segments.append(segments)
+        decoder_targets.append(_concat_row(row, 'decoder_target')[0])
+
+    pad = lambda seqs: pad_sequence(seqs, batch_first=True, padding_value=PAD_IDX)
+    return pad(encoder_ids), pad(encoder_segments), pad(decoder_inputs), pad(decoder_targets), pad(decoder_segments)
+
+
+def packed_attention_masks(encoder_segments, decoder_segments):
+    """
+    Block-diagonal masks (1 = attend) from segment ids.
+
+    Returns:
+        encoder_mask (B, E, E), decoder_mask (B, D, D) (causal), cross_mask (B, D, E)
+    """
+    enc_keys = (encoder_segments != 0)[:, None, :]
+    encoder_mask = (encoder_segments[:, :, None] == encoder_segments[:, None, :]) & enc_keys
+    dec_len = decoder_segments.shape[1]
+    # A 3-D decoder_attention_mask is used as-is: T5 only builds its own causal mask
+    # from a 2-D padding mask, so the causal term here is required, not redundant
+    causal = torch.ones(dec_len, dec_len, dtype=torch.bool, device=decoder_segments.device).tril()
+    decoder_mask = ((decoder_segments[:, :, None] == decoder_segments[:, None, :])
+                    & (decoder_segments != 0)[:, None, :] & causal)
+    cross_mask = (decoder_segments[:, :, None] == encoder_segments[:, None, :]) & enc_keys
+    return encoder_mask.long(), decoder_mask.long(), cross_mask.long()
+
+
+def packed_forward(model, encoder_ids, encoder_segments, decoder_inputs, decoder_segments):
+    """
+    Logits for packed rows. The encoder runs separately because its self-attention
+    mask (E x E) differs from the cross-attention mask (D x E) that
+    T5ForConditionalGeneration takes as `attention_mask` once `encoder_outputs` is given.
+    """
+    encoder_mask, decoder_mask, cross_mask = packed_attention_masks(encoder_segments, decoder_segments)
+    encoder_outputs = model.get_encoder()(input_ids=encoder_ids, attention_mask=encoder_mask)
+    return model(
+        encoder_outputs=encoder_outputs,
+        attention_mask=cross_mask,
+        decoder_input_ids=decoder_inputs,
+        decoder_attention_mask=decoder_mask,
+    )['logits']
+
+
+if __name__ == "__main__":
+    # Tokens/sec and loss parity: packed vs unpacked batches of the same train examples
+    import argparse
+    from functools import partial
+    from torch.utils.data import DataLoader, Subset
+    from load_data import T5Dataset, normal_collate_fn
+    from t5_utils import DEVICE
+    from transformers import T5ForConditionalGeneration
+
+    parser = argparse.ArgumentParser(description='Benchmark sequence packing')
+    parser.add_argument('--batch_size', type=int, default=32)
+    parser.add_argument('--num_batches', type=int, default=20)
+    parser.add_argument('--max_encoder_length', type=int, default=MAX_PACKED_ENCODER_LENGTH)
+    parser.add_argument('--max_decoder_length', type=int, default=MAX_PACKED_DECODER_LENGTH)
+    cli = parser.parse_args()
+
+    torch.manual_seed(0)
+    dataset = T5Dataset('data', 'train')
+    subset = Subset(dataset, torch.randperm(len(dataset))[:cli.batch_size * cli.num_batches].tolist())
+    model = T5ForConditionalGeneration.from_pretrained('google-t5/t5-small').to(DEVICE)
+    criterion = torch.nn.CrossEntropyLoss(reduction='sum')
+
+    def run(loader, packed, train):
+        """Sum of token CE, target tokens and seconds; one optimizer-free backward per batch when training."""
+        model.train(train)
+        loss_sum, tokens, slots, secs = 0.0, 0, 0, 0.0
+        for encoder_ids, encoder_mask_or_segments, decoder_inputs, decoder_targets, decoder_segments in loader:
+            encoder_ids, decoder_inputs, decoder_targets = encoder_ids.to(DEVICE), decoder_inputs.to(DEVICE), decoder_targets.to(DEVICE)
+            start = time.perf_counter()
+            with torch.set_grad_enabled(train):
+                if packed:
+                    logits = packed_forward(model, encoder_ids, encoder_mask_or_segments.to(DEVICE), decoder_inputs, decoder_segments.to(DEVICE))
+                else:
+                    logits = model(input_ids=encoder_ids, attention_mask=encoder_mask_or_segments.to(DEVICE),
+                                   decoder_input_ids=decoder_inputs)['logits']
+                non_pad = decoder_targets != PAD_IDX
+                loss = criterion(logits[non_pad], decoder_targets[non_pad])
+                if train:
+                    loss.backward()
+                    model.zero_grad(set_to_none=True)
+            secs += time.perf_counter() - start
+            loss_sum += loss.item()
+            tokens += int(non_pad.sum())
+            slots += decoder_targets.numel()
+        return loss_sum, tokens, slots, secs
+
+    unpacked_loader = DataLoader(subset, batch_size=cli.batch_size, collate_fn=normal_collate_fn)
+    packed_loader = DataLoader(subset, batch_size=cli.batch_size, collate_fn=partial(
+        packed_collate_fn, max_encoder_length=cli.max_encoder_length, max_decoder_length=cli.max_decoder_length))
+
+    base_loss, base_tokens, base_slots, _ = run(unpacked_loader, packed=False, train=False)
+    packed_loss, packed_tokens, packed_slots, _ = run(packed_loader, packed=True, train=False)
+    print(f"Eval loss unpacked: {base_loss / base_tokens:.6f}  packed: {packed_loss / packed_tokens:.6f}  "
+          f"(|diff| {abs(base_loss / base_tokens - packed_loss / packed_tokens):.2e}, {packed_tokens} target tokens)")
+    print(f"Decoder padding: unpacked {1 - base_tokens / base_slots:.1%}, packed {1 - packed_tokens / packed_slots:.1%}")
+
+    _, tokens, _, base_secs = run(unpacked_loader, packed=False, train=True)
+    _, _, _, packed_secs = run(packed_loader, packed=True, train=True)
+    print(f"Train fwd+bwd tokens/sec unpacked: {tokens / base_secs:.1f}  packed: {tokens / packed_secs:.1f}  "
+          f"({base_secs / packed_secs:.2f}x)")
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+Local HTTP inference server for the T5 text-to-SQL model with dynamic batching.
+
+The checkpoint and tokenizer are loaded once. Concurrent requests are queued and
+grouped into batches of up to --max_batch_size, waiting at most --max_wait_ms for
+a batch to fill, then run through `generate` and `extract_sql_from_output`.
+Requests that ask for execution run their SQL on a separate thread pool, so the
+generation worker keeps forming batches while queries execute.
+
+Tokenizers match train_t5: inputs are encoded with the training tokenizer
+(T5Dataset) and outputs decoded with the eval tokenizer (dev/test inference).
+
+Endpoints:
+    POST /predict   {"question": "...", "execute": false} -> {"sql": ..., "records": ..., "latency_ms": ...}
+    GET  /metrics   request/batch counters and latency percentiles
+    GET  /health
+"""
+
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import torch
+
+from schema_utils import format_enhanced_input, extract_sql_from_output
+from t5_utils import load_model_from_checkpoint, DEVICE
+from tokenizer_registry import get_tokenizer, get_eval_tokenizer
+from utils import compute_record
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Text-to-SQL inference server')
+    parser.add_argument('--experiment_name', type=str, required=True)
+    parser.add_argument('--finetune', action='store_true')
+    parser.add_argument('--checkpoint_dir', type=str, default=None)
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--max_batch_size', type=int, default=16)
+    parser.add_argument('--max_wait_ms', type=float, default=10.0,
+                        help='Longest time the first queued request waits for a batch to fill')
+    parser.add_argument('--num_beams', type=int, default=1)
+    parser.add_argument('--max_gen_length', type=int, default=256)
+    parser.add_argument('--execute_workers', type=int, default=4,
+                        help='Threads executing SQL for requests with "execute": true')
+    return parser.parse_args()
+
+
+class ServerMetrics:
+    """Thread-safe request/batch counters and a bounded window of request latencies."""
+
+    def __init__(self, window=10000):
+        self.lock = threading.Lock()
+        self.window = window
+        self.latencies_ms = []
+        self.requests = 0
+        self.errors = 0
+        self.batches = 0
+        self.batched_requests = 0
+        self.started = time.time()
+
+    def record_batch(self, size):
+        with self.lock:
+            self.batches += 1
+            self.batched_requests += size
+
+    def record_request(self, latency_ms, error=False):
+        with self.lock:
+            self.requests += 1
+            self.errors += int(error)
+            self.latencies_ms.append(latency_ms)
+            if len(self.latencies_ms) > self.window:
+                self.latencies_ms = self.latencies_ms[-self.window:]
+
+    def snapshot(self):
+        with self.lock:
+            latencies = sorted(self.latencies_ms)
+            pct = lambda p: latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))] if latencies else 0.0
+            uptime = time.time() - self.started
+            return {
+                'requests': self.requests,
+                'errors': self.errors,
+                'batches': self.batches,
+                'avg_batch_size': self.batched_requests / self.batches if self.batches else 0.0,
+                'latency_ms': {'p50': pct(50), 'p95': pct(95), 'p99': pct(99),
+                               'mean': sum(latencies) / len(latencies) if latencies else 0.0},
+                'requests_per_sec': self.requests / uptime if uptime > 0 else 0.0,
+                'uptime_secs': uptime,
+            }
+
+
+class DynamicBatcher:
+    """
+    Collects queued questions into batches (max size / max wait policy) and runs
+    generation on a single worker thread, resolving one Future per request. SQL
+    execution is handed to `execute_workers` threads.
+
+    `tokenizer` encodes the inputs (the training tokenizer); `decode_tokenizer`
+    (default: `tokenizer`) decodes the generated ids.
+    """
+
+    def __init__(self, model, tokenizer, max_batch_size=16, max_wait_ms=10.0,
+                 num_beams=1, max_gen_length=256, metrics=None, decode_tokenizer=None, execute_workers=4):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.decode_tokenizer = decode_tokenizer or tokenizer
+        self.executor = ThreadPoolExecutor(max_workers=execute_workers, thread_name_prefix='sql')
+        self.max_batch_size = max_batch_size
+        self.max_wait_secs = max_wait_ms / 1000.0
+        self.num_beams = num_beams
+        self.max_gen_length = max_gen_length
+        self.metrics = metrics or ServerMetrics()
+        self.queue = queue.Queue()
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    def submit(self, question, execute=False):
+        future = Future()
+        self.queue.put((question, execute, future))
+        return future
+
+    def _next_batch(self):
+        batch = [self.queue.get()]
+        deadline = time.perf_counter() + self.max_wait_secs
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    @torch.no_grad()
+    def _generate(self, questions):
+        inputs = self.tokenizer(
+            [format_enhanced_input(q) for q in questions],
+            return_tensors="pt", padding=True, truncation=True, max_length=512,
+        ).to(DEVICE)
+        generated_ids = self.model.generate(
+            input_ids=inputs['input_ids'],
+            attention_mask=inputs['attention_mask'],
+            decoder_start_token_id=self.tokenizer.pad_token_id,
+            max_length=self.max_gen_length,
+            num_beams=self.num_beams,
+            early_stopping=True,
+            pad_token_id=self.tokenizer.pad_token_id,
+            eos_token_id=self.tokenizer.eos_token_id,
+        )
+        return [extract_sql_from_output(self.decode_tokenizer.decode(ids, skip_special_tokens=True).strip())
+                for ids in generated_ids]
+
+    @staticmethod
+    def _execute(sql, future):
+        try:
+            _, records, error_msg = compute_record(0, sql)
+            future.set_result({'sql': sql, 'records': [list(row) for row in records], 'error': error_msg})
+        except Exception as e:
+            future.set_exception(e)
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            self.metrics.record_batch(len(batch))
+            try:
+                sqls = self._generate([question for question, _, _ in batch])
+            except Exception as e:
+                for _, _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, execute, future), sql in zip(batch, sqls):
+                if execute:
+                    self.executor.submit(self._execute, sql, future)
+                else:
+                    future.set_result({'sql': sql})
+
+
+def make_handler(batcher):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status, payload):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == '/health':
+                self._send(200, {'status': 'ok'})
+            elif self.path == '/metrics':
+                self._send(200, batcher.metrics.snapshot())
+            else:
+                self._send(404, {'error': f'unknown path {self.path}'})
+
+        def do_POST(self):
+            if self.path != '/predict':
+                self._send(404, {'error': f'unknown path {self.path}'})
+                return
+            start = time.perf_counter()
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                request = json.loads(self.rfile.read(length) or b'{}')
+            except ValueError as e:
+                self._send(400, {'error': f'invalid JSON body: {e}'})
+                return
+            # Reject malformed requests here: a bad one reaching the batcher would fail its whole batch
+            question = request.get('question') if isinstance(request, dict) else None
+            if not isinstance(question, str) or not question.strip():
+                self._send(400, {'error': 'expected a JSON object with a non-empty string "question"'})
+                return
+            try:
+                result = batcher.submit(question, bool(request.get('execute', False))).result()
+            except Exception as e:
+                batcher.metrics.record_request((time.perf_counter() - start) * 1000, error=True)
+                self._send(500, {'error': f'{type(e).__name__}: {e}'})
+                return
+            latency_ms = (time.perf_counter() - start) * 1000
+            batcher.metrics.record_request(latency_ms)
+            result['latency_ms'] = latency_ms
+            self._send(200, result)
+
+        def log_message(self, format, *args):
+            pass  # per-request logging would dominate latency under load
+
+    return Handler
+
+
+def main():
+    args = get_args()
+    model_type = 'ft' if args.finetune else 'scr'
+    checkpoint_dir = args.checkpoint_dir or os.path.join('runs', f'{model_type}_experiments',
+                                                         args.experiment_name, 'checkpoints')
+    model = load_model_from_checkpoint(
+        SimpleNamespace(finetune=args.finetune, experiment_name=args.experiment_name, checkpoint_dir=checkpoint_dir),
+        best=True,
+    )
+    model.eval()
+
+    batcher = DynamicBatcher(model, get_tokenizer(), max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms,
+                             num_beams=args.num_beams, max_gen_length=args.max_gen_length,
+                             decode_tokenizer=get_eval_tokenizer(), execute_workers=args.execute_workers)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(batcher))
+    print(f"Serving text-to-SQL on http://{args.host}:{args.port} "
+          f"(max_batch_size={args.max_batch_size}, max_wait_ms={args.max_wait_ms})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nShutting down")
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
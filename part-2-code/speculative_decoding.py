@@ -0,0 +1,276 @@
+"""
+Retrieval-based speculative decoding for T5 text-to-SQL model.
+
+ATIS SQL is highly repetitive, so continuations of the current output are
+usually found verbatim in train.sql. This module drafts the next tokens from
+n-gram matches against the tokenized training targets (prompt-lookup decoding)
+and verifies the whole draft with one decoder forward pass. Only draft tokens
+that greedy decoding would have produced are kept, so the output is identical
+to greedy decoding.
+"""
+
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+import torch
+
+from schema_utils import format_enhanced_target
+
+
+class NGramDraftIndex:
+    """
+    Index of token n-grams in a corpus of target sequences.
+
+    Maps every n-gram (1 <= n <= max_ngram) to the position of its latest
+    occurrence, so `draft` can return the tokens that followed it.
+
+    With `vocab_size`, every id must be a valid row of the model's embedding:
+    an index built with a different tokenizer (e.g. the SQL-optimized one, whose
+    added tokens sit above T5's 32128 ids) is rejected here instead of failing
+    with an IndexError inside the decoder.
+    """
+
+    def __init__(self, sequences: List[List[int]], max_ngram: int = 3, draft_len: int = 10,
+                 vocab_size: Optional[int] = None):
+        if vocab_size is not None:
+            out_of_vocab = max((max(seq) for seq in sequences if seq), default=-1)
+            if out_of_vocab >= vocab_size:
+                raise ValueError(f"Draft index contains token id {out_of_vocab} >= model vocab size {vocab_size}; "
+                                 f"build it with the tokenizer the model was trained with")
+        self.sequences = sequences
+        self.max_ngram = max_ngram
+        self.draft_len = draft_len
+        self.index: Dict[Tuple[int, ...], Tuple[int, int]] = {}
+        for seq_idx, seq in enumerate(sequences):
+            for end in range(1, len(seq)):
+                for n in range(1, min(max_ngram, end) + 1):
+                    self.index[tuple(seq[end - n:end])] = (seq_idx, end)
+
+    @classmethod
+    def from_sql_file(cls, tokenizer, sql_path: str = os.path.join('data', 'train.sql'), **kwargs):
+        with open(sql_path, 'r') as f:
+            queries = [line.strip() for line in f.readlines()]
+        targets = [format_enhanced_target(q) for q in queries]
+        sequences = tokenizer(targets, add_special_tokens=True)['input_ids']
+        return cls(sequences, **kwargs)
+
+    def draft(self, tokens: List[int]) -> List[int]:
+        """Return up to draft_len tokens that followed the longest matching suffix of `tokens`."""
+        for n in range(min(self.max_ngram, len(tokens)), 0, -1):
+            hit = self.index.get(tuple(tokens[-n:]))
+            if hit is not None:
+                seq_idx, end = hit
+                return self.sequences[seq_idx][end:end + self.draft_len]
+        return []
+
+
+_DRAFT_INDEX_CACHE = {}
+
+def get_train_draft_index(tokenizer, sql_path: str = os.path.join('data', 'train.sql'),
+                          vocab_size: Optional[int] = None) -> NGramDraftIndex:
+    """
+    Build (once per tokenizer and file) the draft index over the training SQL.
+    `tokenizer` must be the one the model was trained with (tokenizer_registry.get_tokenizer());
+    pass the model's `config.vocab_size` to check it.
+    """
+    key = (id(tokenizer), sql_path, vocab_size)
+    if key not in _DRAFT_INDEX_CACHE:
+        _DRAFT_INDEX_CACHE[key] = NGramDraftIndex.from_sql_file(tokenizer, sql_path, vocab_size=vocab_size)
+    return _DRAFT_INDEX_CACHE[key]
+
+
+def _crop_past(past_key_values, length: int):
+    """Keep the first `length` decoder self-attention positions of a T5 KV cache."""
+    if hasattr(past_key_values, 'crop'):
+        past_key_values.crop(length)
+        return past_key_values
+    return tuple(
+        (layer[0][:, :, :length], layer[1][:, :, :length]) + tuple(layer[2:])
+        for layer in past_key_values
+    )
+
+
+def _select_rows(past_key_values, rows: torch.Tensor):
+    """Keep the batch rows `rows` of a T5 KV cache (self- and cross-attention)."""
+    if hasattr(past_key_values, 'reorder_cache'):
+        past_key_values.reorder_cache(rows)
+        return past_key_values
+    return tuple(tuple(t.index_select(0, rows) for t in layer) for layer in past_key_values)
+
+
+def _finish(seq: List[int], first_new: int, eos_token_id: int, end_ids: Optional[List[int]]) -> bool:
+    """Truncate `seq` after the first EOS or END marker among its new tokens; True if it stopped."""
+    for pos in range(first_new, len(seq)):
+        if seq[pos] == eos_token_id:
+            del seq[pos + 1:]
+            return True
+        if end_ids and pos + 1 >= len(end_ids) and seq[pos + 1 - len(end_ids):pos + 1] == end_ids:
+            del seq[pos + 1:]
+            return True
+    return False
+
+
+@torch.no_grad()
+def speculative_generate(model, input_ids, attention_mask, draft_index: NGramDraftIndex,
+                         decoder_start_token_id: int, eos_token_id: int, pad_token_id: int,
+                         max_length: int = 256, encoder_outputs=None, end_ids: Optional[List[int]] = None,
+                         stats: Optional[dict] = None) -> torch.Tensor:
+    """
+    Greedy-decode a batch, drafting continuations from `draft_index` and verifying
+    the drafts of every row in one batched decoder pass per step.
+
+    Rows accept different numbers of draft tokens, but T5's KV cache needs one
+    length for the whole batch. The cache is therefore kept at the shortest valid
+    length over active rows, and rows that got ahead re-feed their uncached
+    committed tokens in front of their next draft (step inputs are right-padded,
+    which causal attention ignores). Finished rows leave the batch.
+
+    Args:
+        model: T5ForConditionalGeneration
+        input_ids, attention_mask: Encoder inputs, shape (batch, seq_len)
+        draft_index: NGramDraftIndex over training targets
+        decoder_start_token_id: First decoder token
+        eos_token_id: Stop token
+        pad_token_id: Padding for the returned tensor and the step inputs
+        max_length: Maximum output length (including the decoder start token), as in `generate`
+        encoder_outputs: Precomputed encoder outputs for the batch (computed if None)
+        end_ids: If set, also stop each row right after this token sequence (the END
+                 marker of eval_utils.EndMarkerStoppingCriteria), as `generate` would
+        stats: Optional dict accumulating 'tokens', 'forward_passes', 'accepted' and 'stopped'
+
+    Returns:
+        (batch, length) tensor of generated ids starting with the decoder start token,
+        identical to greedy `generate` with the same stopping rules
+    """
+    device = input_ids.device
+    if encoder_outputs is None:
+        encoder_outputs = model.get_encoder()(input_ids=input_ids, attention_mask=attention_mask)
+    hidden, mask = encoder_outputs[0], attention_mask
+
+    generated = [[decoder_start_token_id] for _ in range(input_ids.shape[0])]
+    active = list(range(input_ids.shape[0]))  # batch rows still decoding, in cache order
+    cached = 0  # decoder positions held in the KV cache (shared by the active rows)
+    past = None
+
+    while active:
+        steps, drafts = [], []
+        for row in active:
+            seq = generated[row]
+            draft = draft_index.draft(seq[1:])[:max_length - len(seq) - 1]
+            drafts.append(draft)
+            steps.append(seq[cached:] + draft)
+        width = max(len(step) for step in steps)
+        step_ids = torch.full((len(active), width), pad_token_id, dtype=torch.long, device=device)
+        for i, step in enumerate(steps):
+            step_ids[i, :len(step)] = torch.tensor(step, dtype=torch.long, device=device)
+
+        outputs = model(
+            encoder_outputs=(hidden,),
+            attention_mask=mask,
+            decoder_input_ids=step_ids,
+            past_key_values=past,
+            use_cache=True,
+        )
+        # predictions[i][j] is the greedy token after step_ids[i, :j+1]
+        predictions = outputs.logits.argmax(dim=-1).tolist()
+        if stats is not None:
+            stats['forward_passes'] = stats.get('forward_passes', 0) + 1
+
+        valid, keep = [], []
+        for i, row in enumerate(active):
+            seq, draft = generated[row], drafts[i]
+            preds = predictions[i][len(seq) - cached - 1:]
+            accepted = 0
+            while accepted < len(draft) and draft[accepted] == preds[accepted]:
+                accepted += 1
+            first_new = len(seq)
+            seq.extend((draft[:accepted] + [preds[accepted]])[:max_length - len(seq)])
+            if stats is not None:
+                stats['accepted'] = stats.get('accepted', 0) + accepted
+            stopped_at_end = _finish(seq, first_new, eos_token_id, end_ids)
+            if stopped_at_end and seq[-1] != eos_token_id and stats is not None:
+                stats['stopped'] = stats.get('stopped', 0) + 1
+            if not stopped_at_end and len(seq) < max_length:
+                keep.append(i)
+                # The cache is valid through the committed tokens and the accepted draft
+                valid.append(first_new + accepted)
+
+        if not keep:
+            break
+        past = _crop_past(outputs.past_key_values, min(valid))
+        cached = min(valid)
+        if len(keep) < len(active):
+            rows = torch.tensor(keep, dtype=torch.long, device=device)
+            past = _select_rows(past, rows)
+            hidden, mask = hidden.index_select(0, rows), mask.index_select(0, rows)
+            active = [active[i] for i in keep]
+
+    if stats is not None:
+        stats['tokens'] = stats.get('tokens', 0) + sum(len(seq) - 1 for seq in generated)
+    width = max(len(seq) for seq in generated)
+    padded = torch.full((len(generated), width), pad_token_id, dtype=torch.long, device=device)
+    for row, seq in enumerate(generated):
+        padded[row, :len(seq)] = torch.tensor(seq, dtype=torch.long, device=device)
+    return padded
+
+
+if __name__ == "__main__":
+    # Compare speculative decoding against model.generate greedy decoding on dev, at the eval batch size
+    import argparse
+    from types import SimpleNamespace
+    from load_data import get_dataloader
+    from t5_utils import load_model_from_checkpoint, DEVICE
+    from tokenizer_registry import get_tokenizer
+
+    parser = argparse.ArgumentParser(description='Benchmark retrieval-based speculative decoding')
+    parser.add_argument('--experiment_name', type=str, required=True)
+    parser.add_argument('--finetune', action='store_true')
+    parser.add_argument('--max_gen_length', type=int, default=256)
+    parser.add_argument('--batch_size', type=int, default=16, help='Match train_t5 --test_batch_size')
+    parser.add_argument('--num_batches', type=int, default=10)
+    cli = parser.parse_args()
+
+    tokenizer = get_tokenizer()
+    model = load_model_from_checkpoint(SimpleNamespace(finetune=cli.finetune, experiment_name=cli.experiment_name), best=True)
+    model.eval()
+    draft_index = get_train_draft_index(tokenizer, vocab_size=model.config.vocab_size)
+    dev_loader = get_dataloader(batch_size=cli.batch_size, split="dev")
+
+    def strip(ids):
+        ids = ids.tolist()
+        while len(ids) > 1 and ids[-1] == tokenizer.pad_token_id:
+            ids.pop()
+        return ids
+
+    greedy_secs, spec_secs, greedy_tokens, identical, total = 0.0, 0.0, 0, 0, 0
+    stats = {}
+    for batch_idx, (encoder_ids, encoder_mask, _, _, initial_decoder_inputs) in enumerate(dev_loader):
+        if batch_idx >= cli.num_batches:
+            break
+        encoder_ids, encoder_mask = encoder_ids.to(DEVICE), encoder_mask.to(DEVICE)
+
+        start = time.perf_counter()
+        with torch.no_grad():
+            greedy = model.generate(input_ids=encoder_ids, attention_mask=encoder_mask,
+                                    decoder_start_token_id=tokenizer.pad_token_id,
+                                    max_length=cli.max_gen_length, num_beams=1,
+                                    pad_token_id=tokenizer.pad_token_id, eos_token_id=tokenizer.eos_token_id)
+        greedy_secs += time.perf_counter() - start
+        greedy_tokens += sum(len(strip(row)) - 1 for row in greedy)
+
+        start = time.perf_counter()
+        spec = speculative_generate(model, encoder_ids, encoder_mask, draft_index,
+                                    decoder_start_token_id=tokenizer.pad_token_id,
+                                    eos_token_id=tokenizer.eos_token_id, pad_token_id=tokenizer.pad_token_id,
+                                    max_length=cli.max_gen_length, stats=stats)
+        spec_secs += time.perf_counter() - start
+
+        total += encoder_ids.shape[0]
+        identical += sum(strip(g) == strip(p) for g, p in zip(greedy, spec))
+
+    print(f"Batch size {cli.batch_size}, {total} dev examples")
+    print(f"Identical to greedy: {identical}/{total}")
+    print(f"Greedy:      {greedy_tokens / greedy_secs:.1f} tokens/s")
+    print(f"Speculative: {stats['tokens'] / spec_secs:.1f} tokens/s "
+          f"({stats['tokens'] / stats['forward_passes']:.2f} tokens per batched decoder pass)")
@@ -5,7 +5,8 @@ import torch
 import transformers
 from transformers import T5ForConditionalGeneration, T5Config
 from transformers.pytorch_utils import ALL_LAYERNORM_LAYERS
-import wandb
+
+from tokenizer_registry import T5_MODEL_NAME, from_pretrained
 
 DEVICE = torch.device('cuda') if torch.cuda.is_available() else torch.device('cpu')
 
@@ -21,6 +22,8 @@ def setup_wandb(args):
         print("wandb disabled (--use_wandb not set)")
         return None
 
+    # Imported here: wandb is slow to import and only needed for tracked runs
+    import wandb
     try:
         mode = os.environ.get("WANDB_MODE", "online")
         project = os.environ.get("WANDB_PROJECT", "hw4-text-to-sql")
@@ -54,12 +57,12 @@ def initialize_model(args):
     if args.finetune:
         # Fine-tuning: Load pretrained T5 model
         print("Initializing T5 model for fine-tuning...")
-        model = T5ForConditionalGeneration.from_pretrained('google-t5/t5-small')
+        model = from_pretrained(T5ForConditionalGeneration, T5_MODEL_NAME)
         print(" Using default T5 vocabulary size")
     else:
         # Training from scratch: Use T5 config but randomly initialize weights
         print("Initializing T5 model from scratch...")
-        config = T5Config.from_pretrained('google-t5/t5-small')
+        config = from_pretrained(T5Config, T5_MODEL_NAME)
         model = T5ForConditionalGeneration(config)
     
     # Apply optional parameter freezing for fine-tuning
@@ -132,8 +135,13 @@ def mkdir(dirpath):
         except FileExistsError:
             pass
 
-def save_model(checkpoint_dir, model, best):
-    """Save model checkpoint."""
+def save_model(checkpoint_dir, model, best, training_state=None):
+    """
+    Save model checkpoint. `training_state` (optimizer, scheduler, sampler position,
+    RNG state, ...) is stored alongside so train_t5 --resume can continue the run.
+    The file is written to a temporary path first, so a preempted save never
+    leaves a truncated checkpoint behind.
+    """
     mkdir(checkpoint_dir)
     
     if best:
@@ -142,10 +150,23 @@ def save_model(checkpoint_dir, model, best):
     else:
         save_path = os.path.join(checkpoint_dir, 'latest_model.pt')
     
-    torch.save({
+    checkpoint = {
         'model_state_dict': model.state_dict(),
         'model_config': model.config,
-    }, save_path)
+    }
+    if training_state is not None:
+        checkpoint['training_state'] = training_state
+    tmp_path = save_path + '.tmp'
+    torch.save(checkpoint, tmp_path)
+    os.replace(tmp_path, save_path)
+
+def load_training_checkpoint(checkpoint_dir):
+    """The latest checkpoint if it carries a training state (for resuming), else None."""
+    checkpoint_path = os.path.join(checkpoint_dir, 'latest_model.pt')
+    if not os.path.exists(checkpoint_path):
+        return None
+    checkpoint = torch.load(checkpoint_path, map_location=DEVICE, weights_only=False)
+    return checkpoint if 'training_state' in checkpoint else None
 
 def load_model_from_checkpoint(args, best):
     """Load model from checkpoint. Prefers args.checkpoint_dir if provided, otherwise falls back."""
@@ -175,7 +196,7 @@ def load_model_from_checkpoint(args, best):
     
     # Initialize model with same config
     if args.finetune:
-        model = T5ForConditionalGeneration.from_pretrained('google-t5/t5-small')
+        model = from_pretrained(T5ForConditionalGeneration, T5_MODEL_NAME)
     else:
         model = T5ForConditionalGeneration(checkpoint['model_config'])
     
@@ -187,11 +208,50 @@ def load_model_from_checkpoint(args, best):
     
     return model
 
-def initialize_optimizer_and_scheduler(args, model, epoch_length):
+def quantize_model_dynamic(model):
+    """Apply dynamic int8 quantization to the Linear layers for CPU inference.
+
+    Weights are stored as int8 and activations are quantized on the fly, so no
+    calibration data is needed. Quantized kernels only run on CPU.
+    """
+    model = model.to('cpu')
+    model.eval()
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+def save_quantized_model(checkpoint_dir, model, best):
+    """Save a dynamically quantized model next to the fp32 checkpoints."""
+    mkdir(checkpoint_dir)
+    save_path = os.path.join(checkpoint_dir, 'best_model_int8.pt' if best else 'latest_model_int8.pt')
+    print(f"Saving int8 model to {save_path}")
+    torch.save({
+        'model_state_dict': model.state_dict(),
+        'model_config': model.config,
+        'quantization': 'dynamic_int8',
+    }, save_path)
+    return save_path
+
+def load_quantized_model(checkpoint_path):
+    """Load a model saved by save_quantized_model (always on CPU)."""
+    print(f"Loading int8 model from {checkpoint_path}")
+    checkpoint = torch.load(checkpoint_path, map_location='cpu', weights_only=False)
+    # Rebuild the quantized module structure before loading the packed int8 weights
+    model = quantize_model_dynamic(T5ForConditionalGeneration(checkpoint['model_config']))
+    model.load_state_dict(checkpoint['model_state_dict'])
+    model.eval()
+    return model
+
+def initialize_optimizer_and_scheduler(args, model, epoch_length, epoch_lengths=None):
     optimizer = initialize_optimizer(args, model)
-    scheduler = initialize_scheduler(args, optimizer, epoch_length)
+    scheduler = initialize_scheduler(args, optimizer, epoch_length, epoch_lengths)
     return optimizer, scheduler
 
+def autocast_context(enabled, device=DEVICE):
+    '''
+    bf16 autocast for `device` when enabled, otherwise a no-op context. Matmuls and
+    linear layers run in bf16; parameters, gradients and optimizer state stay fp32.
+    '''
+    return torch.autocast(device_type=device.type, dtype=torch.bfloat16, enabled=enabled)
+
 def initialize_optimizer(args, model):
     decay_parameters = get_parameter_names(model, transformers.pytorch_utils.ALL_LAYERNORM_LAYERS)
     decay_parameters = [name for name in decay_parameters if "bias" not in name]
@@ -210,6 +270,13 @@ def initialize_optimizer(args, model):
         },
     ]
 
+    if getattr(args, 'bf16', False):
+        # Autocast only lowers activations; AdamW must update fp32 master weights
+        low_precision = [n for n, p in model.named_parameters() if p.requires_grad and p.dtype != torch.float32]
+        if low_precision:
+            raise ValueError(f"--bf16 expects fp32 master weights, found {len(low_precision)} "
+                             f"non-fp32 trainable parameters (e.g. {low_precision[0]})")
+
     if args.optimizer_type == "AdamW":
         optimizer = torch.optim.AdamW(
             optimizer_grouped_parameters, lr=args.learning_rate, eps=1e-8, betas=(0.9, 0.999)
@@ -219,9 +286,15 @@ def initialize_optimizer(args, model):
 
     return optimizer
         
-def initialize_scheduler(args, optimizer, epoch_length):
-    num_training_steps = epoch_length * args.max_n_epochs
-    num_warmup_steps = epoch_length * args.num_warmup_epochs
+def initialize_scheduler(args, optimizer, epoch_length, epoch_lengths=None):
+    '''
+    epoch_lengths: Steps of each epoch when they vary between epochs (token-budget
+                   batches); defaults to `epoch_length` for every epoch.
+    '''
+    if epoch_lengths is None:
+        epoch_lengths = [epoch_length] * max(args.max_n_epochs, args.num_warmup_epochs)
+    num_training_steps = sum(epoch_lengths[:args.max_n_epochs])
+    num_warmup_steps = sum(epoch_lengths[:args.num_warmup_epochs])
 
     if args.scheduler_type == "none":
         return None
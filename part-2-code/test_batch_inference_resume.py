@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Test the resume bookkeeping of batch_inference: open_for_resume drops output
+written after the last checkpoint, and check_resume refuses a checkpoint made
+for another input file or batch size.
+"""
+
+import os
+import tempfile
+
+from batch_inference import check_resume, file_sha256, open_for_resume, save_progress, load_progress
+
+
+def test_open_for_resume_truncates():
+    """Bytes past the checkpointed size are dropped and appends continue from there"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'out.sql')
+        with open(path, 'wb') as f:
+            f.write(b"SELECT 1\nSELECT 2\nSELECT 3 part")
+        f = open_for_resume(path, len(b"SELECT 1\nSELECT 2\n"))
+        f.write(b"SELECT 3\n")
+        f.close()
+        with open(path, 'rb') as f:
+            assert f.read() == b"SELECT 1\nSELECT 2\nSELECT 3\n"
+
+        # A fresh run (size 0) starts from an empty file
+        f = open_for_resume(path, 0)
+        f.close()
+        assert os.path.getsize(path) == 0
+
+
+def test_check_resume():
+    """Matching input and batch size resume; any mismatch exits"""
+    with tempfile.TemporaryDirectory() as tmp:
+        input_path = os.path.join(tmp, 'questions.nl')
+        with open(input_path, 'w') as f:
+            f.write("list flights from denver\nshow fares to boston\n")
+        checkpoint_path = os.path.join(tmp, 'out.sql.progress.json')
+        sha = file_sha256(input_path)
+        save_progress(checkpoint_path, {'lines_done': 1, 'output_bytes': 10, 'records_bytes': 0,
+                                        'input_sha256': sha, 'batch_size': 32})
+        progress = load_progress(checkpoint_path)
+
+        check_resume(progress, sha, 32)
+        for label, other_sha, other_batch_size in (('input', 'f' * 64, 32), ('batch size', sha, 16)):
+            try:
+                check_resume(progress, other_sha, other_batch_size)
+            except SystemExit:
+                continue
+            raise AssertionError(f"resumed despite a different {label}")
+
+        # Nothing done yet: any input may start
+        check_resume({'lines_done': 0}, 'f' * 64, 16)
+
+
+def main():
+    print("🧪 TESTING BATCH INFERENCE RESUME")
+    print("=" * 50)
+    print("1. Output truncation on resume...")
+    test_open_for_resume_truncates()
+    print("   ✅ Partial tail dropped")
+    print("2. Checkpoint / input consistency...")
+    test_check_resume()
+    print("   ✅ Mismatched input or batch size refused")
+    print("\n✅ BATCH INFERENCE RESUME TESTS PASSED")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Test that lazy execution reranking (eval_utils.rerank_candidates_lazily) picks
+the same candidate as executing every candidate up front, and that a candidate
+that runs past the execution time limit counts as failed.
+
+SQL execution is replaced by a fake executor so no database is needed.
+"""
+
+import time
+
+import eval_utils
+import utils
+
+# Candidate lists in beam order: 'bad' queries fail, 'slow' ones sleep first
+CANDIDATE_LISTS = [
+    ["ok 1", "ok 2", "bad 3"],
+    ["bad 1", "ok 2", "ok 3"],
+    ["bad 1", "bad 2", "bad 3", "ok 4", "ok 5"],
+    ["bad 1", "bad 2"],
+    ["ok 1"],
+]
+
+
+def fake_compute_record(query_id, query):
+    if query.startswith('slow'):
+        time.sleep(1.0)
+    error = "no such table" if query.startswith('bad') else ""
+    return query_id, [] if error else [(query,)], error
+
+
+def _patch_execution():
+    originals = (eval_utils.compute_record, utils.compute_record)
+    eval_utils.compute_record = fake_compute_record
+    utils.compute_record = fake_compute_record  # used by utils.compute_records
+    return originals
+
+
+def _restore_execution(originals):
+    eval_utils.compute_record, utils.compute_record = originals
+
+
+def test_lazy_matches_eager():
+    """Every window size picks the eager path's candidate and never executes more queries"""
+    originals = _patch_execution()
+    try:
+        for candidates in CANDIDATE_LISTS:
+            eager = eval_utils.rerank_candidates_by_execution(candidates)
+            for window in (1, 2, 4):
+                stats = {}
+                lazy = eval_utils.rerank_candidates_lazily(candidates, window=window, stats=stats)
+                assert lazy == eager, f"window={window}: {lazy!r} != {eager!r} for {candidates}"
+                assert stats.get('executions', 0) <= len(candidates)
+                print(f"   ✅ window={window}: {candidates} -> {lazy!r}")
+    finally:
+        _restore_execution(originals)
+
+
+def test_timeout_counts_as_failure():
+    """A candidate still running at the time limit is skipped in favour of the next beam"""
+    originals = _patch_execution()
+    limit = eval_utils.EXECUTION_TIMEOUT_SECS
+    eval_utils.EXECUTION_TIMEOUT_SECS = 0.2
+    try:
+        for window in (1, 2):
+            stats = {}
+            start = time.perf_counter()
+            best = eval_utils.rerank_candidates_lazily(["slow 1", "ok 2"], window=window, stats=stats)
+            elapsed = time.perf_counter() - start
+            assert best == "ok 2", f"window={window}: picked {best!r}"
+            assert stats['timeouts'] == 1, stats
+            assert elapsed < 0.9, f"waited {elapsed:.2f}s for the timed-out query"
+            print(f"   ✅ window={window}: timed-out candidate skipped in {elapsed:.2f}s")
+    finally:
+        eval_utils.EXECUTION_TIMEOUT_SECS = limit
+        _restore_execution(originals)
+
+
+def main():
+    print("🧪 TESTING LAZY EXECUTION RERANKING")
+    print("=" * 50)
+    print("1. Lazy vs eager candidate choice...")
+    test_lazy_matches_eager()
+    print("2. Execution time limit...")
+    test_timeout_counts_as_failure()
+    print("\n✅ LAZY RERANKING TESTS PASSED")
+
+
+if __name__ == "__main__":
+    main()
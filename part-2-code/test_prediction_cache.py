@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Test prediction_cache.PredictionCache keys: a key must change with the model
+fingerprint, every generation config entry (including the post-processing
+version) and the unpadded input ids, and must not depend on padding.
+"""
+
+import tempfile
+
+import torch
+
+from prediction_cache import PredictionCache
+
+BASE_CONFIG = {'num_beams': 1, 'max_length': 256, 'num_candidates': 1, 'rerank_by_execution': False,
+               'schema_constrained': False, 'prune_invalid_beams': False, 'stop_at_end_marker': False,
+               'tokenizer': ('google-t5/t5-small', 32100), 'postprocess': 1, 'rerank_version': None,
+               'autocast': None}
+
+IDS = torch.tensor([[5, 6, 7, 1, 0, 0]])
+MASK = torch.tensor([[1, 1, 1, 1, 0, 0]])
+
+
+def key_for(cache_dir, fingerprint='a' * 64, config=None, ids=IDS, mask=MASK):
+    cache = PredictionCache(cache_dir, fingerprint, config or BASE_CONFIG)
+    try:
+        return cache.batch_keys(ids, mask)[0]
+    finally:
+        cache.close()
+
+
+def test_key_sensitivity():
+    """Weights, each config entry and the input ids all change the key"""
+    with tempfile.TemporaryDirectory() as tmp:
+        base = key_for(tmp)
+        assert key_for(tmp) == base, "key is not deterministic"
+        assert key_for(tmp, fingerprint='b' * 64) != base, "model fingerprint ignored"
+        for name, value in (('num_beams', 4), ('max_length', 128), ('stop_at_end_marker', True),
+                            ('postprocess', 2), ('rerank_version', 1), ('autocast', 'torch.bfloat16')):
+            assert key_for(tmp, config=dict(BASE_CONFIG, **{name: value})) != base, f"{name} ignored"
+        assert key_for(tmp, ids=torch.tensor([[5, 6, 8, 1, 0, 0]])) != base, "input ids ignored"
+
+
+def test_padding_invariance():
+    """The same example padded to another length maps to the same key"""
+    with tempfile.TemporaryDirectory() as tmp:
+        padded = key_for(tmp, ids=torch.tensor([[5, 6, 7, 1, 0, 0, 0, 0, 0]]),
+                         mask=torch.tensor([[1, 1, 1, 1, 0, 0, 0, 0, 0]]))
+        assert padded == key_for(tmp)
+
+
+def test_round_trip():
+    """Stored predictions come back; other keys miss"""
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = PredictionCache(tmp, 'a' * 64, BASE_CONFIG)
+        keys = cache.batch_keys(torch.tensor([[5, 6, 1], [8, 9, 1]]), torch.ones(2, 3, dtype=torch.long))
+        cache.put_many(keys[:1], ["SELECT 1"])
+        assert cache.get_many(keys) == ["SELECT 1", None]
+        assert (cache.hits, cache.misses) == (1, 1)
+        cache.close()
+
+
+def main():
+    print("🧪 TESTING PREDICTION CACHE KEYS")
+    print("=" * 50)
+    print("1. Key sensitivity...")
+    test_key_sensitivity()
+    print("   ✅ Weights, config, post-processing version and inputs are all keyed")
+    print("2. Padding invariance...")
+    test_padding_invariance()
+    print("   ✅ Padding does not change the key")
+    print("3. Store and look up...")
+    test_round_trip()
+    print("   ✅ Round trip OK")
+    print("\n✅ PREDICTION CACHE TESTS PASSED")
+
+
+if __name__ == "__main__":
+    main()
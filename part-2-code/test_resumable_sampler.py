@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Test load_data.ResumableBatchSampler subclasses: the state_dict round-trip
+resumes mid-epoch with exactly the remaining batches, epochs differ by seed and
+epoch, and epoch_lengths matches the batches actually produced.
+"""
+
+import torch
+
+from load_data import ShuffledBatchSampler, TokenBudgetBatchSampler
+
+NUM_EXAMPLES = 103
+
+
+def make_dataset():
+    generator = torch.Generator().manual_seed(0)
+    enc_lengths = torch.randint(20, 200, (NUM_EXAMPLES,), generator=generator).tolist()
+    dec_lengths = torch.randint(10, 120, (NUM_EXAMPLES,), generator=generator).tolist()
+    return [{'encoder_input': torch.ones(enc, dtype=torch.long), 'decoder_target': torch.ones(dec, dtype=torch.long)}
+            for enc, dec in zip(enc_lengths, dec_lengths)]
+
+
+def make_samplers(dataset, seed):
+    return {
+        'shuffled': lambda: ShuffledBatchSampler(dataset, batch_size=8, seed=seed),
+        'token_budget': lambda: TokenBudgetBatchSampler(dataset, max_tokens=2000, pool_size=32, seed=seed),
+    }
+
+
+def test_mid_epoch_resume():
+    """A sampler restored from state_dict(epoch, k) yields the rest of that epoch, then the next epoch"""
+    dataset = make_dataset()
+    for name, make in make_samplers(dataset, seed=1234).items():
+        reference = make()
+        epochs = []
+        for epoch in range(3):
+            reference.set_epoch(epoch)
+            epochs.append(list(reference))
+        for epoch in range(3):
+            for done in (0, 1, len(epochs[epoch]) // 2, len(epochs[epoch])):
+                interrupted = make()
+                interrupted.set_epoch(epoch)
+                state = interrupted.state_dict(epoch, done)
+
+                resumed = make()
+                resumed.load_state_dict(state)
+                resumed.set_epoch(epoch)  # the training loop does this before every epoch
+                assert len(resumed) == len(epochs[epoch]) - done, name
+                assert list(resumed) == epochs[epoch][done:], f"{name}: epoch {epoch} after {done} batches"
+                if epoch + 1 < len(epochs):
+                    resumed.set_epoch(epoch + 1)
+                    assert list(resumed) == epochs[epoch + 1], f"{name}: epoch {epoch + 1} after resume"
+
+
+def test_seed_and_epoch_change_order():
+    """Different epochs and different seeds give different orders; every example appears once"""
+    dataset = make_dataset()
+    for name, make in make_samplers(dataset, seed=1).items():
+        sampler = make()
+        first = list(sampler)
+        second = list(sampler)  # iterating advances to the next epoch
+        other_seed = list(make_samplers(dataset, seed=2)[name]())
+        assert first != second, f"{name}: epochs 0 and 1 share an order"
+        assert first != other_seed, f"{name}: seeds 1 and 2 share an order"
+        for batches in (first, second, other_seed):
+            assert sorted(i for batch in batches for i in batch) == list(range(NUM_EXAMPLES)), name
+
+
+def test_epoch_lengths():
+    """epoch_lengths (the LR schedule's step counts) equals the batches each epoch yields"""
+    dataset = make_dataset()
+    for name, make in make_samplers(dataset, seed=7).items():
+        planned = make().epoch_lengths(4)
+        sampler = make()
+        actual = []
+        for epoch in range(4):
+            sampler.set_epoch(epoch)
+            actual.append(len(list(sampler)))
+        assert planned == actual, f"{name}: planned {planned}, yielded {actual}"
+
+
+def main():
+    print("🧪 TESTING RESUMABLE BATCH SAMPLERS")
+    print("=" * 50)
+    print("1. Mid-epoch resume...")
+    test_mid_epoch_resume()
+    print("   ✅ Restored samplers continue with the exact remaining batches")
+    print("2. Seed and epoch...")
+    test_seed_and_epoch_change_order()
+    print("   ✅ Orders differ by seed and epoch")
+    print("3. Planned epoch lengths...")
+    test_epoch_lengths()
+    print("   ✅ epoch_lengths matches the batches yielded")
+    print("\n✅ RESUMABLE SAMPLER TESTS PASSED")
+
+
+if __name__ == "__main__":
+    main()
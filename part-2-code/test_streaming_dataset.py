@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Test how load_data.StreamingT5Dataset splits the stream between readers
+(DataLoader workers / ranks): parts are disjoint and cover every line, idx is a
+global line index, and __len__ / num_batches match what the readers yield.
+"""
+
+import os
+import tempfile
+
+from load_data import StreamingT5Dataset
+
+# Lines per shard; the last shard has no trailing newline
+SHARD_LINES = [5, 3, 4]
+
+
+def write_shards(folder):
+    shards, line = [], 0
+    for s, count in enumerate(SHARD_LINES):
+        nl_path = os.path.join(folder, f'train-{s:05d}.nl')
+        sql_path = os.path.join(folder, f'train-{s:05d}.sql')
+        nl = [f"question {line + i}" for i in range(count)]
+        sql = [f"SELECT {line + i}" for i in range(count)]
+        end = '' if s == len(SHARD_LINES) - 1 else '\n'
+        with open(nl_path, 'w') as f:
+            f.write('\n'.join(nl) + end)
+        with open(sql_path, 'w') as f:
+            f.write('\n'.join(sql) + end)
+        shards.append((nl_path, sql_path))
+        line += count
+    return shards
+
+
+def reader_parts(dataset, num_readers):
+    return [list(dataset._lines(reader, num_readers)) for reader in range(num_readers)]
+
+
+def test_readers_disjoint():
+    """By-shard (readers <= shards) and by-line splits are disjoint, complete and globally indexed"""
+    total = sum(SHARD_LINES)
+    with tempfile.TemporaryDirectory() as tmp:
+        dataset = StreamingT5Dataset(tmp, 'train', shards=write_shards(tmp))
+        for num_readers in (1, 2, 3, 4, 5):
+            parts = reader_parts(dataset, num_readers)
+            indices = [idx for part in parts for idx, _, _ in part]
+            assert len(indices) == len(set(indices)) == total, f"{num_readers} readers: overlap or gap"
+            assert sorted(indices) == list(range(total))
+            for part in parts:
+                for idx, nl, sql in part:
+                    # idx is the global line index, so it names the line's own content
+                    assert nl == f"question {idx}" and sql == f"SELECT {idx}", (num_readers, idx, nl, sql)
+
+
+def test_lengths():
+    """__len__ counts an unterminated last line; num_batches sums each reader's partial batches"""
+    with tempfile.TemporaryDirectory() as tmp:
+        dataset = StreamingT5Dataset(tmp, 'train', shards=write_shards(tmp))
+        assert len(dataset) == sum(SHARD_LINES), len(dataset)
+        for num_workers in (0, 1, 2, 3, 4):
+            for batch_size in (1, 2, 4):
+                parts = reader_parts(dataset, max(num_workers, 1))
+                expected = sum((len(part) + batch_size - 1) // batch_size for part in parts)
+                assert dataset.num_batches(batch_size, num_workers) == expected, (num_workers, batch_size)
+
+
+def main():
+    print("🧪 TESTING STREAMING DATASET SHARDING")
+    print("=" * 50)
+    print("1. Reader parts...")
+    test_readers_disjoint()
+    print("   ✅ Disjoint, complete, globally indexed")
+    print("2. Lengths and batch counts...")
+    test_lengths()
+    print("   ✅ __len__ and num_batches match the readers")
+    print("\n✅ STREAMING DATASET TESTS PASSED")
+
+
+if __name__ == "__main__":
+    main()
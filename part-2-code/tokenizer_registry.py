@@ -0,0 +1,68 @@
+"""
+Process-wide tokenizer singleton and offline mode.
+
+Every T5Dataset split, the training loop's dev evaluation and test inference used
+to call `from_pretrained` on their own, each costing a hub lookup and a parse of
+tokenizer.json. `get_tokenizer` loads each tokenizer once per process, and
+transformers is only imported on that first call, so importing the data modules
+stays cheap.
+
+Offline mode (`enable_offline_mode`, or HF_HUB_OFFLINE / TRANSFORMERS_OFFLINE set
+in the environment) loads tokenizers, configs and weights from the local cache
+only, and fails immediately instead of waiting on the network.
+"""
+
+import os
+from typing import Dict, Optional
+
+T5_MODEL_NAME = 'google-t5/t5-small'
+SQL_TOKENIZER_PATH = './sql_optimized_tokenizer'
+OFFLINE_ENV_VARS = ('HF_HUB_OFFLINE', 'TRANSFORMERS_OFFLINE', 'HF_DATASETS_OFFLINE')
+
+_TOKENIZERS: Dict[str, object] = {}
+
+
+def is_offline() -> bool:
+    return any(os.environ.get(var, '').lower() in ('1', 'true', 'yes') for var in OFFLINE_ENV_VARS)
+
+
+def enable_offline_mode():
+    """
+    Never touch the network: Hugging Face loads use the local cache only and wandb
+    logs offline. Call before the first `from_pretrained` (ideally before importing
+    transformers, which reads these variables at import time).
+    """
+    for var in OFFLINE_ENV_VARS:
+        os.environ[var] = '1'
+    os.environ['WANDB_MODE'] = 'offline'
+
+
+def pretrained_kwargs() -> Dict[str, bool]:
+    """Extra `from_pretrained` kwargs: local files only when offline."""
+    return {'local_files_only': True} if is_offline() else {}
+
+
+def from_pretrained(cls, name_or_path: str, **kwargs):
+    """`cls.from_pretrained` honoring offline mode, with a clear error when the files are not cached."""
+    try:
+        return cls.from_pretrained(name_or_path, **pretrained_kwargs(), **kwargs)
+    except OSError as e:
+        if is_offline():
+            raise OSError(f"Offline mode: {name_or_path} is not in the local Hugging Face cache "
+                          f"(download it once with network access)") from e
+        raise
+
+
+def get_tokenizer(name_or_path: str = T5_MODEL_NAME):
+    """Shared T5TokenizerFast for `name_or_path`, loaded on first use."""
+    if name_or_path not in _TOKENIZERS:
+        from transformers import T5TokenizerFast
+        _TOKENIZERS[name_or_path] = from_pretrained(T5TokenizerFast, name_or_path)
+    return _TOKENIZERS[name_or_path]
+
+
+def get_eval_tokenizer(sql_tokenizer_path: Optional[str] = SQL_TOKENIZER_PATH):
+    """Tokenizer used to decode predictions: the SQL-optimized one if present, otherwise T5's."""
+    if sql_tokenizer_path and os.path.exists(sql_tokenizer_path):
+        return get_tokenizer(sql_tokenizer_path)
+    return get_tokenizer()
@@ -1,15 +1,18 @@
 import os
 import argparse
+import random
 from tqdm import tqdm
 
 import torch
 import torch.nn as nn
 import numpy as np
-import wandb
 
 from t5_utils import initialize_model, initialize_optimizer_and_scheduler, save_model, load_model_from_checkpoint, setup_wandb
-from transformers import GenerationConfig, T5Tokenizer
+from t5_utils import load_training_checkpoint, autocast_context
+from t5_utils import quantize_model_dynamic, save_quantized_model
+from transformers import GenerationConfig
 from load_data import load_t5_data
+from tokenizer_registry import get_eval_tokenizer, enable_offline_mode, SQL_TOKENIZER_PATH
 from utils import compute_metrics, save_queries_and_records
 from eval_utils import eval_epoch as eval_epoch_util
 
@@ -42,12 +45,30 @@ def get_args():
 
     parser.add_argument('--use_wandb', action='store_true',
                         help="If set, we will use wandb to keep track of experiments")
+    parser.add_argument('--offline', action='store_true',
+                        help="Strict offline mode: load models/tokenizers from the local cache only, log wandb offline")
     parser.add_argument('--experiment_name', type=str, default='experiment',
                         help="How should we name this experiment?")
 
     # Data hyperparameters
     parser.add_argument('--batch_size', type=int, default=16)
     parser.add_argument('--test_batch_size', type=int, default=16)
+    parser.add_argument('--max_tokens_per_batch', type=int, default=0,
+                        help='If > 0, build training batches up to this many padded encoder+decoder tokens instead of --batch_size')
+    parser.add_argument('--pack_sequences', action='store_true',
+                        help='Pack each training batch into concatenated rows with block-diagonal attention masks (not with --max_tokens_per_batch)')
+    parser.add_argument('--stream_train_data', action='store_true',
+                        help='Stream and tokenize train.nl/train.sql (or train-*.nl/.sql shards) on the fly instead of loading them into memory')
+    parser.add_argument('--shuffle_buffer_size', type=int, default=10000,
+                        help='Examples held per worker for approximate shuffling with --stream_train_data')
+    parser.add_argument('--num_data_workers', type=int, default=0,
+                        help='DataLoader worker processes for --stream_train_data')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='Seed of the training data order (default: random; --resume reuses the checkpoint\'s)')
+    parser.add_argument('--sort_eval_by_length', action='store_true',
+                        help='Batch dev/test generation by encoder length (predictions keep file order)')
+    parser.add_argument('--sort_eval_by_output_length', action='store_true',
+                        help='Also sort dev/test batches by predicted output length')
 
     # Freezing options (for fine-tuning)
     parser.add_argument('--freeze_all_encoder_layers', action='store_true',
@@ -62,6 +83,14 @@ def get_args():
                         help='Freeze shared embeddings (and tied lm_head)')
 
     # Logging
+    parser.add_argument('--bf16', action='store_true',
+                        help='Run the training (and dev loss) forward pass and loss under bf16 autocast; weights and AdamW state stay fp32')
+    parser.add_argument('--bf16_generation', action='store_true',
+                        help='Generate dev/test predictions under bf16 autocast')
+    parser.add_argument('--checkpoint_every_n_steps', type=int, default=0,
+                        help='Also save latest_model.pt (with optimizer and data-order state) every N training steps')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue from latest_model.pt of this experiment, from the exact batch it stopped at')
     parser.add_argument('--log_every', type=int, default=200,
                         help='How many training steps between progress prints')
 
@@ -74,14 +103,99 @@ def get_args():
                         help='Maximum generation length for SQL queries')
     parser.add_argument('--rerank_by_execution', action='store_true',
                         help='Rerank candidates by executing them on the database')
+    parser.add_argument('--rerank_strategy', type=str, default='all', choices=['all', 'lazy'],
+                        help='all = execute every candidate; lazy = execute in beam order and stop at first success')
+    parser.add_argument('--rerank_window', type=int, default=1,
+                        help='Candidates executed speculatively in parallel per step for lazy reranking')
+    parser.add_argument('--schema_constrained', action='store_true',
+                        help='Mask decoder tokens that cannot extend a valid table/alias/column identifier')
+    parser.add_argument('--prune_invalid_beams', action='store_true',
+                        help='Drop beam hypotheses whose partial SQL can no longer become valid')
+    parser.add_argument('--speculative_decoding', action='store_true',
+                        help='Greedy decoding with drafts from train.sql n-grams (output identical to greedy)')
+    parser.add_argument('--stop_at_end_marker', action='store_true',
+                        help='Stop generating each sequence as soon as it emits the END marker')
+    parser.add_argument('--shared_encoder_eval', action='store_true',
+                        help='Encode each dev batch once and reuse it for both the dev loss and generation '
+                             '(generation re-encodes when --bf16 and --bf16_generation differ)')
+    parser.add_argument('--quantize_int8', action='store_true',
+                        help='Run test inference with a dynamically int8-quantized model on CPU (also saved to the run checkpoints)')
+    parser.add_argument('--backend', type=str, default='torch', choices=['torch', 'onnx'],
+                        help='Generation backend for test inference (onnx = onnxruntime on CPU, greedy only)')
+    parser.add_argument('--onnx_dir', type=str, default=None,
+                        help='Directory with exported ONNX graphs (default: <checkpoint_dir>/onnx, exported if missing or stale)')
+    parser.add_argument('--compile', action='store_true',
+                        help='Greedy generation with a compiled decoder step over a static KV cache')
+    parser.add_argument('--compile_backend', type=str, default='compile', choices=['compile', 'script'],
+                        help='compile = torch.compile (falls back to TorchScript); script = TorchScript trace')
+    parser.add_argument('--prediction_cache_dir', type=str, default=None,
+                        help='Reuse test predictions cached for the same weights, inputs and generation config')
+    parser.add_argument('--prune_schema', action='store_true',
+                        help='Put only the tables/columns linked to each question into the input (schema_linking)')
     parser.add_argument('--use_schema_enhancement', action='store_true',
                         help='Use enhanced input with database schema information and Answer: pattern')
     parser.add_argument('--eval_every_n_epochs', type=int, default=1,
                         help='Evaluate on dev set every N epochs (default: 1 = every epoch)')
 
     args = parser.parse_args()
+    if args.pack_sequences and args.max_tokens_per_batch:
+        parser.error("--pack_sequences cannot be combined with --max_tokens_per_batch")
+    # OnnxT5Generator is greedy-only; fail here rather than after training, at test inference
+    if args.backend == 'onnx':
+        unsupported = [flag for flag, enabled in (('--num_beams > 1', args.num_beams > 1),
+                                                  ('--rerank_by_execution', args.rerank_by_execution),
+                                                  ('--schema_constrained', args.schema_constrained),
+                                                  ('--prune_invalid_beams', args.prune_invalid_beams)) if enabled]
+        if unsupported:
+            parser.error(f"--backend onnx only supports greedy decoding; drop {', '.join(unsupported)}")
+        if args.quantize_int8:
+            parser.error("--backend onnx exports the fp32 checkpoint; drop --quantize_int8")
     return args
 
+def get_generation_model(args, model):
+    '''
+    Model to hand to eval_utils.eval_epoch: the compiled static-cache generator with --compile,
+    otherwise the model itself.
+    '''
+    if not getattr(args, 'compile', False) or not isinstance(model, nn.Module):
+        return model
+    from compiled_inference import get_compiled_generator
+    return get_compiled_generator(model, max_length=getattr(args, 'max_gen_length', 256),
+                                  backend=getattr(args, 'compile_backend', 'compile'),
+                                  warmup_batch_sizes=[args.test_batch_size])
+
+def resolve_data_seed(args):
+    '''
+    Seed of the training batch order: --seed, otherwise a random one. A resumed run
+    takes the seed stored in its checkpoint so it replays the same batch plans.
+    '''
+    if getattr(args, 'resume', False):
+        model_type = 'ft' if args.finetune else 'scr'
+        checkpoint = load_training_checkpoint(
+            os.path.join('runs', f'{model_type}_experiments', args.experiment_name, 'checkpoints'))
+        if checkpoint is not None:
+            state = checkpoint['training_state']
+            seed = state.get('seed', (state.get('sampler') or {}).get('seed'))
+            if seed is not None:
+                if args.seed is not None and args.seed != seed:
+                    print(f"Ignoring --seed {args.seed}: resuming with the checkpoint's data seed {seed}")
+                return seed
+    return args.seed if args.seed is not None else random.randrange(2 ** 31)
+
+def planned_epoch_lengths(args, train_loader):
+    '''
+    Optimizer steps of every epoch, for the LR schedule. Token-budget batch counts
+    differ between epochs, so the epoch-0 length does not give the total.
+    '''
+    batch_sampler = getattr(train_loader, 'batch_sampler', None)
+    num_epochs = max(args.max_n_epochs, args.num_warmup_epochs)
+    if hasattr(batch_sampler, 'epoch_lengths'):
+        return batch_sampler.epoch_lengths(num_epochs)
+    if hasattr(train_loader.dataset, 'num_batches'):
+        # Streaming: each worker yields its own partial last batch, beyond len(train_loader)
+        return [train_loader.dataset.num_batches(train_loader.batch_size, train_loader.num_workers)] * num_epochs
+    return [len(train_loader)] * num_epochs
+
 def train(args, model, train_loader, dev_loader, optimizer, scheduler):
     best_f1 = -1
     epochs_since_improvement = 0
@@ -129,12 +243,68 @@ def train(args, model, train_loader, dev_loader, optimizer, scheduler):
             pickle.dump((gt_recs, gt_errs), f)
         err_count = sum(1 for e in gt_errs if e)
         print(f"Saved GT records to {gt_record_path} (errors: {err_count}/{len(gt_errs)})")
-    for epoch in range(args.max_n_epochs):
+
+    # Seeded batch samplers (load_data.ResumableBatchSampler) can restart mid-epoch
+    batch_sampler = getattr(train_loader, 'batch_sampler', None)
+    resumable = hasattr(batch_sampler, 'load_state_dict')
+    num_training_steps = sum(planned_epoch_lengths(args, train_loader)[:args.max_n_epochs])
+
+    def training_state(epoch, step):
+        '''Everything needed to continue after `step` batches of `epoch`.'''
+        return {
+            'epoch': epoch,
+            'step': step,
+            'sampler': batch_sampler.state_dict(epoch, step) if resumable else None,
+            'optimizer': optimizer.state_dict(),
+            'scheduler': scheduler.state_dict() if scheduler is not None else None,
+            'num_training_steps': num_training_steps,
+            'seed': getattr(args, 'seed', None),
+            'rng_state': torch.get_rng_state(),
+            'cuda_rng_state': torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None,
+            'best_f1': best_f1,
+            'epochs_since_improvement': epochs_since_improvement,
+        }
+
+    start_epoch, start_step = 0, 0
+    if getattr(args, 'resume', False):
+        checkpoint = load_training_checkpoint(ckpt_dir)
+        if checkpoint is None:
+            print(f"No resumable checkpoint in {ckpt_dir}; starting from scratch")
+        else:
+            state = checkpoint['training_state']
+            if state.get('num_training_steps', num_training_steps) != num_training_steps:
+                raise ValueError(f"Cannot resume: the checkpoint's LR schedule spans {state['num_training_steps']} "
+                                 f"steps, this run plans {num_training_steps} (changed epochs or batching?)")
+            model.load_state_dict(checkpoint['model_state_dict'])
+            optimizer.load_state_dict(state['optimizer'])
+            if scheduler is not None and state['scheduler'] is not None:
+                scheduler.load_state_dict(state['scheduler'])
+            torch.set_rng_state(state['rng_state'])
+            if state['cuda_rng_state'] is not None and torch.cuda.is_available():
+                torch.cuda.set_rng_state_all(state['cuda_rng_state'])
+            best_f1, epochs_since_improvement = state['best_f1'], state['epochs_since_improvement']
+            start_epoch, start_step = state['epoch'], state['step']
+            if resumable and state['sampler'] is not None:
+                batch_sampler.load_state_dict(state['sampler'])
+            elif start_step:
+                print("Train data order is not resumable (streaming); restarting the epoch")
+                start_step = 0
+            print(f"Resumed from {ckpt_dir} at epoch {start_epoch}, batch {start_step}")
+
+    for epoch in range(start_epoch, args.max_n_epochs):
         # Report LR at epoch start
         current_lr = optimizer.param_groups[0]['lr'] if optimizer.param_groups else -1
         print(f"Epoch {epoch}: starting, learning rate={current_lr:.6f}")
-
-        tr_loss = train_epoch(args, model, train_loader, optimizer, scheduler)
+        if resumable:
+            batch_sampler.set_epoch(epoch)
+        if hasattr(train_loader.dataset, 'set_epoch'):
+            # Streaming data: reseed the shuffle buffers for this epoch
+            train_loader.dataset.set_epoch(epoch)
+
+        tr_loss = train_epoch(args, model, train_loader, optimizer, scheduler,
+                              start_step=start_step if epoch == start_epoch else 0,
+                              checkpoint_fn=lambda step: save_model(args.checkpoint_dir, model, best=False,
+                                                                    training_state=training_state(epoch, step)))
         print(f"Epoch {epoch}: Average train loss was {tr_loss}")
 
         # Evaluate based on user-specified frequency (or on the last epoch)
@@ -166,6 +336,7 @@ def train(args, model, train_loader, dev_loader, optimizer, scheduler):
                     'dev/sql_em' : sql_em,
                     'dev/error_rate' : error_rate,
                 })
+            import wandb
             wandb.log(result_dict, step=epoch)
             
             # Only save artifacts when we actually evaluated
@@ -197,7 +368,7 @@ def train(args, model, train_loader, dev_loader, optimizer, scheduler):
             # Don't count skipped evaluations toward patience
             print(f"Epoch {epoch}: Skipped evaluation, patience counter unchanged ({epochs_since_improvement})")
 
-        save_model(args.checkpoint_dir, model, best=False)
+        save_model(args.checkpoint_dir, model, best=False, training_state=training_state(epoch + 1, 0))
         if should_evaluate and epochs_since_improvement == 0:
             save_model(args.checkpoint_dir, model, best=True)
 
@@ -206,30 +377,47 @@ def train(args, model, train_loader, dev_loader, optimizer, scheduler):
             print(f"Early stopping: no improvement for {args.patience_epochs} evaluations")
             break
 
-def train_epoch(args, model, train_loader, optimizer, scheduler):
+def train_epoch(args, model, train_loader, optimizer, scheduler, start_step=0, checkpoint_fn=None):
+    '''
+    One pass over train_loader. `start_step` is the number of batches of this epoch
+    already trained before a resume (the sampler skips them); `checkpoint_fn(step)`
+    is called every args.checkpoint_every_n_steps steps.
+    '''
     model.train()
     total_loss = 0
     total_tokens = 0
     criterion = nn.CrossEntropyLoss()
-    step = 0
+    step = start_step
+    checkpoint_every = getattr(args, 'checkpoint_every_n_steps', 0)
     running_loss = 0.0
     running_tokens = 0
 
-    for encoder_input, encoder_mask, decoder_input, decoder_targets, _ in tqdm(train_loader):
+    packed = getattr(args, 'pack_sequences', False)
+    if packed:
+        from sequence_packing import packed_forward
+    bf16 = getattr(args, 'bf16', False)
+
+    for encoder_input, encoder_mask, decoder_input, decoder_targets, decoder_segments in tqdm(train_loader):
         optimizer.zero_grad()
         encoder_input = encoder_input.to(DEVICE)
         encoder_mask = encoder_mask.to(DEVICE)
         decoder_input = decoder_input.to(DEVICE)
         decoder_targets = decoder_targets.to(DEVICE)
 
-        logits = model(
-            input_ids=encoder_input,
-            attention_mask=encoder_mask,
-            decoder_input_ids=decoder_input,
-        )['logits']
+        with autocast_context(bf16):
+            if packed:
+                # encoder_mask holds segment ids in packed batches
+                logits = packed_forward(model, encoder_input, encoder_mask, decoder_input, decoder_segments.to(DEVICE))
+            else:
+                logits = model(
+                    input_ids=encoder_input,
+                    attention_mask=encoder_mask,
+                    decoder_input_ids=decoder_input,
+                )['logits']
 
-        non_pad = decoder_targets != PAD_IDX
-        loss = criterion(logits[non_pad], decoder_targets[non_pad])
+            non_pad = decoder_targets != PAD_IDX
+            # Softmax/CE in fp32 (no-op without autocast)
+            loss = criterion(logits[non_pad].float(), decoder_targets[non_pad])
         loss.backward()
         optimizer.step()
         if scheduler is not None: 
@@ -249,7 +437,10 @@ def train_epoch(args, model, train_loader, optimizer, scheduler):
                 running_loss = 0.0
                 running_tokens = 0
 
-    return total_loss / total_tokens
+        if checkpoint_fn is not None and checkpoint_every > 0 and step % checkpoint_every == 0:
+            checkpoint_fn(step)
+
+    return total_loss / total_tokens if total_tokens > 0 else 0.0
         
 def eval_epoch(args, model, dev_loader, gt_sql_pth, model_sql_path, gt_record_path, model_record_path):
     '''
@@ -257,53 +448,62 @@ def eval_epoch(args, model, dev_loader, gt_sql_pth, model_sql_path, gt_record_pa
     Returns: avg_loss, record_f1, record_em, sql_em, error_rate
     '''
     model.eval()
+    shared_encoder = getattr(args, 'shared_encoder_eval', False)
 
-    # 1) Compute CE loss on dev
+    # 1) Compute CE loss on dev (in the generation pass below when sharing encoder outputs)
     total_loss = 0.0
     total_tokens = 0
     criterion = nn.CrossEntropyLoss()
-    with torch.no_grad():
-        for encoder_input, encoder_mask, decoder_input, decoder_targets, _ in tqdm(dev_loader, desc="Eval loss"):
-            encoder_input = encoder_input.to(DEVICE)
-            encoder_mask = encoder_mask.to(DEVICE)
-            decoder_input = decoder_input.to(DEVICE)
-            decoder_targets = decoder_targets.to(DEVICE)
-
-            logits = model(
-                input_ids=encoder_input,
-                attention_mask=encoder_mask,
-                decoder_input_ids=decoder_input,
-            )["logits"]
-
-            non_pad = decoder_targets != PAD_IDX
-            loss = criterion(logits[non_pad], decoder_targets[non_pad])
-            num_tokens = torch.sum(non_pad).item()
-            total_loss += loss.item() * num_tokens
-            total_tokens += num_tokens
+    if not shared_encoder:
+        with torch.no_grad(), autocast_context(getattr(args, 'bf16', False)):
+            for encoder_input, encoder_mask, decoder_input, decoder_targets, _ in tqdm(dev_loader, desc="Eval loss"):
+                encoder_input = encoder_input.to(DEVICE)
+                encoder_mask = encoder_mask.to(DEVICE)
+                decoder_input = decoder_input.to(DEVICE)
+                decoder_targets = decoder_targets.to(DEVICE)
+
+                logits = model(
+                    input_ids=encoder_input,
+                    attention_mask=encoder_mask,
+                    decoder_input_ids=decoder_input,
+                )["logits"]
+
+                non_pad = decoder_targets != PAD_IDX
+                loss = criterion(logits[non_pad].float(), decoder_targets[non_pad])
+                num_tokens = torch.sum(non_pad).item()
+                total_loss += loss.item() * num_tokens
+                total_tokens += num_tokens
 
     avg_loss = (total_loss / total_tokens) if total_tokens > 0 else 0.0
 
     # 2) Use eval_utils to generate predictions; then save and score with provided scripts
-    # Use SQL-optimized tokenizer if available, otherwise default
-    from transformers import T5TokenizerFast
-    sql_tokenizer_path = "./sql_optimized_tokenizer"
-    if os.path.exists(sql_tokenizer_path):
-        print("🚀 Using SQL-optimized tokenizer for evaluation")
-        tokenizer = T5TokenizerFast.from_pretrained(sql_tokenizer_path)
+    # Use SQL-optimized tokenizer if available, otherwise default (shared, loaded once per process)
+    tokenizer = get_eval_tokenizer()
+    with autocast_context(getattr(args, 'bf16_generation', False)):
+        util_outputs = eval_epoch_util(
+            model=get_generation_model(args, model),
+            dataloader=dev_loader,
+            tokenizer=tokenizer,
+            device=DEVICE,
+            generation_max_length=getattr(args, 'max_gen_length', 256),
+            num_beams=getattr(args, 'num_beams', 1),
+            num_candidates=getattr(args, 'num_candidates', 4) if getattr(args, 'rerank_by_execution', False) else 1,
+            rerank_by_execution=getattr(args, 'rerank_by_execution', False),
+            return_predictions=True,
+            rerank_strategy=getattr(args, 'rerank_strategy', 'all'),
+            rerank_window=getattr(args, 'rerank_window', 1),
+            schema_constrained=getattr(args, 'schema_constrained', False),
+            prune_invalid_beams=getattr(args, 'prune_invalid_beams', False),
+            speculative_decoding=getattr(args, 'speculative_decoding', False),
+            stop_at_end_marker=getattr(args, 'stop_at_end_marker', False),
+            compute_loss=shared_encoder,
+            # Same precision as the unshared dev loss above, whatever --bf16_generation says
+            loss_bf16=getattr(args, 'bf16', False),
+        )
+    if shared_encoder:
+        f1_from_util, predictions, avg_loss = util_outputs
     else:
-        print("📊 Using default tokenizer for evaluation")
-        tokenizer = T5Tokenizer.from_pretrained('google-t5/t5-small')
-    f1_from_util, predictions = eval_epoch_util(
-        model=model,
-        dataloader=dev_loader,
-        tokenizer=tokenizer,
-        device=DEVICE,
-        generation_max_length=getattr(args, 'max_gen_length', 256),
-        num_beams=getattr(args, 'num_beams', 1),
-        num_candidates=getattr(args, 'num_candidates', 4) if getattr(args, 'rerank_by_execution', False) else 1,
-        rerank_by_execution=getattr(args, 'rerank_by_execution', False),
-        return_predictions=True,
-    )
+        f1_from_util, predictions = util_outputs
 
     # Save queries to disk and compute records for downstream metrics
     save_queries_and_records(predictions, model_sql_path, model_record_path)
@@ -320,6 +520,7 @@ def eval_epoch(args, model, dev_loader, gt_sql_pth, model_sql_path, gt_record_pa
     if getattr(args, 'use_wandb', False):
         try:
             import random
+            import wandb
             # Load NL and GT SQL for the dev set (order-aligned with predictions)
             from load_data import load_lines
             dev_nl = load_lines(os.path.join('data', 'dev.nl'))
@@ -352,27 +553,37 @@ def test_inference(args, model, test_loader, model_sql_path, model_record_path):
     model.eval()
     
     # Use SQL-optimized tokenizer if available, otherwise default
-    from transformers import T5TokenizerFast
-    sql_tokenizer_path = "./sql_optimized_tokenizer"
-    if os.path.exists(sql_tokenizer_path):
+    if os.path.exists(SQL_TOKENIZER_PATH):
         print("🚀 Using SQL-optimized tokenizer for test inference")
-        tokenizer = T5TokenizerFast.from_pretrained(sql_tokenizer_path)
     else:
         print("📊 Using default tokenizer for test inference")
-        tokenizer = T5Tokenizer.from_pretrained('google-t5/t5-small')
+    tokenizer = get_eval_tokenizer()
+
+    # Quantized int8 kernels and the onnxruntime backend only run on CPU
+    on_cpu = getattr(args, 'quantize_int8', False) or getattr(args, 'backend', 'torch') == 'onnx'
+    device = torch.device('cpu') if on_cpu else DEVICE
 
     # Generate only; F1 will be None since no targets in test loader
-    _, predictions = eval_epoch_util(
-        model=model,
-        dataloader=test_loader,
-        tokenizer=tokenizer,
-        device=DEVICE,
-        generation_max_length=getattr(args, 'max_gen_length', 256),
-        num_beams=getattr(args, 'num_beams', 1),
-        num_candidates=getattr(args, 'num_candidates', 4) if getattr(args, 'rerank_by_execution', False) else 1,
-        rerank_by_execution=getattr(args, 'rerank_by_execution', False),
-        return_predictions=True,
-    )
+    # (bf16 autocast does not apply to the int8 / onnxruntime backends)
+    with autocast_context(getattr(args, 'bf16_generation', False) and not on_cpu, device):
+        _, predictions = eval_epoch_util(
+            model=get_generation_model(args, model),
+            dataloader=test_loader,
+            tokenizer=tokenizer,
+            device=device,
+            generation_max_length=getattr(args, 'max_gen_length', 256),
+            num_beams=getattr(args, 'num_beams', 1),
+            num_candidates=getattr(args, 'num_candidates', 4) if getattr(args, 'rerank_by_execution', False) else 1,
+            rerank_by_execution=getattr(args, 'rerank_by_execution', False),
+            return_predictions=True,
+            rerank_strategy=getattr(args, 'rerank_strategy', 'all'),
+            rerank_window=getattr(args, 'rerank_window', 1),
+            schema_constrained=getattr(args, 'schema_constrained', False),
+            prune_invalid_beams=getattr(args, 'prune_invalid_beams', False),
+            speculative_decoding=getattr(args, 'speculative_decoding', False),
+            stop_at_end_marker=getattr(args, 'stop_at_end_marker', False),
+            prediction_cache_dir=getattr(args, 'prediction_cache_dir', None),
+        )
 
     # Save SQL and execute to records for submission
     save_queries_and_records(predictions, model_sql_path, model_record_path)
@@ -400,14 +611,28 @@ def test_inference(args, model, test_loader, model_sql_path, model_record_path):
 def main():
     # Get key arguments
     args = get_args()
+    if args.offline:
+        enable_offline_mode()
+    # Before wandb setup so the run config records it
+    args.seed = resolve_data_seed(args)
+    print(f"Training data seed: {args.seed}")
     if args.use_wandb:
         # Recommended: Using wandb (or tensorboard) for result logging can make experimentation easier
         setup_wandb(args)
 
     # Load the data and the model
-    train_loader, dev_loader, test_loader = load_t5_data(args.batch_size, args.test_batch_size)
+    train_loader, dev_loader, test_loader = load_t5_data(args.batch_size, args.test_batch_size,
+                                                         args.sort_eval_by_length, args.sort_eval_by_output_length,
+                                                         max_tokens=args.max_tokens_per_batch or None,
+                                                         pack_sequences=args.pack_sequences,
+                                                         prune_schema=args.prune_schema,
+                                                         streaming=args.stream_train_data,
+                                                         shuffle_buffer_size=args.shuffle_buffer_size,
+                                                         num_workers=args.num_data_workers,
+                                                         seed=args.seed)
     model = initialize_model(args)
-    optimizer, scheduler = initialize_optimizer_and_scheduler(args, model, len(train_loader))
+    optimizer, scheduler = initialize_optimizer_and_scheduler(args, model, len(train_loader),
+                                                              planned_epoch_lengths(args, train_loader))
 
     # Train 
     train(args, model, train_loader, dev_loader, optimizer, scheduler)
@@ -428,6 +653,17 @@ def main():
     # Ensure subsequent loads know where to look
     args.checkpoint_dir = ckpt_dir
 
+    if args.quantize_int8:
+        model = quantize_model_dynamic(model)
+        save_quantized_model(ckpt_dir, model, best=True)
+
+    if args.backend == 'onnx':
+        from onnx_backend import export_onnx_if_stale, OnnxT5Generator
+        onnx_dir = args.onnx_dir or os.path.join(ckpt_dir, 'onnx')
+        # Graphs left over from an earlier run of this experiment are re-exported
+        export_onnx_if_stale(model, onnx_dir)
+        model = OnnxT5Generator(onnx_dir)
+
     # Dev evaluation is already done during training, no need to repeat
 
     # Test set